@@ -0,0 +1,257 @@
+import spinedb_api as api
+from spinedb_api import DatabaseMapping
+from pathlib import Path
+import sys
+import os
+import json
+import datetime
+import shutil
+import subprocess
+import time
+from sys import exit
+import yaml
+
+# Generates synthetic OSeMOSYS Spine databases of different sizes, converts each with osemosys_to_ines.py
+# and collects the stage profiles (time, source queries, added items, peak memory) into one result file.
+# usage: python benchmark_osemosys_to_ines.py settings.yaml output_folder [scale names]
+
+scales = {
+    "tiny": {"regions": 1, "technologies": 10, "fuels": 3, "storages": 1, "years": 3, "timeslices": 4, "alternatives": 1},
+    "small": {"regions": 2, "technologies": 30, "fuels": 6, "storages": 2, "years": 10, "timeslices": 12, "alternatives": 2},
+    "medium": {"regions": 5, "technologies": 80, "fuels": 12, "storages": 4, "years": 20, "timeslices": 48, "alternatives": 2},
+    "large": {"regions": 10, "technologies": 150, "fuels": 20, "storages": 8, "years": 30, "timeslices": 96, "alternatives": 3},
+}
+
+# Sets that are not parameter dimensions in the OSeMOSYS data, read_osemosys.py turns them into indexes of the parameter maps
+dimens_to_param = ["SEASON", "DAYTYPE", "DAILYTIMEBRACKET", "TIMESLICE", "MODE_OF_OPERATION", "YEAR"]
+emissions = ["CO2", "NOX", "SO2"]
+default_values = {"DiscountRate": 0.05, "DiscountRateStorage": 0.05, "OperationalLife": 1.0, "CapacityToActivityUnit": 1.0,
+                  "StorageLevelStart": 0.0, "ResidualCapacity": 0.0, "CapitalCost": 0.0, "FixedCost": 0.0, "VariableCost": 0.0}
+
+
+def main(settings_file, output_folder, scale_names):
+    osemosys_to_ines_folder = Path(__file__).parent
+    param_dimens_file = osemosys_to_ines_folder.parent / "param_dimens.yaml"
+    with open(param_dimens_file, 'r') as file:
+        param_dimens = yaml.safe_load(file)
+    with open(settings_file, 'r') as file:
+        # The generated data is in the default alternative of the conversion, like the example data
+        default_alternative = yaml.safe_load(file)["default_alternative"]
+    results = []
+    for scale_name in scale_names:
+        scale = scales[scale_name]
+        scale_folder = Path(output_folder) / scale_name
+        scale_folder.mkdir(parents=True, exist_ok=True)
+        source_file = scale_folder / "osemosys_source.sqlite"
+        target_file = scale_folder / "ines_target.sqlite"
+        timeslice_csv = scale_folder / "timeslices_to_time.csv"
+        profile_json = scale_folder / "profile.json"
+        for file in (source_file, target_file, profile_json):
+            if file.exists():
+                file.unlink()
+        print("Generating the " + scale_name + " database")
+        create_source_db("sqlite:///" + str(source_file), param_dimens, scale, default_alternative)
+        write_timeslice_csv(timeslice_csv, scale["timeslices"])
+        # The conversion writes to an ines database, start from the empty ines-spec
+        shutil.copy(osemosys_to_ines_folder.parent / "ines-spec.sqlite", target_file)
+        print("Converting the " + scale_name + " database")
+        environment = dict(os.environ, OSEMOSYS_TO_INES_PROFILE=str(profile_json))
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, str(osemosys_to_ines_folder / "osemosys_to_ines.py"),
+                                    "sqlite:///" + str(source_file), "sqlite:///" + str(target_file),
+                                    str(Path(settings_file).resolve()), str(timeslice_csv)],
+                                   cwd=osemosys_to_ines_folder, env=environment)
+        seconds = round(time.perf_counter() - start, 3)
+        result = {"scale": scale_name, **scale, "seconds": seconds, "returncode": completed.returncode}
+        if completed.returncode != 0:
+            print(f"The conversion of {scale_name} failed with return code {completed.returncode}")
+        if profile_json.exists():
+            with open(profile_json, 'r') as file:
+                result["stages"] = json.load(file)["stages"]
+        else:
+            print("No stage profile for " + scale_name)
+        results.append(result)
+    with open(Path(output_folder) / "benchmark_results.json", 'w') as file:
+        json.dump(results, file, indent=2)
+    print_summary(results)
+
+
+def create_source_db(url, param_dimens, scale, default_alternative):
+    # Same entity classes and parameter layout as read_osemosys.py: one entity class per set and per combination
+    # of parameter dimensions, the YEAR, TIMESLICE and MODE_OF_OPERATION dimensions are map indexes of the values.
+    regions = [f"R{i}" for i in range(scale["regions"])]
+    technologies = [f"TECH{i}" for i in range(scale["technologies"])]
+    fuels = [f"FUEL{i}" for i in range(scale["fuels"])]
+    storages = [f"STO{i}" for i in range(scale["storages"])]
+    years = [str(2025 + i) for i in range(scale["years"])]
+    timeslices = [f"S{i}" for i in range(scale["timeslices"])]
+    alternatives = [default_alternative] + [f"alternative_{i}" for i in range(1, scale["alternatives"])]
+    modes = ["1"]
+
+    def year_map(value):
+        return api.Map(years, [float(value)] * len(years))
+
+    def mode_year_map(value):
+        return api.Map(modes, [year_map(value)])
+
+    def timeslice_year_map(values):
+        return api.Map(timeslices, [year_map(value) for value in values])
+
+    with DatabaseMapping(url, create=True) as db:
+        # A new database has the Base alternative
+        base_alternative = db.get_alternative_item(name="Base")
+        if base_alternative and default_alternative != "Base":
+            db.update_alternative_item(id=base_alternative["id"], name=default_alternative)
+        for alternative in alternatives[1:]:
+            db.add_alternative_item(name=alternative)
+        db.add_scenario_item(name="base")
+        for rank, alternative in enumerate(alternatives):
+            db.add_scenario_alternative_item(scenario_name="base", alternative_name=alternative, rank=rank + 1)
+        for set_name in ["REGION", "TECHNOLOGY", "FUEL", "EMISSION", "STORAGE", "model"] + dimens_to_param:
+            db.add_entity_class_item(name=set_name)
+        for param_name, (dimens, indexes, _) in param_dimens.items():
+            class_name = "__".join(dimens)
+            if not db.get_entity_class_item(name=class_name):
+                db.add_entity_class_item(name=class_name, dimension_name_list=tuple(dimens))
+            if param_name in default_values:
+                default_value, default_type = api.to_database(default_values[param_name])
+                db.add_parameter_definition_item(entity_class_name=class_name, name=param_name,
+                                                 default_value=default_value, default_type=default_type)
+            else:
+                db.add_parameter_definition_item(entity_class_name=class_name, name=param_name)
+
+        def add_entity(class_name, entity_byname, active=False):
+            if len(entity_byname) == 1:
+                db.add_entity_item(entity_class_name=class_name, name=entity_byname[0])
+            else:
+                db.add_entity_item(entity_class_name=class_name, entity_byname=entity_byname)
+            if active:
+                db.add_entity_alternative_item(entity_class_name=class_name, entity_byname=entity_byname,
+                                               alternative_name=default_alternative, active=True)
+
+        def add_value(class_name, entity_byname, param_name, value, alternative=default_alternative):
+            p_value, p_type = api.to_database(value)
+            db.add_parameter_value_item(entity_class_name=class_name, entity_byname=entity_byname, parameter_definition_name=param_name,
+                                        alternative_name=alternative, value=p_value, type=p_type)
+
+        add_entity("model", ("OSeMOSYS",), active=True)
+        add_value("model", ("OSeMOSYS",), "YearSplit", timeslice_year_map([1.0 / len(timeslices)] * len(timeslices)))
+        for year in years:
+            add_entity("YEAR", (year,), active=True)
+        for timeslice in timeslices:
+            add_entity("TIMESLICE", (timeslice,))
+        for mode in modes:
+            add_entity("MODE_OF_OPERATION", (mode,))
+        for technology in technologies:
+            add_entity("TECHNOLOGY", (technology,), active=True)
+        for entity_class, names in (("REGION", regions), ("FUEL", fuels), ("EMISSION", emissions), ("STORAGE", storages)):
+            for name in names:
+                add_entity(entity_class, (name,))
+
+        for r, region in enumerate(regions):
+            add_value("REGION", (region,), "DiscountRate", 0.05 + 0.01 * r)
+            add_value("REGION", (region,), "REMinProductionTarget", year_map(0.2))
+            for f, fuel in enumerate(fuels):
+                add_entity("REGION__FUEL", (region, fuel))
+                if f % 4 == 3:
+                    add_value("REGION__FUEL", (region, fuel), "AccumulatedAnnualDemand", year_map(5.0 + f))
+                else:
+                    add_value("REGION__FUEL", (region, fuel), "SpecifiedAnnualDemand", year_map(10.0 + f))
+                    add_value("REGION__FUEL", (region, fuel), "SpecifiedDemandProfile",
+                              timeslice_year_map([1.0 / len(timeslices)] * len(timeslices)))
+                    add_value("REGION__FUEL", (region, fuel), "RETagFuel", year_map(1.0))
+            for t, technology in enumerate(technologies):
+                # Technologies cycle through outputs, every third one is a pure source without an input fuel
+                output_fuel = fuels[t % len(fuels)]
+                input_fuel = fuels[(t + 1) % len(fuels)] if t % 3 else None
+                add_entity("REGION__TECHNOLOGY", (region, technology))
+                add_entity("REGION__TECHNOLOGY__FUEL", (region, technology, output_fuel))
+                add_value("REGION__TECHNOLOGY__FUEL", (region, technology, output_fuel), "OutputActivityRatio", mode_year_map(1.0))
+                if input_fuel and input_fuel != output_fuel:
+                    add_entity("REGION__TECHNOLOGY__FUEL", (region, technology, input_fuel))
+                    add_value("REGION__TECHNOLOGY__FUEL", (region, technology, input_fuel), "InputActivityRatio", mode_year_map(2.0 + 0.01 * t))
+                add_value("REGION__TECHNOLOGY", (region, technology), "CapitalCost", year_map(1000.0 + t))
+                add_value("REGION__TECHNOLOGY", (region, technology), "FixedCost", year_map(10.0 + t))
+                add_value("REGION__TECHNOLOGY", (region, technology), "VariableCost", mode_year_map(1.0 + 0.1 * t))
+                add_value("REGION__TECHNOLOGY", (region, technology), "OperationalLife", 20.0 + t % 20)
+                add_value("REGION__TECHNOLOGY", (region, technology), "ResidualCapacity", year_map(1.0 + t % 5))
+                for alternative in alternatives[1:]:
+                    add_value("REGION__TECHNOLOGY", (region, technology), "CapitalCost", year_map(900.0 + t), alternative)
+                if t % 2:
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalAnnualMaxCapacity", year_map(100.0))
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalAnnualMaxCapacityInvestment", year_map(10.0))
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalTechnologyAnnualActivityUpperLimit", year_map(500.0))
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalTechnologyModelPeriodActivityLowerLimit", 7.0)
+                    add_value("REGION__TECHNOLOGY", (region, technology), "RETagTechnology", year_map(1.0))
+                else:
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalAnnualMinCapacityInvestment", year_map(0.5))
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalTechnologyAnnualActivityLowerLimit", year_map(1.0))
+                    add_value("REGION__TECHNOLOGY", (region, technology), "TotalTechnologyModelPeriodActivityUpperLimit", 700.0)
+                    add_value("REGION__TECHNOLOGY", (region, technology), "CapacityToActivityUnit", 31.536)
+                if t % 3 == 0:
+                    add_value("REGION__TECHNOLOGY", (region, technology), "CapacityFactor",
+                              timeslice_year_map([0.2 + 0.6 * s / len(timeslices) for s in range(len(timeslices))]))
+                if t % 4 == 0:
+                    for emission in emissions:
+                        add_entity("REGION__TECHNOLOGY__EMISSION", (region, technology, emission))
+                        add_value("REGION__TECHNOLOGY__EMISSION", (region, technology, emission), "EmissionActivityRatio", mode_year_map(0.1))
+            for emission in emissions:
+                add_entity("REGION__EMISSION", (region, emission))
+                add_value("REGION__EMISSION", (region, emission), "EmissionsPenalty", year_map(20.0))
+                add_value("REGION__EMISSION", (region, emission), "AnnualEmissionLimit", year_map(1000.0))
+                add_value("REGION__EMISSION", (region, emission), "AnnualExogenousEmission", year_map(1.0))
+                add_value("REGION__EMISSION", (region, emission), "ModelPeriodEmissionLimit", 10000.0)
+                add_value("REGION__EMISSION", (region, emission), "ModelPeriodExogenousEmission", 10.0)
+            for s, storage in enumerate(storages):
+                add_entity("REGION__STORAGE", (region, storage))
+                add_value("REGION__STORAGE", (region, storage), "ResidualStorageCapacity", year_map(4.0))
+                add_value("REGION__STORAGE", (region, storage), "StorageLevelStart", 1.0)
+                add_value("REGION__STORAGE", (region, storage), "CapitalCostStorage", year_map(30.0))
+                add_value("REGION__STORAGE", (region, storage), "MinStorageCharge", year_map(0.1))
+                add_value("REGION__STORAGE", (region, storage), "StorageMaxChargeRate", 2.0)
+                add_value("REGION__STORAGE", (region, storage), "StorageMaxDischargeRate", 3.0)
+                # Each storage is charged and discharged by its own technology
+                technology = technologies[s % len(technologies)]
+                add_entity("REGION__TECHNOLOGY__STORAGE", (region, technology, storage))
+                add_value("REGION__TECHNOLOGY__STORAGE", (region, technology, storage), "TechnologyToStorage", api.Map(modes, [1.0]))
+                add_value("REGION__TECHNOLOGY__STORAGE", (region, technology, storage), "TechnologyFromStorage", api.Map(modes, [1.0]))
+        db.commit_session("Synthetic OSeMOSYS data for benchmarking")
+
+
+def write_timeslice_csv(timeslice_csv, timeslice_count, hours=8760):
+    # Hourly year in the format of data/example/timeslices_to_time.csv, the timeslices repeat in six hour blocks
+    start = datetime.datetime(2024, 1, 1)
+    with open(timeslice_csv, 'w') as file:
+        file.write("datetime,timeslice,duration\n")
+        for hour in range(hours):
+            date_time = start + datetime.timedelta(hours=hour)
+            file.write(f"{date_time.month}/{date_time.day}/{date_time:%y} {date_time.hour}:00,S{(hour // 6) % timeslice_count},1\n")
+
+
+def print_summary(results):
+    stage_names = []
+    for result in results:
+        for stage in result.get("stages", []):
+            if stage["stage"] not in stage_names:
+                stage_names.append(stage["stage"])
+    print(f"{'stage':<36}" + "".join(f"{result['scale']:>12}" for result in results))
+    for stage_name in stage_names:
+        row = f"{stage_name:<36}"
+        for result in results:
+            seconds = [stage["seconds"] for stage in result.get("stages", []) if stage["stage"] == stage_name]
+            row += f"{seconds[0]:>12.3f}" if seconds else f"{'':>12}"
+        print(row)
+    print(f"{'total (s)':<36}" + "".join(f"{result['seconds']:>12.3f}" for result in results))
+    print(f"{'peak memory (MB)':<36}" + "".join(f"{max((stage['peak_memory_mb'] for stage in result.get('stages', [])), default=0):>12}"
+                                              for result in results))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        exit("Please provide the settings yaml file and a folder for the benchmark databases and results as arguments. "
+             "Optionally followed by the scales to run: " + ", ".join(scales))
+    scale_names = sys.argv[3:] if len(sys.argv) > 3 else ["tiny", "small", "medium"]
+    for scale_name in scale_names:
+        if scale_name not in scales:
+            exit("Unknown scale " + scale_name + ", choose from: " + ", ".join(scales))
+    main(sys.argv[1], sys.argv[2], scale_names)
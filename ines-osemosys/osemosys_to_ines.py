@@ -9,21 +9,46 @@ except:
         import ines_transform
     except:
         print("Cannot find ines tools as an installed package or as parallel folder")
+from spinedb_api.exception import NothingToCommit, SpineDBAPIError
 from sqlalchemy.exc import DBAPIError
 import sys
 import csv
 from sys import exit
 import yaml
 import itertools
+from collections import OrderedDict
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import json
+import numpy as np
 import datetime
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import parse
 
 
 def main():
-    with DatabaseMapping(url_db_in) as source_db:
-        with DatabaseMapping(url_db_out, upgrade=True) as target_db:
-            ## Empty the database
+    try:
+        with DatabaseMapping(url_db_in) as source_db:
+            with DatabaseMapping(url_db_out, upgrade=True) as target_db:
+                if not incremental:
+                    convert(source_db, target_db)
+                else:
+                    convert_incrementally(source_db, target_db)
+    finally:
+        # Also the profile of a conversion that stops with exit() is reported
+        profiler.report()
+
+
+def convert(source_db, target_db, purge=True):
+    ## Empty the database
+    if purge:
+        with profiler.stage("purge target_db", None):
             target_db.purge_items('parameter_value')
             target_db.purge_items('entity')
             target_db.purge_items('alternative')
@@ -33,10 +58,15 @@ def main():
             target_db.refresh_session()
             target_db.commit_session("Purged stuff")
 
-            source_db.fetch_all('entity_class')
-            source_db.fetch_all('entity')
-            source_db.fetch_all('parameter_value')
-            ## Copy scenarios alternatives
+    with profiler.stage("read source_db", None):
+        source_db.fetch_all('entity_class')
+        source_db.fetch_all('entity')
+        source_db.fetch_all('parameter_value')
+        ## Read the source data once, the process functions query the snapshot instead of the source_db
+        source = SourceSnapshot(source_db, parsed_value_cache_size)
+    ## Copy scenarios alternatives
+    if stage_tracker.selected("copy alternatives and scenarios"):
+        with profiler.stage("copy alternatives and scenarios", source), stage_tracker.stage("copy alternatives and scenarios", target_db, source):
             for alternative in source_db.get_alternative_items():
                 target_db.add_alternative_item(name=alternative["name"])
             for scenario in source_db.get_scenario_items():
@@ -45,50 +75,833 @@ def main():
                 target_db.add_scenario_alternative_item(scenario_name=scenario_alternative["scenario_name"],
                                                         alternative_name=scenario_alternative["alternative_name"],
                                                         rank=scenario_alternative["rank"])
-            try:
-                target_db.commit_session("Added alternatives and scenarios")
-            except DBAPIError as e:
-                print(e)
+            if not source.alternatives:
                 exit("no alternatives in the source database, check the URL for the DB")
+            commit_policy.checkpoint(target_db, "Added alternatives and scenarios")
 
-            ## Copy entities
+    ## Copy entities
+    if stage_tracker.selected("copy_entities"):
+        with profiler.stage("copy_entities", source), stage_tracker.stage("copy_entities", target_db, source, configuration_reads(entities_to_copy)):
             target_db = ines_transform.copy_entities(source_db, target_db, entities_to_copy)
-            ## Create periods from years
-            target_db = create_periods(source_db, target_db)
-            ## Copy timeslice parameters (manual scripting)
-            target_db, datetime_indexes, timeslice_indexes, year_splits = process_timeslice_data(source_db, target_db, timeslice_csv)
-            ## Copy numeric parameters(source_db, target_db, parameter_transforms)
+    ## Create periods from years
+    if stage_tracker.selected("create_periods"):
+        with profiler.stage("create_periods", source), stage_tracker.stage("create_periods", target_db, source):
+            target_db = create_periods(source, target_db)
+    ## Copy timeslice parameters (manual scripting)
+    timeline = timeslice_indexes = timeslice_gather = year_splits = None
+    if stage_tracker.selected("process_timeslice_data"):
+        with profiler.stage("process_timeslice_data", source), stage_tracker.stage("process_timeslice_data", target_db, source):
+            target_db, timeline, timeslice_indexes, timeslice_gather, year_splits = process_timeslice_data(source, target_db, timeslice_csv)
+    ## Start the stages that depend only on the source, they are computed in worker processes while the main process continues
+    stages = StageScheduler(source, stage_workers)
+    stages.start([(process_demands, (timeline,)),
+                  (process_capacities, (timeline, timeslice_gather, year_splits)),
+                  (process_model_level, ()),
+                  (process_zero_investment_cost, ()),
+                  (process_RE_min_constraint, ()),
+                  (process_activity_constraints, ()),
+                  (process_emissions, ()),
+                  (process_reserves, (timeslice_indexes,)),
+                  (process_storages, ()),
+                  (process_node_types, ())])
+    ## Copy numeric parameters(source_db, target_db, parameter_transforms)
+    if stage_tracker.selected("transform_parameters"):
+        with profiler.stage("transform_parameters", source), stage_tracker.stage("transform_parameters", target_db, source, configuration_reads(parameter_transforms)):
             target_db = ines_transform.transform_parameters(source_db, target_db, parameter_transforms,
                                                                         use_default=True, default_alternative="base", ts_to_map=True)
-            ## Copy method parameters
+    ## Copy method parameters
+    if stage_tracker.selected("process_methods"):
+        with profiler.stage("process_methods", source), stage_tracker.stage("process_methods", target_db, source, configuration_reads(parameter_methods)):
             target_db = ines_transform.process_methods(source_db, target_db, parameter_methods)
-            ## Copy entities to parameters
+    ## Copy entities to parameters
+    if stage_tracker.selected("copy_entities_to_parameters"):
+        with profiler.stage("copy_entities_to_parameters", source), stage_tracker.stage("copy_entities_to_parameters", target_db, source, configuration_reads(entities_to_parameters)):
             target_db = ines_transform.copy_entities_to_parameters(source_db, target_db, entities_to_parameters)
-            ## Process demands
-            target_db = process_demands(source_db, target_db , datetime_indexes)
-            ## Copy capacity specific parameters (manual scripting)
-            target_db = process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes, year_splits)
-            ## Special model level parameters
-            target_db = process_model_level(source_db, target_db)
-            ## Process units with zero investment cost
-            target_db = process_zero_investment_cost(source_db, target_db)
-            ## Add constraints
-            target_db = process_RE_min_constraint(source_db, target_db)
-            ## Add activity constraints
-            target_db = process_activity_constraints(source_db, target_db)
-            ##Process emissions
-            target_db = process_emissions(source_db, target_db)
-            ## Process reserves
-            target_db = process_reserves(source_db, target_db, timeslice_indexes)
-            ## Process storages. This is done last as it takes a copy of an unit in the target db
-            target_db = process_storages(source_db, target_db)
-            ## Assign node types
-            target_db = process_node_types(source_db, target_db)
-
-
-def create_periods(source_db, target_db):
-    models = source_db.get_entity_items(entity_class_name="model")
-    years = source_db.get_entity_items(entity_class_name="YEAR")
+    ## The stages that take the results of process_timeslice_data
+    timeslice_results = ("process_timeslice_data",)
+    ## Process demands
+    target_db = stages.run(process_demands, target_db, timeslice_results)
+    ## Copy capacity specific parameters (manual scripting)
+    target_db = stages.run(process_capacities, target_db, timeslice_results)
+    ## Special model level parameters
+    target_db = stages.run(process_model_level, target_db)
+    ## Process units with zero investment cost
+    target_db = stages.run(process_zero_investment_cost, target_db)
+    ## Add constraints
+    target_db = stages.run(process_RE_min_constraint, target_db)
+    ## Add activity constraints
+    target_db = stages.run(process_activity_constraints, target_db)
+    ##Process emissions
+    target_db = stages.run(process_emissions, target_db)
+    ## Process reserves
+    target_db = stages.run(process_reserves, target_db, timeslice_results)
+    ## Process storages. This is done last as it takes a copy of an unit in the target db
+    target_db = stages.run(process_storages, target_db)
+    ## Assign node types
+    target_db = stages.run(process_node_types, target_db)
+    stages.close()
+    ## Commit what the commit policy has left uncommitted
+    with profiler.stage("final commit", source):
+        commit_policy.commit(target_db)
+
+
+def convert_incrementally(source_db, target_db):
+    # Converts into a scratch copy of the ines db and writes only the difference to the target_db.
+    # The state file keeps a fingerprint of the entities of every source entity class and of every source parameter and,
+    # for every conversion stage, the parts it read and the target items it wrote. Only the stages that read a changed part
+    # run again, together with the stages
+    # they share target items, entities or results with. Their items are removed from the copy before they run and
+    # the difference is taken over their items only, the items of the other stages are not touched.
+    global commit_policy, stage_tracker
+    if not url_db_out.startswith("sqlite:///"):
+        exit("The incremental conversion needs a sqlite target database, it converts into a copy of the target file")
+    target_file = url_db_out[len("sqlite:///"):]
+    state_file = incremental_state_file or target_file + ".fingerprints.json"
+    state = read_incremental_state(state_file)
+    with profiler.stage("fingerprint source_db", None):
+        alternatives, parts = source_fingerprints(source_db)
+        conversion = conversion_fingerprint()
+    selected_stages = None
+    if state and state.get("conversion") == conversion and state.get("alternatives") == alternatives:
+        changed = {part for part in set(state["parts"]) | set(parts) if state["parts"].get(part) != parts.get(part)}
+        if not changed:
+            print("No changes in the source data since the last conversion, nothing to do")
+            return
+        selected_stages = stages_to_rerun(state["stages"], changed)
+        print(f"{len(changed)} source entity classes or parameters changed since the last conversion, "
+              f"running {len(selected_stages)} of {len(state['stages'])} stages: {', '.join(sorted(selected_stages))}")
+    elif state:
+        print("The settings, configuration files, alternatives or the conversion script have changed, converting everything")
+    # The stage tracker commits the copy after every stage to see what the stage wrote, the target_db is committed once
+    commit_policy = CommitPolicy("end")
+    stage_tracker = StageTracker(selected_stages, tracking=True)
+    with tempfile.TemporaryDirectory() as scratch_folder:
+        with profiler.stage("copy target_db", None):
+            scratch_url = copy_target(target_file, scratch_folder)
+        with DatabaseMapping(scratch_url) as scratch_db:
+            keys = None
+            if selected_stages is not None:
+                with profiler.stage("remove items of the changed stages", None):
+                    keys = stage_items(state["stages"], selected_stages)
+                    remove_items(scratch_db, keys)
+            convert(source_db, scratch_db, purge=selected_stages is None)
+            with profiler.stage("write difference to target_db", None):
+                if keys is not None:
+                    for item_type, new_keys in stage_items(stage_tracker.stages, selected_stages).items():
+                        keys.setdefault(item_type, set()).update(new_keys)
+                added, updated, removed_items = apply_difference(scratch_db, target_db, keys)
+                profiler.count_items(added + updated)
+                print(f"Incremental conversion added {added}, updated {updated} and removed {removed_items} items in the target_db")
+                commit_policy.checkpoint(target_db, "Incremental conversion from OSeMOSYS")
+                commit_policy.commit(target_db)
+    stages = dict(state["stages"]) if selected_stages is not None else {}
+    stages.update(stage_tracker.stages)
+    write_incremental_state(state_file, {"conversion": conversion, "alternatives": alternatives, "parts": parts, "stages": stages})
+
+
+def source_fingerprints(source_db):
+    # Hash of the alternatives and scenarios and of every source part: the entities of a class with their alternatives
+    # (key: class) and the definition and values of a parameter (key: class/parameter), see source_part
+    contents = {}
+    for entity in source_db.get_entity_items():
+        contents.setdefault(source_part(entity["entity_class_name"]), []).append(repr(("entity", tuple(entity["entity_byname"]))))
+    for entity_alternative in source_db.get_entity_alternative_items():
+        contents.setdefault(source_part(entity_alternative["entity_class_name"]), []).append(repr(
+            ("alternative", tuple(entity_alternative["entity_byname"]), entity_alternative["alternative_name"], entity_alternative["active"])))
+    for definition in source_db.get_parameter_definition_items():
+        contents.setdefault(source_part(definition["entity_class_name"], definition["name"]), []).append(repr(
+            ("definition", definition["default_type"], definition["default_value"])))
+    for param in source_db.get_parameter_value_items():
+        contents.setdefault(source_part(param["entity_class_name"], param["parameter_definition_name"]), []).append(repr(
+            ("value", tuple(param["entity_byname"]), param["alternative_name"], param["type"], param["value"])))
+    alternatives = [repr(("alternative", alternative["name"])) for alternative in source_db.get_alternative_items()]
+    alternatives += [repr(("scenario", scenario["name"])) for scenario in source_db.get_scenario_items()]
+    alternatives += [repr(("scenario_alternative", item["scenario_name"], item["alternative_name"], item["rank"]))
+                     for item in source_db.get_scenario_alternative_items()]
+    return (hashlib.sha1("\n".join(sorted(alternatives)).encode("UTF8")).hexdigest(),
+            {part: hashlib.sha1("\n".join(sorted(content)).encode("UTF8")).hexdigest() for part, content in contents.items()})
+
+def source_part(class_name, param_name=None):
+    # The incremental conversion tracks the source data in parts: the entities of a class and each parameter of a class
+    return class_name if param_name is None else class_name + "/" + param_name
+
+def configuration_reads(configuration):
+    # The source parts an ines_transform configuration reads: the entities of its source classes and the parameters
+    # named in it. Names of parameters and features are the keys under the target classes (parameters and methods)
+    # or the strings and keys in the list of a target class (features of entities).
+    reads = set()
+    for class_name, targets in configuration.items():
+        reads.add(source_part(class_name))
+        for target in (targets if isinstance(targets, list) else [targets]):
+            for features in (target.values() if isinstance(target, dict) else []):
+                for feature in (features if isinstance(features, (list, dict)) else []):
+                    if isinstance(feature, str):
+                        reads.add(source_part(class_name, feature))
+                    elif isinstance(feature, dict):
+                        reads.update(source_part(class_name, name) for name in feature)
+    return reads
+
+def conversion_fingerprint():
+    # Everything besides the source data that changes the conversion result
+    conversion = hashlib.sha1()
+    conversion.update(Path(__file__).read_bytes())
+    conversion.update(json.dumps({key: value for key, value in settings.items() if key not in runtime_settings},
+                                 sort_keys=True, default=str).encode("UTF8"))
+    conversion.update(json.dumps([entities_to_copy, parameter_transforms, parameter_methods, entities_to_parameters],
+                                 sort_keys=True).encode("UTF8"))
+    conversion.update(Path(timeslice_csv).read_bytes() if Path(timeslice_csv).exists() else b"")
+    return conversion.hexdigest()
+
+def stages_to_rerun(stage_state, changed_parts):
+    # The stages that read a changed source part. A stage runs together with the stages whose results it takes and the stages
+    # that write the same target items. A stage that runs again also takes the stages that refer to its entities and
+    # alternatives, because their items are removed with the ones they refer to.
+    rerun = {name for name, stage in stage_state.items() if changed_parts & set(stage["reads"])}
+    links = {name: set(stage["uses"]) for name, stage in stage_state.items()}
+    writers = {}
+    for name, stage in stage_state.items():
+        for used in stage["uses"]:
+            links.setdefault(used, set()).add(name)
+        for item_type, keys in stage["items"].items():
+            for key in keys:
+                writers.setdefault((item_type, json.dumps(key)), set()).add(name)
+        for provided in stage["provides"]:
+            writers.setdefault(("reference", json.dumps(provided)), set()).add(name)
+    for name, stage in stage_state.items():
+        for reference in stage["references"]:
+            for writer in writers.get(("reference", json.dumps(reference)), ()):
+                links[writer].add(name)
+    for names in writers.values():
+        for name in names:
+            links[name] |= names
+    pending = list(rerun)
+    while pending:
+        for name in links.get(pending.pop(), ()):
+            if name not in rerun:
+                rerun.add(name)
+                pending.append(name)
+    return rerun
+
+def stage_items(stage_state, stage_names):
+    # item type -> difference keys of the target items the stages wrote
+    items = {}
+    for name in stage_names:
+        for item_type, keys in stage_state.get(name, {}).get("items", {}).items():
+            items.setdefault(item_type, set()).update(tuple(tuple(field) if isinstance(field, list) else field for field in key) for key in keys)
+    return items
+
+def remove_items(scratch_db, keys):
+    # Removes the items written by the stages that run again, the items that refer to them first
+    for item_type, key_fields, value_fields in reversed(difference_item_types):
+        for key in keys.get(item_type, ()):
+            item = scratch_db.get_item(item_type, **dict(zip(key_fields, key)))
+            if item:
+                scratch_db.remove_item(item_type, item["id"])
+    try:
+        scratch_db.commit_session("Removed the items of the changed stages")
+    except NothingToCommit:
+        pass
+
+def read_incremental_state(state_file):
+    if not Path(state_file).exists():
+        return None
+    with open(state_file, 'r') as file:
+        return json.load(file)
+
+def write_incremental_state(state_file, state):
+    with open(state_file, 'w') as file:
+        json.dump(state, file)
+
+def copy_target(target_file, scratch_folder):
+    # A copy of the target sqlite file keeps its entity classes, superclasses, parameter definitions and value lists as they are.
+    # (Importing an exported structure into a new db fails for the superclasses of ines-spec.) A full convert() purges the data,
+    # otherwise the items of the stages that do not run again stay as they are.
+    scratch_file = Path(scratch_folder) / "scratch.sqlite"
+    shutil.copyfile(target_file, scratch_file)
+    return "sqlite:///" + str(scratch_file)
+
+def apply_difference(scratch_db, target_db, keys=None):
+    # Makes the data of the target_db equal to the scratch_db. Items are matched by their names, only new and changed ones are written.
+    # With keys (item type -> difference keys) only those items are compared, the others are not touched.
+    added = updated = removed = 0
+    errors = []
+    target_items = {}
+    for item_type, key_fields, value_fields in difference_item_types:
+        compared = keys.get(item_type, set()) if keys is not None else None
+        target_items[item_type] = {}
+        for item in target_db.get_items(item_type):
+            key = difference_key(item, key_fields)
+            if compared is None or key in compared:
+                target_items[item_type][key] = item
+        scratch_items = sorted(scratch_db.get_items(item_type), key=lambda item: len(item["entity_byname"]) if item_type == "entity" else 0)
+        for item in scratch_items:
+            key = difference_key(item, key_fields)
+            if compared is not None and key not in compared:
+                continue
+            target_item = target_items[item_type].pop(key, None)
+            if target_item and all(target_item[field] == item[field] for field in value_fields):
+                continue
+            fields = dict(zip(key_fields, key))
+            fields.update({field: item[field] for field in value_fields})
+            if target_item:
+                fields["id"] = target_item["id"]
+                result, error = target_db.update_item(item_type, **fields)
+                updated += 1
+            else:
+                result, error = target_db.add_item(item_type, **fields)
+                added += 1
+            if error:
+                errors.append(error)
+    # What is left in the target_items is not in the conversion result anymore, remove the dependent items first
+    for item_type, key_fields, value_fields in reversed(difference_item_types):
+        stale_items = sorted(target_items[item_type].values(), key=lambda item: -len(item["entity_byname"]) if item_type == "entity" else 0)
+        for item in stale_items:
+            if item.is_valid():
+                result, error = target_db.remove_item(item_type, item["id"])
+                removed += 1
+                if error:
+                    errors.append(error)
+    if errors:
+        print(f"{len(errors)} errors when writing the incremental changes to the target_db:")
+        for error in errors[:10]:
+            print("    " + str(error))
+    return added, updated, removed
+
+def difference_key(item, key_fields):
+    return tuple(tuple(item[field]) if field == "entity_byname" else item[field] for field in key_fields)
+
+# Item types compared in an incremental conversion: (item type, fields that identify the item, fields that are compared)
+difference_item_types = [
+    ("alternative", ("name",), ()),
+    ("scenario", ("name",), ()),
+    ("scenario_alternative", ("scenario_name", "alternative_name"), ("rank",)),
+    ("entity", ("entity_class_name", "entity_byname"), ()),
+    ("entity_alternative", ("entity_class_name", "entity_byname", "alternative_name"), ("active",)),
+    ("parameter_value", ("entity_class_name", "entity_byname", "parameter_definition_name", "alternative_name"), ("type", "value")),
+]
+
+# Settings that change how the conversion runs but not its result
+runtime_settings = ("commit_policy", "stage_workers", "profile", "profile_json", "incremental", "incremental_state_file",
+                    "timeslice_cache", "timeslice_cache_directory", "parsed_value_cache_size")
+
+
+class StageScheduler:
+    """Runs the process stages of main(), computing them in a process pool when stage_workers > 1.
+
+    The process stages are independent by construction: they read only the source snapshot and never the target_db.
+    Items that refer to target_db content written earlier (entities copied by ines_transform, the entities of an
+    earlier stage) are resolved when they are added, and run() adds them in the order main() calls it.
+    A worker runs the stage against a StageOutput instead of the target_db, which stops the conversion if a stage
+    tries to read the target_db. run() then adds the recorded items to the target_db in the main process, so there
+    is a single writer. With stage_workers 1 the stages run directly in run().
+    """
+    def __init__(self, source, max_workers):
+        self.source = source
+        self.max_workers = max_workers
+        self._args = {}
+        self._futures = {}
+        self._pool = None
+
+    def start(self, stages):
+        stages = [(function, args) for function, args in stages if stage_tracker.selected(function.__name__)]
+        for function, args in stages:
+            self._args[function.__name__] = args
+        if self.max_workers < 2 or len(stages) < 2:
+            return
+        self._pool = ProcessPoolExecutor(max_workers=min(self.max_workers, len(stages)),
+                                         initializer=init_stage_worker, initargs=(self.source, settings))
+        for function, args in stages:
+            self._futures[function.__name__] = self._pool.submit(run_stage_in_worker, function, args)
+
+    def run(self, function, target_db, uses=()):
+        # uses: the stages whose results the stage takes as arguments
+        if not stage_tracker.selected(function.__name__):
+            return target_db
+        with profiler.stage(function.__name__, self.source), stage_tracker.stage(function.__name__, target_db, self.source, uses=uses):
+            future = self._futures.pop(function.__name__, None)
+            if future is None:
+                return function(self.source, target_db, *self._args[function.__name__])
+            records, worker_profile, read_parts = future.result()
+            profiler.add_worker_profile(worker_profile)
+            stage_tracker.add_reads(read_parts)
+            return self._merge(target_db, function.__name__, records)
+
+    def _merge(self, target_db, stage_name, records):
+        writer = ParameterValueWriter(target_db, stage_name)
+        for method, arguments, on_error in records:
+            if method == "add_update_items":
+                for item in arguments:
+                    writer.add_database_value(item["entity_class_name"], item["entity_byname"], item["parameter_definition_name"],
+                                              item["alternative_name"], item["value"], item["type"])
+                writer.flush()
+            elif method == "commit_session":
+                commit_policy.checkpoint(target_db, arguments)
+            else:
+                handle_target_result(getattr(target_db, method)(**arguments), on_error)
+                profiler.count_items(1)
+        writer.flush()
+        return target_db
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+class StageOutput:
+    """Takes the place of the target_db for a stage running in a worker process.
+
+    Records the target_db calls of the stage in order as (method, arguments, on_error). Entities and alternatives
+    are recorded through add_target_item, which gives the error handling of the call. Any other use of the
+    target_db, e.g. a query, stops the conversion, because the target_db is not available in the worker.
+    """
+    def __init__(self):
+        self.records = []
+
+    def record(self, method, arguments, on_error):
+        self.records.append((method, arguments, on_error))
+
+    def add_update_items(self, item_type, *items, **kwargs):
+        if item_type != "parameter_value":
+            exit("StageOutput records only parameter values, got " + item_type)
+        self.records.append(("add_update_items", items, None))
+        return [], [], []
+
+    def commit_session(self, message):
+        self.records.append(("commit_session", message, None))
+
+    def __getattr__(self, name):
+        exit(f"A process stage used target_db.{name} in a worker process. The stages computed with stage_workers > 1 "
+             "can only add items with add_target_item and ParameterValueWriter and cannot read the target_db")
+
+
+def add_target_item(target_db, method, on_error, **kwargs):
+    # Calls an add method of the target_db in a process stage. on_error is "ignore", "warn" or the message to exit with.
+    # In a worker process the call is recorded with on_error, so the merge handles an error like the serial run.
+    if isinstance(target_db, StageOutput):
+        target_db.record(method, kwargs, on_error)
+        return
+    handle_target_result(getattr(target_db, method)(**kwargs), on_error)
+    profiler.count_items(1)
+
+def handle_target_result(result, on_error):
+    error = result[-1]
+    if not error or on_error == "ignore":
+        return
+    if on_error == "warn":
+        ines_transform.assert_success(result, warn=True)
+    else:
+        exit(on_error + str(error))
+
+
+def init_stage_worker(source, worker_settings):
+    global stage_source, commit_policy
+    stage_source = source
+    apply_settings(worker_settings)
+    # Every checkpoint is recorded, the main process applies the actual commit policy
+    commit_policy = CommitPolicy("stage")
+
+def run_stage_in_worker(function, args):
+    stage_output = StageOutput()
+    stage_source.read_parts.clear()
+    with profiler.stage(function.__name__, stage_source) as worker_profile:
+        function(stage_source, stage_output, *args)
+    return stage_output.records, worker_profile, set(stage_source.read_parts)
+
+
+class StageTracker:
+    """Selects the conversion stages that run and records what each stage reads and writes.
+
+    The incremental conversion runs only the selected stages (all with selected_stages None) and with tracking
+    records for each stage the source parts (see source_part) it read from the SourceSnapshot (and the parts
+    named in its ines_transform configuration), the keys of the target items it added or changed, the entities and
+    alternatives those items refer to and the stages whose results it takes. The target_db is committed after
+    every tracked stage, the items of the commits made during a stage are the ones it wrote (ines_transform
+    functions may commit on their own).
+    """
+    def __init__(self, selected_stages=None, tracking=False):
+        self.selected_stages = selected_stages
+        self.tracking = tracking
+        self.stages = {}
+        self._current = None
+
+    def selected(self, name):
+        return self.selected_stages is None or name in self.selected_stages
+
+    @contextlib.contextmanager
+    def stage(self, name, target_db, source, reads=(), uses=()):
+        if not self.tracking:
+            yield
+            return
+        source.read_parts.clear()
+        self._current = {"reads": set(reads), "items": {}}
+        first_commit_id = last_commit_id(target_db)
+        yield
+        record = self._current
+        self._current = None
+        record["reads"] |= source.read_parts
+        try:
+            target_db.commit_session("Converted " + name)
+        except NothingToCommit:
+            pass
+        provides = set()
+        references = set()
+        for item_type, key_fields, value_fields in difference_item_types:
+            keys = record["items"].setdefault(item_type, set())
+            for item in target_db.get_items(item_type, fetch=False):
+                if (item.get("commit_id") or 0) > first_commit_id:
+                    keys.add(difference_key(item, key_fields))
+                    item_provides, item_references = item_links(item_type, item)
+                    provides.update(item_provides)
+                    references.update(item_references)
+        # Values written again unchanged are not committed, they are recorded by ParameterValueWriter
+        for class_name, entity_byname, param_name, alternative_name in record["items"]["parameter_value"]:
+            references.update({("entity", class_name, entity_byname), ("alternative", alternative_name)})
+        self.stages[name] = {"reads": sorted(record["reads"]), "uses": list(uses),
+                             "items": {item_type: sorted(keys, key=repr) for item_type, keys in record["items"].items()},
+                             "provides": sorted(provides, key=repr), "references": sorted(references - provides, key=repr)}
+
+    def add_reads(self, read_parts):
+        # The source classes a stage read in a worker process
+        if self._current is not None:
+            self._current["reads"] |= set(read_parts)
+
+    def record_values(self, keys):
+        # (class, entity_byname, parameter, alternative) of the parameter values the current stage wrote
+        if self._current is not None:
+            self._current["items"].setdefault("parameter_value", set()).update(keys)
+
+def last_commit_id(db):
+    with db:
+        commit = db.query(db.commit_sq.c.id).order_by(db.commit_sq.c.id.desc()).first()
+    return commit.id if commit else 0
+
+def item_links(item_type, item):
+    # The entities, alternatives and scenarios an item is (provides) and refers to (references).
+    # An entity is referred to by its byname from the items that belong to it and by its name from the entities it is an element of.
+    if item_type == "alternative":
+        return [("alternative", item["name"])], []
+    if item_type == "scenario":
+        return [("scenario", item["name"])], []
+    if item_type == "scenario_alternative":
+        return [], [("scenario", item["scenario_name"]), ("alternative", item["alternative_name"])]
+    if item_type == "entity":
+        return ([("entity", item["entity_class_name"], item["name"]), ("entity", item["entity_class_name"], tuple(item["entity_byname"]))],
+                [("entity", dimension, element) for dimension, element in zip(item["dimension_name_list"], item["element_name_list"])])
+    return [], [("entity", item["entity_class_name"], tuple(item["entity_byname"])), ("alternative", item["alternative_name"])]
+
+
+class StageProfiler:
+    """Wall time, source queries, added target items and peak memory of the conversion stages.
+
+    Switched on with profile: true in settings.yaml or with the OSEMOSYS_TO_INES_PROFILE environment variable
+    (1 or the path of a JSON file). report() prints a table and writes the JSON file if one is given.
+    Source queries are the SourceSnapshot queries, the ines_transform stages read the source_db directly.
+    Added target items are counted by ParameterValueWriter and add_target_item, so they are given only for the
+    stages that write through them (the process stages and the incremental difference), the others are blank.
+    Peak memory is the peak of Python allocations from tracemalloc, which slows down the profiled run.
+    """
+    def __init__(self, enabled=False, json_path=None):
+        self.enabled = enabled
+        self.json_path = json_path
+        self.stages = []
+        self._current = None
+
+    @contextlib.contextmanager
+    def stage(self, name, source):
+        if not self.enabled:
+            yield None
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        queries = source.query_count if source else None
+        profile = {"stage": name, "target_items_added": None}
+        self._current = profile
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile["seconds"] = round(time.perf_counter() - start, 3)
+            profile["source_queries"] = source.query_count - queries + profile.get("source_queries", 0) if source else None
+            profile["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            self._current = None
+            self.stages.append(profile)
+
+    def count_items(self, count):
+        # Items written to the target_db by the current stage
+        if self._current is not None:
+            self._current["target_items_added"] = (self._current["target_items_added"] or 0) + count
+
+    def add_worker_profile(self, worker_profile):
+        # The stage was computed in a worker process, the stage in the main process only adds the items to the target_db
+        if self._current is None or worker_profile is None:
+            return
+        self._current["worker_seconds"] = worker_profile["seconds"]
+        self._current["worker_peak_memory_mb"] = worker_profile["peak_memory_mb"]
+        self._current["source_queries"] = worker_profile["source_queries"]
+
+    def report(self):
+        if not self.enabled:
+            return
+        print(f"{'stage':<36}{'seconds':>10}{'worker s':>10}{'queries':>10}{'items added':>13}{'peak MB':>10}")
+        for profile in self.stages:
+            print(f"{profile['stage']:<36}{profile['seconds']:>10.3f}{self._cell(profile.get('worker_seconds'), '.3f'):>10}"
+                  f"{self._cell(profile['source_queries']):>10}{self._cell(profile['target_items_added']):>13}"
+                  f"{self._cell(max(profile['peak_memory_mb'], profile.get('worker_peak_memory_mb', 0))):>10}")
+        total_seconds = round(sum(profile["seconds"] for profile in self.stages), 3)
+        print(f"{'total':<36}{total_seconds:>10.3f}")
+        if self.json_path:
+            with open(self.json_path, 'w') as file:
+                json.dump({"total_seconds": total_seconds, "stages": self.stages}, file, indent=2)
+
+    @staticmethod
+    def _cell(value, format_spec=""):
+        return "" if value is None else format(value, format_spec)
+
+
+class SourceSnapshot:
+    """Read-once view of the OSeMOSYS source database.
+
+    Entities, entity_alternatives, parameter definitions and parameter values are read from the source_db
+    once and indexed in dicts. Parameter values are keyed by (class, entity_byname, parameter, alternative).
+    The records are dicts with the same keys as the spinedb_api items the process functions used before,
+    including "parsed_value". The parameter values are parsed on first access through a ParsedValueCache
+    of at most parsed_value_cache_size values. Parsed values are shared - do not modify them in place.
+    """
+    def __init__(self, source_db, parsed_value_cache_size=None):
+        self.parsed_values = ParsedValueCache(parsed_value_cache_size)
+        # The source parts queried, for the incremental conversion
+        self.read_parts = set()
+        self.alternatives = [{"name": alternative["name"]} for alternative in source_db.get_alternative_items()]
+        self.query_count = 0
+        self._entities = {}
+        for entity in source_db.get_entity_items():
+            self._entities.setdefault(entity["entity_class_name"], []).append({
+                "name": entity["name"],
+                "entity_byname": tuple(entity["entity_byname"]),
+                "element_name_list": tuple(entity["element_name_list"]),
+            })
+        self._entity_alternatives = {}
+        self._entity_alternatives_by_entity = {}
+        for entity_alternative in source_db.get_entity_alternative_items():
+            record = {
+                "entity_class_name": entity_alternative["entity_class_name"],
+                "entity_byname": tuple(entity_alternative["entity_byname"]),
+                "alternative_name": entity_alternative["alternative_name"],
+                "active": entity_alternative["active"],
+            }
+            self._entity_alternatives.setdefault(record["entity_class_name"], []).append(record)
+            self._entity_alternatives_by_entity.setdefault((record["entity_class_name"], record["entity_byname"]), []).append(record)
+        self._definitions = {}
+        for definition in source_db.get_parameter_definition_items():
+            self._definitions[(definition["entity_class_name"], definition["name"])] = {
+                "name": definition["name"],
+                "default_value": definition["default_value"],
+                "default_type": definition["default_type"],
+                "parsed_value": api.from_database(definition["default_value"], definition["default_type"]),
+            }
+        self._values = {}
+        self._values_by_parameter = {}
+        self._values_by_entity = {}
+        for param in source_db.get_parameter_value_items():
+            record = ParameterValueRecord(self.parsed_values, {
+                "id": param["id"],
+                "entity_class_name": param["entity_class_name"],
+                "entity_name": param["entity_name"],
+                "entity_byname": tuple(param["entity_byname"]),
+                "parameter_definition_name": param["parameter_definition_name"],
+                "alternative_name": param["alternative_name"],
+                "value": param["value"],
+                "type": param["type"],
+            })
+            class_name = record["entity_class_name"]
+            param_name = record["parameter_definition_name"]
+            self._values[(class_name, record["entity_byname"], param_name, record["alternative_name"])] = record
+            self._values_by_parameter.setdefault((class_name, param_name), []).append(record)
+            self._values_by_entity.setdefault((class_name, record["entity_byname"], param_name), []).append(record)
+
+    def entities(self, class_name):
+        self.query_count += 1
+        self.read_parts.add(source_part(class_name))
+        return self._entities.get(class_name, [])
+
+    def entity_alternatives(self, class_name, entity_byname=None):
+        self.query_count += 1
+        self.read_parts.add(source_part(class_name))
+        if entity_byname is None:
+            return self._entity_alternatives.get(class_name, [])
+        return self._entity_alternatives_by_entity.get((class_name, tuple(entity_byname)), [])
+
+    def parameter_definition(self, class_name, param_name):
+        self.query_count += 1
+        self.read_parts.add(source_part(class_name, param_name))
+        return self._definitions.get((class_name, param_name))
+
+    def parameter_values(self, class_name, param_name, entity_byname=None):
+        self.query_count += 1
+        self.read_parts.add(source_part(class_name, param_name))
+        if entity_byname is None:
+            return self._values_by_parameter.get((class_name, param_name), [])
+        return self._values_by_entity.get((class_name, tuple(entity_byname), param_name), [])
+
+    def parameter_value(self, class_name, entity_byname, param_name, alternative_name):
+        self.query_count += 1
+        self.read_parts.add(source_part(class_name, param_name))
+        return self._values.get((class_name, tuple(entity_byname), param_name, alternative_name))
+
+    def value(self, class_name, entity_byname, param_name, alternative_name):
+        record = self.parameter_value(class_name, entity_byname, param_name, alternative_name)
+        return record["parsed_value"] if record else None
+
+
+class ParsedValueCache:
+    """Least recently used cache of parsed parameter values keyed by parameter_value id.
+
+    Each value blob is parsed with api.from_database once and kept until more than max_size values are cached,
+    then the least recently used value is dropped and parsed again if it is needed later. No max_size keeps all values.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def get(self, value_id, value, value_type):
+        try:
+            parsed_value = self._values[value_id]
+        except KeyError:
+            self.misses += 1
+            parsed_value = api.from_database(value, value_type)
+            self._values[value_id] = parsed_value
+            if self.max_size and len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+            return parsed_value
+        self.hits += 1
+        self._values.move_to_end(value_id)
+        return parsed_value
+
+    def __getstate__(self):
+        # Stage worker processes get an empty cache of the same size
+        return {"max_size": self.max_size, "hits": 0, "misses": 0, "_values": OrderedDict()}
+
+
+class ParameterValueRecord(dict):
+    # Parameter value record of the SourceSnapshot, "parsed_value" comes from the parsed value cache
+    __slots__ = ("_parsed_values",)
+
+    def __init__(self, parsed_values, items):
+        super().__init__(items)
+        self._parsed_values = parsed_values
+
+    def __missing__(self, key):
+        if key != "parsed_value":
+            raise KeyError(key)
+        return self._parsed_values.get(self["id"], self["value"], self["type"])
+
+
+class ParameterValueWriter:
+    """Buffers the parameter values a process function writes to the target_db.
+
+    Values are collected as (class, entity_byname, parameter, alternative) -> database value and written
+    with one add_update_items call in flush(). A value given twice for the same key is written once, the last one wins,
+    which is what the add_update calls did before. Errors are collected and reported together after the flush.
+    If the commit policy commits every N items, the writer flushes and commits as soon as N values are pending.
+    """
+    def __init__(self, target_db, description):
+        self.target_db = target_db
+        self.description = description
+        self._items = {}
+
+    def add(self, class_name, entity_byname, param_name, alternative_name, value):
+        p_value, p_type = api.to_database(value)
+        self.add_database_value(class_name, entity_byname, param_name, alternative_name, p_value, p_type)
+
+    def add_database_value(self, class_name, entity_byname, param_name, alternative_name, p_value, p_type):
+        self._items[(class_name, tuple(entity_byname), param_name, alternative_name)] = (p_value, p_type)
+        if commit_policy.is_due(len(self._items)):
+            self.flush()
+            commit_policy.checkpoint(self.target_db, "Added " + self.description)
+
+    def add_item(self, param_name, alt_ent_class, value):
+        # Same argument order as ines_transform.add_item_to_DB: alt_ent_class is (alternative, entity_byname, class)
+        self.add(alt_ent_class[2], alt_ent_class[1], param_name, alt_ent_class[0], value)
+
+    def flush(self):
+        items = [{"entity_class_name": class_name,
+                  "entity_byname": entity_byname,
+                  "parameter_definition_name": param_name,
+                  "alternative_name": alternative_name,
+                  "value": p_value,
+                  "type": p_type}
+                 for (class_name, entity_byname, param_name, alternative_name), (p_value, p_type) in self._items.items()]
+        stage_tracker.record_values(self._items)
+        self._items = {}
+        profiler.count_items(len(items))
+        if not items:
+            return []
+        added, updated, errors = self.target_db.add_update_items("parameter_value", *items)
+        commit_policy.add_pending(len(items))
+        errors = [error for error in errors if error]
+        if errors:
+            print(f"{len(errors)} of {len(items)} parameter values failed when trying to add {self.description}:")
+            for error in errors[:10]:
+                print("    " + str(error))
+            if len(errors) > 10:
+                print(f"    ... and {len(errors) - 10} more")
+        return errors
+
+
+class CommitPolicy:
+    """When the conversion commits to the target_db, set by commit_policy in settings.yaml.
+
+    "stage" commits at the end of every process stage, "end" commits once at the end of main() and
+    an integer N commits whenever N parameter values have been added since the last commit.
+    Every commit flushes the SQLite file, so large conversions are faster with "end" or a large N.
+    """
+    def __init__(self, policy="stage"):
+        self.per_stage = policy == "stage"
+        self.every_n_items = None
+        if not self.per_stage and policy != "end":
+            try:
+                self.every_n_items = int(policy)
+            except (TypeError, ValueError):
+                exit("commit_policy in the settings should be stage, end or the number of items between commits, got: " + str(policy))
+            if self.every_n_items < 1:
+                exit("commit_policy in the settings should be stage, end or a positive number of items between commits")
+        self.pending_items = 0
+        self._messages = []
+
+    def add_pending(self, count):
+        self.pending_items += count
+
+    def is_due(self, buffered_items=0):
+        return self.every_n_items is not None and self.pending_items + buffered_items >= self.every_n_items
+
+    def checkpoint(self, target_db, message):
+        if message not in self._messages:
+            self._messages.append(message)
+        if self.per_stage or self.is_due():
+            self.commit(target_db)
+
+    def commit(self, target_db):
+        if not self._messages:
+            return
+        message = "; ".join(self._messages)
+        try:
+            target_db.commit_session(message)
+        except NothingToCommit:
+            pass
+        except (DBAPIError, SpineDBAPIError) as e:
+            print("failed to commit: " + message)
+            print(e)
+        self._messages = []
+        self.pending_items = 0
+
+
+def create_periods(source, target_db):
+    models = source.entities("model")
+    years = source.entities("YEAR")
     for model in models:
         added, error = target_db.add_entity_item(entity_class_name="system", name=model["name"])
         if error:
@@ -101,7 +914,7 @@ def create_periods(source_db, target_db):
         previous_year = None
         previous_alt = None
         for year in years:
-            period_alts = source_db.get_entity_alternative_items(entity_class_name="YEAR", entity_name=year["name"])
+            period_alts = source.entity_alternatives("YEAR", year["entity_byname"])
             if len(period_alts) > 1:
                 exit("Multiple entity_alternatives for the YEAR entities - not managed")
             if len(period_alts) == 0:
@@ -150,8 +963,7 @@ def create_periods(source_db, target_db):
                                                           type=p_type)
         if error:
             exit("Adding ines periods from OSEMOSYS years failed. " + error)
-        for ea in source_db.get_entity_alternative_items(entity_class_name="model",
-                                                         entity_name=model["name"]):
+        for ea in source.entity_alternatives("model", model["entity_byname"]):
             added_ea, update_ea, error = target_db.add_update_entity_alternative_item(entity_class_name="solve_pattern",
                                                                     entity_byname=(model["name"],),
                                                                     alternative_name=ea["alternative_name"],
@@ -164,66 +976,127 @@ def create_periods(source_db, target_db):
                                                                     active=ea["active"])
             if error:
                 exit("Adding system entity_alternative failed. " + error)
-    try:
-        target_db.commit_session("Added periods from YEARs to ines_db")
-    except DBAPIError as e:
-        print("failed to add periods")
+    commit_policy.checkpoint(target_db, "Added periods from YEARs to ines_db")
     return target_db
 
 def read_timeslice_data(timeslice_csv):
-    out_list = list()
+    # Returns the timestamps (datetime64[s]), timeslice names, timeslice codes (position in the names for each row)
+    # and the durations (hours) as NumPy arrays, or None if there is no csv file.
+    datetime_strings = []
+    timeslice_names = []
+    durations = []
     try:
         with open(timeslice_csv) as csv_file:
             csv_reader = csv.reader(csv_file, delimiter=',')
-            csv_header = []
-            csv_data = []
-            first_line = True
+            next(csv_reader, None)
             for row in csv_reader:
-                if first_line:
-                    for item in row:
-                        csv_header.append(item)
-                        csv_data.append([])
-                    first_line = False
-                else:
-                    for k, item in enumerate(row):
-                        if item == '':
-                            break
-                        csv_data[k].append(item)
-        for index_value in zip(csv_data[0],csv_data[1], csv_data[2]):
-            
-            try:
-                # Automatically parse the date string
-                date_object = parse(index_value[0])
-                out_list.append((api.DateTime(date_object), index_value[1], float(index_value[2])))
-            except ValueError as e:
-                print(f"Error parsing date: {e}")
-                sys.exit(-1)
-
+                if len(row) < 3 or '' in row[0:3]:
+                    continue
+                datetime_strings.append(row[0])
+                timeslice_names.append(row[1])
+                durations.append(row[2])
     except FileNotFoundError:
         print("No csv data file for " + timeslice_csv)
-    return out_list
-
-
-def process_timeslice_data(source_db, target_db, read_separate_csv):
-    model_items = source_db.get_entity_items(entity_class_name="model")
+        return None
+    if not datetime_strings:
+        return None
+    timestamps = parse_datetimes(datetime_strings)
+    timeslice_names, timeslice_codes = np.unique(np.array(timeslice_names), return_inverse=True)
+    return timestamps, timeslice_names, timeslice_codes, np.array(durations, dtype=float)
+
+def parse_datetimes(datetime_strings):
+    # The datetime format is detected once from a few rows and then used for every row.
+    # If no known format gives the same result as dateutil, every row is parsed with dateutil like before.
+    samples = sorted(set(datetime_strings[0:50] + datetime_strings[-50:] + datetime_strings[::max(1, len(datetime_strings) // 50)]))
+    try:
+        parsed_samples = [parse(sample) for sample in samples]
+    except ValueError as e:
+        print(f"Error parsing date: {e}")
+        sys.exit(-1)
+    for datetime_format in datetime_formats:
+        try:
+            if all(datetime.datetime.strptime(sample, datetime_format) == parsed for sample, parsed in zip(samples, parsed_samples)):
+                break
+        except ValueError:
+            continue
+    else:
+        datetime_format = None
+    try:
+        if datetime_format and datetime_format.startswith("%Y-%m-%d"):
+            # ISO dates are parsed by NumPy directly
+            return np.array(datetime_strings, dtype="datetime64[s]")
+        if datetime_format:
+            return np.array([datetime.datetime.strptime(datetime_string, datetime_format) for datetime_string in datetime_strings],
+                            dtype="datetime64[s]")
+        return np.array([parse(datetime_string) for datetime_string in datetime_strings], dtype="datetime64[s]")
+    except ValueError as e:
+        print(f"Error parsing date: {e}")
+        sys.exit(-1)
+
+# Datetime formats tried for the timeslice csv, the first that agrees with dateutil on the sample rows is used
+datetime_formats = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
+                    "%m/%d/%y %H:%M", "%m/%d/%Y %H:%M", "%m/%d/%y %H:%M:%S", "%m/%d/%Y %H:%M:%S",
+                    "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%Y/%m/%d %H:%M", "%Y/%m/%d %H:%M:%S"]
+
+
+def load_timeslice_mapping(timeslice_csv):
+    # Returns the parsed timeslice csv and the solve blocks as a dict of arrays, or None if there is no csv file.
+    # With timeslice_cache the arrays are kept in timeslice_cache_directory in a .npz file named by the hash of the csv content
+    # and reused while the csv content stays the same.
+    try:
+        with open(timeslice_csv, "rb") as csv_file:
+            csv_hash = hashlib.sha256(timeslice_cache_version + csv_file.read()).hexdigest()
+    except FileNotFoundError:
+        print("No csv data file for " + timeslice_csv)
+        return None
+    cache_file = Path(timeslice_cache_directory) / (csv_hash + ".npz")
+    if timeslice_cache and cache_file.exists():
+        try:
+            with np.load(cache_file, allow_pickle=False) as cached:
+                return {name: cached[name] for name in cached.files}
+        except (OSError, ValueError) as e:
+            print("Could not read the timeslice cache " + str(cache_file) + ": " + str(e))
+    timeslices_to_time = read_timeslice_data(timeslice_csv)
+    if not timeslices_to_time:
+        return None
+    timestamps, timeslice_names, timeslice_codes, durations = timeslices_to_time
+    block_starts, block_durations = timeline_blocks(timestamps, durations)
+    mapping = {"timestamps": timestamps, "timeslice_names": timeslice_names, "timeslice_codes": timeslice_codes,
+               "durations": durations, "block_starts": block_starts, "block_durations": block_durations}
+    if timeslice_cache:
+        temporary_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary_file, "wb") as npz_file:
+                np.savez(npz_file, **mapping)
+            os.replace(temporary_file, cache_file)
+        except OSError as e:
+            print("Could not write the timeslice cache " + str(cache_file) + ": " + str(e))
+    return mapping
+
+# Part of the timeslice cache hash, change when the cached arrays change
+timeslice_cache_version = b"timeslice cache 1\n"
+
+
+def process_timeslice_data(source, target_db, read_separate_csv):
+    model_items = source.entities("model")
     if len(model_items) > 1:
         exit("OSeMOSYS to ines script does not handle databases with more than one model entity")
     if len(model_items) == 0:
         exit("No model entities and associated parameters")
     model_item = model_items[0]
     
-    timeslices_to_time = read_timeslice_data(read_separate_csv)
+    timeslices_to_time = load_timeslice_mapping(read_separate_csv)
     if not timeslices_to_time:
         exit("No timeslices to datetime mapping")
-    datetime_indexes = list()
-    for i in timeslices_to_time:
-        datetime_indexes.append(i[0])
-    timeslice_indexes = []
-    time_durations = []
-    previous_time_duration = timeslices_to_time[0][2]
-    for i in timeslices_to_time:
-        timeslice_indexes.append(i[1])
-        time_durations.append(float(i[2]))
+    timestamps = timeslices_to_time["timestamps"]
+    timeslice_names = timeslices_to_time["timeslice_names"]
+    timeslice_codes = timeslices_to_time["timeslice_codes"]
+    time_durations = timeslices_to_time["durations"]
+    timeslice_indexes = timeslice_names[timeslice_codes]
+    timeslice_gather = (timeslice_names, timeslice_codes)
+    timeline = ProfileTimeline(timestamps)
+    previous_time_duration = float(time_durations[0])
     # Store the model time resolution in ines_db
     p_value, p_type = api.to_database(api.Duration(relativedelta(hours=previous_time_duration)))
     added, error = target_db.add_parameter_value_item(entity_class_name="solve_pattern",
@@ -235,7 +1108,7 @@ def process_timeslice_data(source_db, target_db, read_separate_csv):
     if error:
         exit("Could not add resolution parameter to ines-db: " + error)
 
-    timeline_map = api.TimeSeriesVariableResolution(datetime_indexes, time_durations, ignore_year=False, repeat=False, index_name="timestamp")
+    timeline_map = api.TimeSeriesVariableResolution(timestamps, time_durations, ignore_year=False, repeat=False, index_name="timestamp")
     p_value, p_type = api.to_database(timeline_map)
     added, error = target_db.add_parameter_value_item(entity_class_name="system",
                                                       parameter_definition_name="timeline",
@@ -247,19 +1120,10 @@ def process_timeslice_data(source_db, target_db, read_separate_csv):
         exit("Could not add timeline parameter to ines-db: " + error)
 
     #check for gaps in time series and create blocks of continuous time series
-    datetime_block_start = datetime_indexes[0]
-    datetime_block_starts = []
-    datetime_block_durations = []
-    for k, datetime_index in enumerate(datetime_indexes[:-1]):
-        if round_to_nearest_minute(datetime_indexes[k + 1].value) - round_to_nearest_minute(datetime_index.value) > datetime.timedelta(hours=int(time_durations[k])):
-            datetime_block_starts.append(datetime_block_start)
-            datetime_block_durations.append(api.Duration(relativedelta(datetime_index.value, datetime_block_start.value)
-                                                         + relativedelta(hours=int(time_durations[k]))))
-            datetime_block_start = datetime_indexes[k + 1]
-    #if continous block until the end
-    if len(datetime_block_starts) == 0:
-        datetime_block_starts.append(datetime_block_start)
-        datetime_block_durations.append(api.Duration(relativedelta(datetime_indexes[-1].value, datetime_block_start.value)))
+    block_starts = timeslices_to_time["block_starts"]
+    block_durations = timeslices_to_time["block_durations"]
+    datetime_block_starts = [api.DateTime(block_start) for block_start in block_starts.astype(datetime.datetime)]
+    datetime_block_durations = [api.Duration(relativedelta(seconds=int(block_duration))) for block_duration in block_durations]
     spine_array = api.Array(values=datetime_block_starts, index_name="datetime")
     p_value, p_type = api.to_database(spine_array)
     added, error = target_db.add_parameter_value_item(entity_class_name="solve_pattern",
@@ -281,108 +1145,119 @@ def process_timeslice_data(source_db, target_db, read_separate_csv):
     if error:
         print("process timeblock durations error: " + error)
 
-    try:
-        target_db.commit_session("Added starttimes and durations for timeslices")
-    except DBAPIError as e:
-        print("failed to add parameter values for starttimes and durations data. " + e)
+    commit_policy.checkpoint(target_db, "Added starttimes and durations for timeslices")
 
     # Go through parameters that use time indexes
-    year_splits =source_db.get_parameter_value_items(entity_class_name="model",
-                                                          entity_name=model_item["name"],
-                                                          parameter_definition_name="YearSplit")
+    year_splits = source.parameter_values("model", "YearSplit", model_item["entity_byname"])
     for year_split in year_splits:
-        year_split_data = api.from_database(year_split["value"], year_split["type"])
-        target_db = add_timeslice_data(source_db, target_db, year_split_data, time_durations,
+        year_split_data = year_split["parsed_value"]
+        target_db = add_timeslice_data(source, target_db, year_split_data, time_durations,
                                        "REGION__FUEL", "SpecifiedDemandProfile", "node", "flow_profile",
-                                       timeslice_indexes, datetime_indexes, -1.0, True)
-        #target_db = add_timeslice_data(source_db, target_db, year_split_data,
+                                       timeslice_gather, timeline, -1.0, True)
+        #target_db = add_timeslice_data(source, target_db, year_split_data,
         #                               "REGION__TECHNOLOGY", "CapacityFactor", "unit", "availability",
-        #                               timeslice_indexes, datetime_indexes, 1.0, False)
-    return target_db, datetime_indexes, timeslice_indexes, year_splits
+        #                               timeslice_gather, timeline, 1.0, False)
+    return target_db, timeline, timeslice_indexes, timeslice_gather, year_splits
+
+
+def timeline_blocks(timestamps, time_durations):
+    # Splits the timeline into blocks of continuous time steps. A block ends where the next timestamp
+    # (rounded to the nearest minute) comes later than the end of the time step.
+    # Returns the block start times (datetime64[s]) and the block durations in seconds, last time step included.
+    seconds = timestamps.astype("datetime64[s]").astype(np.int64)
+    step_seconds = np.round(time_durations * 3600).astype(np.int64)
+    rounded_minutes = (seconds + 30) // 60
+    gaps = np.flatnonzero(np.diff(rounded_minutes) * 60 > step_seconds[:-1])
+    first_steps = np.concatenate(([0], gaps + 1))
+    last_steps = np.concatenate((gaps, [len(seconds) - 1]))
+    block_durations = seconds[last_steps] - seconds[first_steps] + step_seconds[last_steps]
+    return timestamps[first_steps], block_durations
+
+
+class ProfileTimeline:
+    """Timeline shared by all the profiles written to the ines db.
+
+    The timestamps are converted once. If the time steps are all equally long, the profiles are stored
+    as fixed resolution time series with a start and a resolution. Otherwise the timestamps are serialized once
+    and reused for every variable resolution time series.
+    """
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+        steps = np.unique(np.diff(timestamps))
+        self.fixed_resolution = len(steps) == 1 and steps[0] > np.timedelta64(0, "s")
+        if self.fixed_resolution:
+            self._start = timestamps[0].astype(datetime.datetime)
+            self._resolution = resolution_to_string(int(steps[0].astype(int)))
+        else:
+            self._timestamps = np.datetime_as_string(timestamps, unit="s").tolist()
+
+    def to_database(self, values):
+        if self.fixed_resolution:
+            return api.to_database(api.TimeSeriesFixedResolution(self._start, self._resolution, values,
+                                                                 ignore_year=False, repeat=False))
+        # Same layout as a spinedb_api variable resolution time series, without converting the timestamps again
+        value_dict = {"data": dict(zip(self._timestamps, np.asarray(values, dtype=float).tolist()))}
+        return json.dumps(value_dict).encode("UTF8"), api.TimeSeries.TYPE
 
 
 def get_timeslice_value(year_split_data, source_param, source_class,
-                       source_param_name, timeslice_indexes, datetime_indexes,
+                       source_param_name, timeslice_gather, timeline,
                        multiplier, scale_with_time, time_durations = None):
     profile_data = source_param["parsed_value"]
-    timeslice_profiles = {}
-    for s, profile_data_by_slices in enumerate(profile_data.values):
-        if scale_with_time:
-            timeslice_profiles[profile_data.indexes[s]] = multiplier * \
-                                                            round(float(profile_data_by_slices.values[0]) /  # Note that this takes the first value from the array of years (first year)
-                                                                float(year_split_data.values[s].values[0]), 6) /8760
-        else:
-            timeslice_profiles[profile_data.indexes[s]] = multiplier * \
-                                                            round(float(profile_data_by_slices.values[0]), 6)  # Note that this takes the first value from the array of years (first year)
-    datetime_profiles = []
-    for t, timeslice_index in enumerate(timeslice_indexes):
-        if timeslice_index not in timeslice_profiles.keys():
-            print(f'Timeslice index {timeslice_index} not found in timeslice profiles for {source_class["name"]} parameter {source_param_name}')
+    timeslice_names, timeslice_positions = timeslice_gather
+    # Note that this takes the first value from the array of years (first year)
+    timeslice_values = np.array([float(profile_data_by_slices.values[0]) for profile_data_by_slices in profile_data.values])
+    if scale_with_time:
+        year_split_values = np.array([float(year_split_by_slices.values[0]) for year_split_by_slices in year_split_data.values])
+        timeslice_values = multiplier * np.round(timeslice_values / year_split_values, 6) / 8760
+    else:
+        timeslice_values = multiplier * np.round(timeslice_values, 6)
+    profile_positions = {timeslice: s for s, timeslice in enumerate(profile_data.indexes)}
+    for timeslice_name in timeslice_names:
+        if timeslice_name not in profile_positions:
+            print(f'Timeslice index {timeslice_name} not found in timeslice profiles for {source_class["name"]} parameter {source_param_name}')
             sys.exit(-1)
-        datetime_profiles.append(timeslice_profiles[timeslice_index])
+    # Order the values like timeslice_names and gather them to the time steps
+    datetime_profiles = timeslice_values[[profile_positions[timeslice_name] for timeslice_name in timeslice_names]][timeslice_positions]
     if scale_with_time:
-        datetime_profiles = [round(float(dp) * time_durations[t], 6) for t, dp in enumerate(datetime_profiles)]
-    to_db_profile_data = api.TimeSeriesVariableResolution(
-        datetime_indexes,
-        datetime_profiles,
-        ignore_year=False,
-        repeat=False
-    )
-    profile_data_divided, p_type = api.to_database(to_db_profile_data)
+        datetime_profiles = np.round(datetime_profiles * time_durations, 6)
+    profile_data_divided, p_type = timeline.to_database(datetime_profiles)
     
     return profile_data_divided, p_type,
 
-def add_timeslice_data(source_db, target_db, year_split_data, time_durations, source_class_name,
-                       source_param_name, target_class_name, target_param_name, timeslice_indexes, datetime_indexes,
+def add_timeslice_data(source, target_db, year_split_data, time_durations, source_class_name,
+                       source_param_name, target_class_name, target_param_name, timeslice_gather, timeline,
                        multiplier, scale_with_time):
-    for source_class in source_db.get_entity_items(entity_class_name=source_class_name):
-        for source_param in source_db.get_parameter_value_items(entity_class_name=source_class_name,
-                                                                 entity_name=source_class["name"],
-                                                                 parameter_definition_name=source_param_name):
+    writer = ParameterValueWriter(target_db, "timeslice data")
+    for source_class in source.entities(source_class_name):
+        for source_param in source.parameter_values(source_class_name, source_param_name, source_class["entity_byname"]):
             
             profile_data_divided, p_type = get_timeslice_value(year_split_data, source_param, source_class, source_param_name, 
-                                                               timeslice_indexes, datetime_indexes, multiplier, scale_with_time, 
+                                                               timeslice_gather, timeline, multiplier, scale_with_time, 
                                                                time_durations = time_durations)
             target_entity_byname = tuple(['__'.join(source_param["entity_byname"])])
-            added, error = target_db.add_parameter_value_item(entity_class_name=target_class_name,
-                                                                parameter_definition_name=target_param_name,
-                                                                entity_byname=target_entity_byname,
-                                                                alternative_name=source_param["alternative_name"],
-                                                                value=profile_data_divided,
-                                                                type=p_type)
-            if error:
-                print("process timeslice data error: " + error)
-    try:
-        target_db.commit_session("Added parameter values for timeslice data")
-    except DBAPIError as e:
-        print("failed to add parameter values for timeslice data")
-        print(e)
+            writer.add_database_value(target_class_name, target_entity_byname, target_param_name,
+                                      source_param["alternative_name"], profile_data_divided, p_type)
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added parameter values for timeslice data")
     return target_db
 
 
-def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes, year_splits):
-    region__tech__fuel_entities = source_db.get_entity_items(entity_class_name="REGION__TECHNOLOGY__FUEL")
-    TotalAnnualMaxCapacityInvestment = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY",
-                                                parameter_definition_name="TotalAnnualMaxCapacityInvestment")
-    TotalAnnualMinCapacityInvestment = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY",
-                                                parameter_definition_name="TotalAnnualMinCapacityInvestment")
-    
-    source_unit_investment_cost_all = get_parameter_values_with_default(source_db, "REGION__TECHNOLOGY", "CapitalCost", use_default = True, ignore_default_value_of = None)
-    source_unit_fixed_cost_all = get_parameter_values_with_default(source_db, "REGION__TECHNOLOGY", "FixedCost", use_default = True, ignore_default_value_of = None)
-    source_unit_variable_cost_all = get_parameter_values_with_default(source_db, "REGION__TECHNOLOGY", "VariableCost", use_default = True, ignore_default_value_of = None)
-    operational_life_all = get_parameter_values_with_default(source_db, "REGION__TECHNOLOGY", "OperationalLife", use_default = True, ignore_default_value_of = None)
-    source_unit_interest_rate_all = get_parameter_values_with_default(source_db, "REGION__TECHNOLOGY", "DiscountRateIdv", use_default = True, ignore_default_value_of = None)
-
-    for unit_source in source_db.get_entity_items(entity_class_name="REGION__TECHNOLOGY"):
-        source_unit_investment_cost = [source for source in source_unit_investment_cost_all if source["entity_byname"] == unit_source["entity_byname"]]
-        source_unit_fixed_cost = [source for source in source_unit_fixed_cost_all if source["entity_byname"] == unit_source["entity_byname"]]
-        source_unit_variable_cost = [source for source in source_unit_variable_cost_all if source["entity_byname"] == unit_source["entity_byname"]]
-        operational_life = [source for source in operational_life_all if source["entity_byname"] == unit_source["entity_byname"]]
-        source_unit_interest_rate = [source for source in source_unit_interest_rate_all if source["entity_byname"] == unit_source["entity_byname"]]
-        
-        source_region_interest_rate = source_db.get_parameter_value_items(entity_class_name="REGION", entity_name=unit_source["entity_byname"][0], parameter_definition_name="DiscountRate")
-        default_discount_rate = source_db.get_parameter_definition_item(entity_class_name="REGION", name="DiscountRate")
-        unit_entity_alternatives = source_db.get_entity_alternative_items(entity_class_name="unit")
+def process_capacities(source, target_db, timeline, timeslice_gather, year_splits):
+    writer = ParameterValueWriter(target_db, "capacity related parameters")
+    activity_ratios = index_activity_ratios(source)
+    source_unit_investment_cost_all = get_parameter_values_with_default(source, "REGION__TECHNOLOGY", "CapitalCost", use_default = True, ignore_default_value_of = None)
+    source_unit_fixed_cost_all = get_parameter_values_with_default(source, "REGION__TECHNOLOGY", "FixedCost", use_default = True, ignore_default_value_of = None)
+    source_unit_variable_cost_all = get_parameter_values_with_default(source, "REGION__TECHNOLOGY", "VariableCost", use_default = True, ignore_default_value_of = None)
+    operational_life_all = get_parameter_values_with_default(source, "REGION__TECHNOLOGY", "OperationalLife", use_default = True, ignore_default_value_of = None)
+    source_unit_interest_rate_all = get_parameter_values_with_default(source, "REGION__TECHNOLOGY", "DiscountRateIdv", use_default = True, ignore_default_value_of = None)
+    unit_interest_rates = resolve_discount_rates(source, source_unit_interest_rate_all)
+
+    for unit_source in source.entities("REGION__TECHNOLOGY"):
+        source_unit_investment_cost = source_unit_investment_cost_all.get(unit_source["entity_byname"], [])
+        source_unit_fixed_cost = source_unit_fixed_cost_all.get(unit_source["entity_byname"], [])
+        source_unit_variable_cost = source_unit_variable_cost_all.get(unit_source["entity_byname"], [])
+        operational_life = operational_life_all.get(unit_source["entity_byname"], [])
 
         #calculating the efficiency from InputActivityRatio and OutputActivityRatio
         act_indexes = None
@@ -392,25 +1267,19 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
         output_act_params = []
         input_names = []
         output_names = []
-        for rtf_ent in region__tech__fuel_entities:
-            if rtf_ent["entity_byname"][0] + rtf_ent["entity_byname"][1] == unit_source["entity_byname"][0] + unit_source["entity_byname"][1]:
-                temp = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__FUEL",
-                                                           entity_name=rtf_ent["name"],
-                                                           parameter_definition_name="InputActivityRatio")
-                if temp:
-                    input_act_params.extend(temp)
-                    input_names.append(rtf_ent["entity_byname"])
-                temp = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__FUEL",
-                                                           entity_name=rtf_ent["name"],
-                                                           parameter_definition_name="OutputActivityRatio")
-                if temp:
-                    output_act_params.extend(temp)
-                    output_names.append(rtf_ent["entity_byname"])
+        for fuel, fuel_activity_ratios in activity_ratios.get(unit_source["entity_byname"], {}).items():
+            rtf_byname = unit_source["entity_byname"] + (fuel,)
+            if fuel_activity_ratios["InputActivityRatio"]:
+                input_act_params.extend(fuel_activity_ratios["InputActivityRatio"])
+                input_names.append(rtf_byname)
+            if fuel_activity_ratios["OutputActivityRatio"]:
+                output_act_params.extend(fuel_activity_ratios["OutputActivityRatio"])
+                output_names.append(rtf_byname)
 
         #pairing the alternative and the value for InputActivityRatio and OutputActivityRatio
         for param in input_act_params:
             fuel = param["entity_byname"][2]
-            mode_map_objects = api.from_database(param["value"], "map")
+            mode_map_objects = param["parsed_value"]
             for k, input_map_object in enumerate(mode_map_objects.values):
                 if k == 0: # taking only the first mode of operation
                     if fuel not in input_act_ratio.keys():
@@ -418,11 +1287,11 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                     input_act_ratio[fuel].append({param["alternative_name"]: input_map_object.values})
                     if act_indexes:
                         if not act_indexes == input_map_object.indexes:
-                            exit("InputActivityRatio and/or OutputActivityRatio contain inconsistent YEAR indexes for " and rtf_ent["name"])
+                            exit("InputActivityRatio and/or OutputActivityRatio contain inconsistent YEAR indexes for " + param["entity_name"])
                     act_indexes = input_map_object.indexes
         for param in output_act_params:
             fuel = param["entity_byname"][2]
-            mode_map_objects = api.from_database(param["value"], "map")
+            mode_map_objects = param["parsed_value"]
             for k, output_map_object in enumerate(mode_map_objects.values):
                 if k == 0: # taking only the first mode of operation
                     if fuel not in output_act_ratio.keys():
@@ -439,7 +1308,7 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                 for alt_o, oar in next(iter(output_act_ratio.values()))[0].items():
                     alt = alternative_name_from_two(alt_i, alt_o, target_db)
                     alt_ent_class = (alt, (unit_source["name"],), "unit")
-                    target_db = ines_transform.add_item_to_DB(target_db, "efficiency", alt_ent_class, oar[0] / iar[0])
+                    writer.add_item("efficiency", alt_ent_class, oar[0] / iar[0])
         elif len(input_act_ratio) == 0 and len(output_act_ratio) == 1:
             pass # no eff can be defined, will use the conversion method: coefficients_only
         elif len(input_act_ratio) == 1 and len(output_act_ratio) == 0:
@@ -484,7 +1353,7 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                     summed_output = [sum(x) for x in zip(*output_values)]
                     summed_input = [sum(x) for x in zip(*input_values)]
                     alt_ent_class = (alt, (unit_source["name"],), "unit")
-                    target_db = ines_transform.add_item_to_DB(target_db, "efficiency", alt_ent_class, summed_output[0] / summed_input[0])
+                    writer.add_item("efficiency", alt_ent_class, summed_output[0] / summed_input[0])
             if len(output_values) > 1: # if there are multiple outputs, we need to fix the ratio of the flows
                 output_1 = None
                 alt_1 = None
@@ -496,12 +1365,12 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                                               '__'.join([output_names[k - 1][0], output_names[k - 1][2]]),
                                               '__'.join([output_names[k][0], output_names[k][1]]),
                                               '__'.join([output_names[k][0], output_names[k][2]]))
-                                target_db.add_entity_item(entity_class_name="unit_flow__unit_flow", entity_byname=ent_byname)
+                                add_target_item(target_db, "add_entity_item", "ignore", entity_class_name="unit_flow__unit_flow", entity_byname=ent_byname)
                                 fix_ratio = [round(o2 / o1, 6) for o2, o1 in zip(out[alto], output_1)]
-                                output_map_object.values = fix_ratio
+                                fix_ratio_map = map_with_values(output_map_object, fix_ratio)
                                 alt = alternative_name_from_two(alt_1, alto, target_db)
                                 alt_ent_class = (alt, ent_byname, "unit_flow__unit_flow")
-                                target_db = ines_transform.add_item_to_DB(target_db, "equality_ratio", alt_ent_class, output_map_object)
+                                writer.add_item("equality_ratio", alt_ent_class, fix_ratio_map)
                         output_1 = out[alto]
                         alt_1 = alto
 
@@ -524,17 +1393,17 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
             exit("Not handling multiple inputs together with multiple outputs. Error in entity: " + unit_source["name"])
         
         # Get the possible capacity of one technology unit
-        source_CapacityOfOneTechnologyUnit = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="CapacityOfOneTechnologyUnit")
+        source_CapacityOfOneTechnologyUnit = source.parameter_values("REGION__TECHNOLOGY", "CapacityOfOneTechnologyUnit", unit_source["entity_byname"])
         if len(source_CapacityOfOneTechnologyUnit) > 1:
             exit("Multiple alternatives for CapacityOfOneTechnologyUnit - not handled")
         elif len(source_CapacityOfOneTechnologyUnit) == 0:
             cap = default_unit_size
         else:
             source_CapacityOfOneTechnologyUnit = source_CapacityOfOneTechnologyUnit[0]
-            cap = api.from_database(source_CapacityOfOneTechnologyUnit["value"], "map").values[0] * capacity_unit_factor
-            if any(x != cap for x in api.from_database(source_CapacityOfOneTechnologyUnit["value"].values, "map").values):
+            cap = source_CapacityOfOneTechnologyUnit["parsed_value"].values[0] * capacity_unit_factor
+            if any(x * capacity_unit_factor != cap for x in source_CapacityOfOneTechnologyUnit["parsed_value"].values):
                 exit("CapacityOfOneTechnologyUnit has different values for different years - not handled")
-            target_db = ines_transform.add_item_to_DB(target_db, "investment_uses_integer", (unit_source["name"],), True)
+            writer.add("unit", (unit_source["name"],), "investment_uses_integer", source_CapacityOfOneTechnologyUnit["alternative_name"], True)
 
         # Place the capacity, note that the act_ratio_dict contains only one alternative
         for alt_activity, act_ratio_list in act_ratio_dict.items():
@@ -547,46 +1416,42 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
             act_ratio = act_ratio_list[0]
             unit_capacity =  cap * act_ratio
             alt_ent_class = (alt_activity, entity_byname, class_name)
-            target_db = ines_transform.add_item_to_DB(target_db, "capacity", alt_ent_class, unit_capacity)
+            writer.add_item("capacity", alt_ent_class, unit_capacity)
         
         # Pass number of unit values
         flag_limit_cumulative_investments = False
-        source_unit_residual_capacity = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="ResidualCapacity")
+        source_unit_residual_capacity = source.parameter_values("REGION__TECHNOLOGY", "ResidualCapacity", unit_source["entity_byname"])
         for param in source_unit_residual_capacity:
-            param_map = api.from_database(param["value"], "map")
-            param_map.values = [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values]
+            param_map = param["parsed_value"]
+            param_map = map_with_values(param_map, [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values])
             alt_ent_class = (param["alternative_name"], unit_byname, "unit")
-            target_db = ines_transform.add_item_to_DB(target_db, "units_existing", alt_ent_class, param_map)
-        source_unit_total_max = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="TotalAnnualMaxCapacity")
+            writer.add_item("units_existing", alt_ent_class, param_map)
+        source_unit_total_max = source.parameter_values("REGION__TECHNOLOGY", "TotalAnnualMaxCapacity", unit_source["entity_byname"])
         for param in source_unit_total_max:
-            param_map = api.from_database(param["value"], "map")
-            param_map.values = [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values]
+            param_map = param["parsed_value"]
+            param_map = map_with_values(param_map, [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values])
             alt_ent_class = (param["alternative_name"], unit_byname, "unit")
-            target_db = ines_transform.add_item_to_DB(target_db, "units_max_cumulative", alt_ent_class, param_map)
+            writer.add_item("units_max_cumulative", alt_ent_class, param_map)
             flag_limit_cumulative_investments = True
-        source_unit_total_min = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="TotalAnnualMinCapacity")
+        source_unit_total_min = source.parameter_values("REGION__TECHNOLOGY", "TotalAnnualMinCapacity", unit_source["entity_byname"])
         for param in source_unit_total_min:
-            param_map = api.from_database(param["value"], "map")
-            param_map.values = [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values]
+            param_map = param["parsed_value"]
+            param_map = map_with_values(param_map, [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values])
             alt_ent_class = (param["alternative_name"], unit_byname, "unit")
-            target_db = ines_transform.add_item_to_DB(target_db, "units_min_cumulative", alt_ent_class, param_map)
+            writer.add_item("units_min_cumulative", alt_ent_class, param_map)
             flag_limit_cumulative_investments = True
         
-        for param in TotalAnnualMaxCapacityInvestment:
-            if param["entity_byname"] == unit_source["entity_byname"]:
-                param_map = api.from_database(param["value"], "map")
-                param_map.values = [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values]
-                param_map.index_name = "period"
-                alt_ent_class = (param["alternative_name"], unit_byname, "unit")
-                target_db = ines_transform.add_item_to_DB(target_db, "units_invest_max_period", alt_ent_class, param_map)
-
-        for param in TotalAnnualMinCapacityInvestment:
-            if param["entity_byname"] == unit_source["entity_byname"]:
-                param_map = api.from_database(param["value"], "map")
-                param_map.values = [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values]
-                param_map.index_name = "period"
-                alt_ent_class = (param["alternative_name"], unit_byname, "unit")
-                target_db = ines_transform.add_item_to_DB(target_db, "units_invest_min_period", alt_ent_class, param_map)
+        for param in source.parameter_values("REGION__TECHNOLOGY", "TotalAnnualMaxCapacityInvestment", unit_source["entity_byname"]):
+            param_map = param["parsed_value"]
+            param_map = map_with_values(param_map, [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values], "period")
+            alt_ent_class = (param["alternative_name"], unit_byname, "unit")
+            writer.add_item("units_invest_max_period", alt_ent_class, param_map)
+
+        for param in source.parameter_values("REGION__TECHNOLOGY", "TotalAnnualMinCapacityInvestment", unit_source["entity_byname"]):
+            param_map = param["parsed_value"]
+            param_map = map_with_values(param_map, [x * capacity_unit_factor * act_ratio / unit_capacity for x in param_map.values], "period")
+            alt_ent_class = (param["alternative_name"], unit_byname, "unit")
+            writer.add_item("units_invest_min_period", alt_ent_class, param_map)
         
         for alt_activity, act_ratio in act_ratio_dict.items():    
             flag_allow_investments = False
@@ -594,10 +1459,9 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
             alt_fixed_cost = alt_activity
             for source_param in source_unit_investment_cost:
                 alt = source_param["alternative_name"]
-                source_param = api.from_database(source_param["value"], source_param["type"])
+                source_param = source_param["parsed_value"]
                 if isinstance(source_param, api.Map):
-                    source_param.values = [s * investment_unit_factor / a for s, a in zip(source_param.values, act_ratio)]
-                    source_param.index_name = "period"
+                    source_param = map_with_values(source_param, [s * investment_unit_factor / a for s, a in zip(source_param.values, act_ratio)], "period")
                     if max(source_param.values) > 0 and min(source_param.values) == 0.0:
                         exit("Investment cost 0 for some years and above 0 for others - don't know how to handle")
                     if min(source_param.values) > 0:
@@ -606,13 +1470,12 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                     if source_param > 0:
                         alt_inv_cost = alt_activity
                 alt_ent_class = (alt, entity_byname, class_name)
-                target_db = ines_transform.add_item_to_DB(target_db, "investment_cost", alt_ent_class, source_param)
+                writer.add_item("investment_cost", alt_ent_class, source_param)
             for source_param in source_unit_fixed_cost:
                 alt = source_param["alternative_name"]
-                source_param = api.from_database(source_param["value"], source_param["type"])
+                source_param = source_param["parsed_value"]
                 if isinstance(source_param, api.Map):
-                    source_param.values = [s * investment_unit_factor / a for s, a in zip(source_param.values, act_ratio)]
-                    source_param.index_name = "period"
+                    source_param = map_with_values(source_param, [s * investment_unit_factor / a for s, a in zip(source_param.values, act_ratio)], "period")
                     if max(source_param.values) > 0 and min(source_param.values) == 0.0:
                         exit("Fixed cost 0 for some years and above 0 for others - don't know how to handle")
                     if min(source_param.values) > 0:
@@ -621,98 +1484,70 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
                     if source_param > 0:
                         alt_fixed_cost = alt_activity
                 alt_ent_class = (alt, entity_byname, class_name)
-                target_db = ines_transform.add_item_to_DB(target_db, "fixed_cost", alt_ent_class, source_param)
+                writer.add_item("fixed_cost", alt_ent_class, source_param)
             
-            #find interest rate from either from the entity itself, region or region's default value
-            interest_rate = None
-            for source_param in source_unit_interest_rate:
-                if source_param["entity_byname"] == unit_source["entity_byname"]:
-                    interest_rate = api.from_database(source_param["value"], source_param["type"])
-                    alt = source_param["alternative_name"]
-            if not interest_rate:
-                for source_param in source_region_interest_rate:
-                    if source_param["entity_byname"][0] == unit_source["entity_byname"][0]:
-                        interest_rate = api.from_database(source_param["value"], source_param["type"])
-                        alt = source_param["alternative_name"]
-            if not interest_rate:
-                if default_discount_rate["default_value"]:
-                    interest_rate = api.from_database(default_discount_rate["default_value"], default_discount_rate["default_type"])
-                    for unit in unit_entity_alternatives:
-                        if unit["entity_byname"] == unit_source["entity_byname"]:
-                            alt = unit["entity_alternative_name"]
-            if interest_rate:
-                target_db = ines_transform.add_item_to_DB(target_db, "interest_rate", (alt, unit_byname, "unit"), interest_rate)
+            #interest rate from either from the entity itself, region or region's default value
+            if unit_source["entity_byname"] in unit_interest_rates:
+                alt, interest_rate = unit_interest_rates[unit_source["entity_byname"]]
+                writer.add_item("interest_rate", (alt, unit_byname, "unit"), interest_rate)
 
             #If lifetime exists, invesments are allowed. No costs are needed.
             for source_param in operational_life:
-                operational_life_value = api.from_database(source_param["value"], source_param["type"])
+                operational_life_value = source_param["parsed_value"]
                 if operational_life_value and operational_life_value > 0:
                     flag_allow_investments = True
 
             if flag_allow_investments:
                 if flag_limit_cumulative_investments:
-                    p_value, p_type = api.to_database("cumulative_limits")
+                    investment_method = "cumulative_limits"
                 else:
-                    p_value, p_type = api.to_database("no_limits")
+                    investment_method = "no_limits"
                 
             else:
-                p_value, p_type = api.to_database("not_allowed")
+                investment_method = "not_allowed"
             alt = alternative_name_from_two(alt_inv_cost, alt_fixed_cost, target_db)
-            added, error = target_db.add_parameter_value_item(entity_class_name="unit",
-                                                              entity_byname=unit_byname,
-                                                              parameter_definition_name="investment_method",
-                                                              alternative_name=alt,  # This is not really satisfactory, if there are values across different alternatives. Tries to do something, but it's shaky.
-                                                              value=p_value,
-                                                              type=p_type)
-            if error:
-                exit("error in trying to add investment_method: " + error)
+            # The alternative is not really satisfactory, if there are values across different alternatives. Tries to do something, but it's shaky.
+            writer.add("unit", unit_byname, "investment_method", alt, investment_method)
             for source_param in source_unit_variable_cost:
                 # Not doing this, since it's messy, instead exiting above if more than one act_ratio_dict:
                 # alt = alternative_name_from_two(source_param["alternative_name"], alt_activity, target_db)
                 alt = source_param["alternative_name"]
-                source_param = api.from_database(source_param["value"], source_param["type"])
+                source_param = source_param["parsed_value"]
                 if isinstance(source_param, api.Map):
                     if isinstance(source_param.values[0], api.Map):
                         print("Only one mode_of_operation is allowed, taking the first one.")
                         source_param = source_param.values[0]  # Bypass mode_of_operation dimension (assume there is only one)
-                    source_param.values = [s * variable_cost_unit_factor / a for s, a in zip(source_param.values, act_ratio)]
-                    source_param.index_name = "period"
+                    source_param = map_with_values(source_param, [s * variable_cost_unit_factor / a for s, a in zip(source_param.values, act_ratio)], "period")
                 else:
                     source_param = source_param * variable_cost_unit_factor / act_ratio[0]
                 alt_ent_class = (alt, entity_byname, class_name)
-                target_db = ines_transform.add_item_to_DB(target_db, "other_operational_cost", alt_ent_class, source_param)
+                writer.add_item("other_operational_cost", alt_ent_class, source_param)
 
         #add capacity factor
-        for source_capacity_factor in source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="CapacityFactor"):
+        for source_capacity_factor in source.parameter_values("REGION__TECHNOLOGY", "CapacityFactor", unit_source["entity_byname"]):
             for year_split in year_splits:
-                year_split_data = api.from_database(year_split["value"], year_split["type"])
+                year_split_data = year_split["parsed_value"]
                 profile_data_divided, p_type = get_timeslice_value(year_split_data, source_capacity_factor, "REGION__TECHNOLOGY", "CapacityFactor",
-                                                                    timeslice_indexes, datetime_indexes, 1.0, False)
-                added, error = target_db.add_parameter_value_item(entity_class_name=class_name,
-                                                        parameter_definition_name="profile_limit_upper",
-                                                        entity_byname=entity_byname,
-                                                        alternative_name=source_capacity_factor["alternative_name"],
-                                                        value=profile_data_divided,
-                                                        type=p_type)
-            target_db = ines_transform.add_item_to_DB(target_db, "profile_method", alt_ent_class, "upper_limit")
+                                                                    timeslice_gather, timeline, 1.0, False)
+                writer.add_database_value(class_name, entity_byname, "profile_limit_upper",
+                                          source_capacity_factor["alternative_name"], profile_data_divided, p_type)
+            writer.add_item("profile_method", alt_ent_class, "upper_limit")
 
 
         if (len(output_act_ratio) == 1 and len(input_act_ratio) == 0) or (len(output_act_ratio) == 0 and len(input_act_ratio) == 1):
             for alt_activity, act_ratio in act_ratio_dict.items():
                 alt_ent_class = (alt_activity, unit_byname, "unit")
-                target_db = ines_transform.add_item_to_DB(target_db, "conversion_method", alt_ent_class, "coefficients_only")
+                writer.add_item("conversion_method", alt_ent_class, "coefficients_only")
         if len(output_act_ratio) > 0 and len(input_act_ratio) > 0:
             for alt_activity, act_ratio in act_ratio_dict.items():
                 alt_ent_class = (alt_activity, unit_byname, "unit")
-                target_db = ines_transform.add_item_to_DB(target_db, "conversion_method", alt_ent_class, "constant_efficiency")
+                writer.add_item("conversion_method", alt_ent_class, "constant_efficiency")
         # If no capacity nor investment_cost defined, warn.
         if not (source_unit_residual_capacity or source_unit_investment_cost):
             print("Unit without capacity or investment_cost:" + unit_source["name"])
     
-    try:
-        target_db.commit_session("Added capacity related parameter values")
-    except:
-        print("failed to add capacity related parameter values")
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added capacity related parameter values")
 
     return target_db
 
@@ -720,7 +1555,7 @@ def process_capacities(source_db, target_db, datetime_indexes, timeslice_indexes
 def params_to_dict(params):
     dict_temp = {}
     for param in params:
-        value = api.from_database(param["value"], param["type"])
+        value = param["parsed_value"]
         if value and param["type"] == 'map':
             if isinstance(value.values[0], api.Map):
                 for val0 in value.values:
@@ -732,321 +1567,255 @@ def params_to_dict(params):
     return dict_temp
 
 
-def process_model_level(source_db, target_db):
-    discount_rate = source_db.get_parameter_definition_item(entity_class_name="REGION",
-                                                            name="DiscountRate")
-    model_entities = source_db.get_entity_items(entity_class_name="model")
+def process_model_level(source, target_db):
+    discount_rate = source.parameter_definition("REGION", "DiscountRate")
+    model_entities = source.entities("model")
+    writer = ParameterValueWriter(target_db, "discount_rate")
     for model_entity in model_entities:
-        model_entity_alternatives = source_db.get_entity_alternative_items(entity_class_name="model",
-                                                                           entity_name=model_entity["name"])
+        model_entity_alternatives = source.entity_alternatives("model", model_entity["entity_byname"])
         for model_entity_alternative in model_entity_alternatives:
-            added, error = target_db.add_parameter_value_item(entity_class_name="system",
-                                                              entity_byname=(model_entity["name"], ),
-                                                              parameter_definition_name="discount_rate",
-                                                              alternative_name=model_entity_alternative["alternative_name"],
-                                                              type=discount_rate["default_type"],
-                                                              value=discount_rate["default_value"])
-            if error:
-                exit("Error when trying to add discount_rate: " + error)
+            writer.add_database_value("system", (model_entity["name"], ), "discount_rate",
+                                      model_entity_alternative["alternative_name"], discount_rate["default_value"], discount_rate["default_type"])
 
-    try:
-        target_db.commit_session("Added special model level parameters")
-    except:
-        print("failed to add special model level parameters")
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added special model level parameters")
 
     return target_db
 
 
-def process_zero_investment_cost(source_db, target_db):
-    units = source_db.get_entity_items(entity_class_name="REGION__TECHNOLOGY")
-    alts = source_db.get_alternative_items()
-    for alt in alts:
-        for unit in units:
-            unit_alternatives = source_db.get_entity_alternative_items(entity_class_name="TECHNOLOGY",
-                                                                       entity_byname=(unit["element_name_list"][1], ))
-            if not any(unit_alt["alternative_name"] == alt["name"] and unit_alt["active"] is True for unit_alt in unit_alternatives):
-                continue
-
-            flag_invest_zero = False
-            flag_fixed_zero = False
-            flag_existing_zero = False
-            flag_operational_life_zero = False
-            invest_cost = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY",
-                                                             entity_byname=unit["entity_byname"],
-                                                             alternative_name=alt["name"],
-                                                             parameter_definition_name="CapitalCost")
-            fixed_cost = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY",
-                                                            entity_byname=unit["entity_byname"],
-                                                            alternative_name=alt["name"],
-                                                            parameter_definition_name="FixedCost")
-            existing = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY",
-                                                          entity_byname=unit["entity_byname"],
-                                                          alternative_name=alt["name"],
-                                                          parameter_definition_name="ResidualCapacity")
-            operational_life = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY",
-                                                          entity_byname=unit["entity_byname"],
-                                                          alternative_name=alt["name"],
-                                                          parameter_definition_name="OperationalLife")
-            
-            if not invest_cost:
-                param_def_item = source_db.get_parameter_definition_item(entity_class_name="REGION__TECHNOLOGY", name=unit["entity_byname"]) 
-                if param_def_item and param_def_item["default_value"] and param_def_item["default_value"] > 0:
-                    invest_cost = param_def_item["default_value"]
-            if not fixed_cost:
-                param_def_item = source_db.get_parameter_definition_item(entity_class_name="REGION__TECHNOLOGY", name=unit["entity_byname"]) 
-                if param_def_item and param_def_item["default_value"] and param_def_item["default_value"] > 0:
-                    fixed_cost = param_def_item["default_value"]
-            if not existing:
-                param_def_item = source_db.get_parameter_definition_item(entity_class_name="REGION__TECHNOLOGY", name=unit["entity_byname"]) 
-                if param_def_item and param_def_item["default_value"] and param_def_item["default_value"] > 0:
-                    existing = param_def_item["default_value"]
-            if not operational_life:
-                param_def_item = source_db.get_parameter_definition_item(entity_class_name="REGION__TECHNOLOGY", name=unit["entity_byname"]) 
-                if param_def_item and param_def_item["default_value"] and param_def_item["default_value"] > 0:
-                    operational_life = param_def_item["default_value"]
-
-            if invest_cost:
-                for i in invest_cost["parsed_value"].values:
-                    if i == 0:
-                        flag_invest_zero = True
-                        break
-            else:
-                flag_invest_zero = True
-            if fixed_cost:
-                for f in fixed_cost["parsed_value"].values:
-                    if f == 0:
-                        flag_fixed_zero = True
-                        break
-            else:
-                flag_fixed_zero = True
-            if existing:
-                for e in existing["parsed_value"].values:
-                    if e == 0:
-                        flag_existing_zero = True
-                        break
-            else:
-                flag_existing_zero = True
-            if operational_life:
-                for e in existing["parsed_value"].values:
-                    if e == 0:
-                        flag_operational_life_zero = True
-                        break
-            else:
-                flag_operational_life_zero = True
-
-            if flag_existing_zero and flag_operational_life_zero:
-                break #if no operational life, unit cannot be invested in osemosys, if also no residual capacity, the unit does not exist.
-
-            if flag_invest_zero and flag_fixed_zero and flag_existing_zero:
-                variable_cost = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY",
-                                                                   entity_byname=unit["entity_byname"],
-                                                                   alternative_name=alt["name"],
-                                                                   parameter_definition_name="VariableCost")
-                p_value, p_type = api.to_database(unlimited_unit_capacity / default_unit_size)
-                added, updated, error = target_db.add_update_parameter_value_item(entity_class_name="unit",
-                                                                                  entity_byname=(unit["name"],),
-                                                                                  alternative_name=alt["name"],
-                                                                                  parameter_definition_name="units_existing",
-                                                                                  type=p_type,
-                                                                                  value=p_value)
-                if error:
-                    exit("Failed to add existing capacity for a unit without investment cost or existing capacity: " + error)
-
-                if not variable_cost:
-                    print("Warning: unit " + unit["name"] + " does not have investment cost, existing capacity nor variable cost in alternative " + alt["name"] + ". Maybe not limited.")
+def process_zero_investment_cost(source, target_db):
+    units = source.entities("REGION__TECHNOLOGY")
+    writer = ParameterValueWriter(target_db, "units without investment costs and existing capacity")
+    cost_params = ["CapitalCost", "FixedCost", "ResidualCapacity", "OperationalLife"]
+    table = ParameterTable(source, "REGION__TECHNOLOGY", units, cost_params, has_zero_value)
+
+    # A parameter counts as zero if one of its values is zero or if it has no value and no default value above zero
+    zero = table.test.copy()
+    for p, param_name in enumerate(cost_params):
+        param_def_item = source.parameter_definition("REGION__TECHNOLOGY", param_name)
+        default_value = param_def_item["parsed_value"] if param_def_item else None
+        default_is_positive = isinstance(default_value, (int, float)) and default_value > 0
+        zero[:, :, p] |= ~table.exists[:, :, p] & (not default_is_positive)
+    invest_zero, fixed_zero, existing_zero, operational_life_zero = (zero[:, :, p] for p in range(len(cost_params)))
+
+    active = np.zeros(table.exists.shape[0:2], dtype=bool)
+    alternative_positions = {alternative: a for a, alternative in enumerate(table.alternatives)}
+    for u, unit in enumerate(units):
+        for unit_alt in source.entity_alternatives("TECHNOLOGY", (unit["element_name_list"][1], )):
+            if unit_alt["active"] is True and unit_alt["alternative_name"] in alternative_positions:
+                active[u, alternative_positions[unit_alt["alternative_name"]]] = True
+
+    #if no operational life, unit cannot be invested in osemosys, if also no residual capacity, the unit does not exist.
+    unit_exists = ~(existing_zero & operational_life_zero)
+    unlimited = active & unit_exists & invest_zero & fixed_zero & existing_zero
+    unit__nodes = group_by_byname(source.entities("REGION__TECHNOLOGY__FUEL"), 2)
+
+    for a, u in np.argwhere(unlimited.T):
+        unit = units[u]
+        alt_name = table.alternatives[a]
+        variable_cost = source.parameter_value("REGION__TECHNOLOGY", unit["entity_byname"], "VariableCost", alt_name)
+        writer.add("unit", (unit["name"],), "units_existing", alt_name, unlimited_unit_capacity / default_unit_size)
+
+        if not variable_cost:
+            print("Warning: unit " + unit["name"] + " does not have investment cost, existing capacity nor variable cost in alternative " + alt_name + ". Maybe not limited.")
+            continue
+        variable_cost_list = variable_cost["parsed_value"].values[0].values
+        # If unit has variable cost higher than the penalty boundary setting, then move the variable cost to penalty costs
+        if max(variable_cost_list) >= unit_to_penalty_boundary:
+            add_target_item(target_db, "add_update_entity_alternative_item", "Failed to inactivate unit that was being turned into node penalty cost: ",
+                            entity_class_name="unit", entity_byname=(unit["name"],), alternative_name=alt_name, active=False)
+            for unit__node in unit__nodes.get(unit["entity_byname"], []):
+                oa_ratio = source.parameter_value("REGION__TECHNOLOGY__FUEL", unit__node["entity_byname"], "OutputActivityRatio", alt_name)
+                if not oa_ratio:
                     continue
-                variable_cost_list = variable_cost["parsed_value"].values[0].values
-                # If unit has variable cost higher than the penalty boundary setting, then move the variable cost to penalty costs
-                if max(variable_cost_list) >= unit_to_penalty_boundary:
-                    added, updated, error = target_db.add_update_entity_alternative_item(entity_class_name="unit",
-                                                                                         entity_byname=(unit["name"],),
-                                                                                         alternative_name=alt["name"],
-                                                                                         active=False)
-                    if error:
-                        exit("Failed to inactivate unit that was being turned into node penalty cost: " + error)
-                    unit__nodes = source_db.get_entity_items(entity_class_name="REGION__TECHNOLOGY__FUEL")
-                    for unit__node in unit__nodes:
-                        if unit__node["entity_byname"][0:2] == unit["entity_byname"]:
-                            oa_ratio = source_db.get_parameter_value_item(entity_class_name="REGION__TECHNOLOGY__FUEL",
-                                                                          entity_byname=unit__node["entity_byname"],
-                                                                          alternative_name=alt["name"],
-                                                                          parameter_definition_name="OutputActivityRatio")
-                            node_name = unit__node["entity_byname"][0] + "__" + unit__node["entity_byname"][2]
-                            # Ignore mode of operation and just take the output activity ratios
-                            oa_ratio_list = oa_ratio["parsed_value"].values[0].values
-                            penalty_up = [oa * var for oa, var in zip(oa_ratio_list, variable_cost_list)]
-                            penalty_up_map = api.Map(indexes=oa_ratio["parsed_value"].values[0].indexes,
-                                                          values=penalty_up,
-                                                          index_name="period")
-                            p_value, p_type = api.to_database(penalty_up_map)
-                            added, updated, error = target_db.add_update_parameter_value_item(entity_class_name="node",
-                                                                                              entity_byname=(node_name,),
-                                                                                              alternative_name=alt["name"],
-                                                                                              parameter_definition_name="penalty_upward",
-                                                                                              type=p_type,
-                                                                                              value=p_value)
-                            if error:
-                                exit(
-                                    "Failed to add penalty price based on the variable cost of a unit without investment cost or existing capacity but node with demand: " + error)
-    try:
-        target_db.commit_session("Inactivated units without investment costs and existing capacity. Instead use commodity price of the node")
-    except:
-        print("failed to process units without investment costs and existing capacity")
+                node_name = unit__node["entity_byname"][0] + "__" + unit__node["entity_byname"][2]
+                # Ignore mode of operation and just take the output activity ratios
+                oa_ratio_list = oa_ratio["parsed_value"].values[0].values
+                penalty_up = [oa * var for oa, var in zip(oa_ratio_list, variable_cost_list)]
+                penalty_up_map = api.Map(indexes=oa_ratio["parsed_value"].values[0].indexes,
+                                              values=penalty_up,
+                                              index_name="period")
+                writer.add("node", (node_name,), "penalty_upward", alt_name, penalty_up_map)
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Inactivated units without investment costs and existing capacity. Instead use commodity price of the node")
     return target_db
 
-def process_demands(source_db, target_db, datetime_indexes):
+class ParameterTable:
+    """Parameter values of the entities of one class pivoted to entity x alternative x parameter arrays.
+
+    exists[e, a, p] tells if entity e has a value for parameter p in alternative a. test[e, a, p] is
+    value_test(parsed value) where a value exists and False elsewhere. Alternatives are those of the source.
+    """
+    def __init__(self, source, class_name, entities, param_names, value_test=None):
+        self.alternatives = [alternative["name"] for alternative in source.alternatives]
+        entity_positions = {entity["entity_byname"]: e for e, entity in enumerate(entities)}
+        alternative_positions = {alternative: a for a, alternative in enumerate(self.alternatives)}
+        self.exists = np.zeros((len(entities), len(self.alternatives), len(param_names)), dtype=bool)
+        self.test = np.zeros(self.exists.shape, dtype=bool)
+        for p, param_name in enumerate(param_names):
+            for param in source.parameter_values(class_name, param_name):
+                e = entity_positions.get(param["entity_byname"])
+                a = alternative_positions.get(param["alternative_name"])
+                if e is None or a is None:
+                    continue
+                self.exists[e, a, p] = True
+                if value_test:
+                    self.test[e, a, p] = value_test(param["parsed_value"])
+
+def has_zero_value(value):
+    values = value.values if isinstance(value, api.IndexedValue) else [value]
+    return any(x == 0 for x in values)
 
-    region__fuels = source_db.get_entity_items(entity_class_name="REGION__FUEL")
-    AccumulatedAnnualDemand = source_db.get_parameter_value_items(entity_class_name="REGION__FUEL", parameter_definition_name="AccumulatedAnnualDemand")    
-    SpecifiedAnnualDemand = source_db.get_parameter_value_items(entity_class_name="REGION__FUEL", parameter_definition_name="SpecifiedAnnualDemand")
+def process_demands(source, target_db, timeline):
+
+    region__fuels = source.entities("REGION__FUEL")
+    AccumulatedAnnualDemand = source.parameter_values("REGION__FUEL", "AccumulatedAnnualDemand")
+    SpecifiedAnnualDemand = source.parameter_values("REGION__FUEL", "SpecifiedAnnualDemand")
+    writer = ParameterValueWriter(target_db, "demands")
 
     for region_fuel in region__fuels:
         for param in AccumulatedAnnualDemand:
             if param["entity_byname"] == region_fuel["entity_byname"]:
                 alt_ent_class = [param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node"] 
-                param_map = api.from_database(param["value"], param["type"])
+                param_map = param["parsed_value"]
                 if isinstance(param_map, float):
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_annual", alt_ent_class, -param_map * demand_unit_factor)
+                    writer.add_item("flow_annual", alt_ent_class, -param_map * demand_unit_factor)
                 else:
-                    param_map.values = [-x * demand_unit_factor  for x in param_map.values]
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_annual", alt_ent_class, param_map)
+                    param_map = map_with_values(param_map, [-x * demand_unit_factor  for x in param_map.values])
+                    writer.add_item("flow_annual", alt_ent_class, param_map)
                 
         for param in SpecifiedAnnualDemand:
             if param["entity_byname"] == region_fuel["entity_byname"]:
                 alt_ent_class = [param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node"] 
-                param_map = api.from_database(param["value"], param["type"])
+                param_map = param["parsed_value"]
                 if isinstance(param_map, float):
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_annual", alt_ent_class, param_map * demand_unit_factor)
+                    writer.add_item("flow_annual", alt_ent_class, param_map * demand_unit_factor)
                 else:
-                    param_map.values = [x * demand_unit_factor  for x in param_map.values]
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_annual", alt_ent_class, param_map)
-                target_db = ines_transform.add_item_to_DB(target_db, "flow_scaling_method", alt_ent_class, "scale_to_annual")
+                    param_map = map_with_values(param_map, [x * demand_unit_factor  for x in param_map.values])
+                    writer.add_item("flow_annual", alt_ent_class, param_map)
+                writer.add_item("flow_scaling_method", alt_ent_class, "scale_to_annual")
         
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added demands")
     return target_db
 
-def process_storages(source_db, target_db):
+def process_storages(source, target_db):
 
     ## Create relationships. OSEMOSYS can have the same technology charging and discharging a storage.
-    region__storages = source_db.get_entity_items(entity_class_name="REGION__STORAGE")
-    technologys = source_db.get_entity_items(entity_class_name="TECHNOLOGY")
-    TechnologyFromStorage = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__STORAGE",
-                                                parameter_definition_name="TechnologyFromStorage")
-    TechnologyToStorage = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__STORAGE",
-                                                parameter_definition_name="TechnologyToStorage")
-    StorageLevelStart = get_parameter_values_with_default(source_db, "REGION__STORAGE", "StorageLevelStart", use_default = True, ignore_default_value_of = 0.0)
-    ResidualStorageCapacity = get_parameter_values_with_default(source_db, "REGION__STORAGE", "ResidualStorageCapacity", use_default = True, ignore_default_value_of = 0.0)
-    CapitalCostStorage = get_parameter_values_with_default(source_db, "REGION__STORAGE", "CapitalCostStorage", use_default = True, ignore_default_value_of = 0.0)
-    MinStorageCharge = get_parameter_values_with_default(source_db, "REGION__STORAGE", "MinStorageCharge", use_default = True, ignore_default_value_of = 0.0)
-    StorageMaxChargeRate = get_parameter_values_with_default(source_db, "REGION__STORAGE", "StorageMaxChargeRate", use_default = True, ignore_default_value_of = 0.0)
-    StorageMaxDischargeRate = get_parameter_values_with_default(source_db, "REGION__STORAGE", "StorageMaxDischargeRate", use_default = True, ignore_default_value_of = 0.0)
-    DiscountRateStorage = get_parameter_values_with_default(source_db, "REGION__STORAGE", "DiscountRateStorage", use_default = True, ignore_default_value_of = 0.0)
+    region__storages = source.entities("REGION__STORAGE")
+    TechnologyFromStorage = source.parameter_values("REGION__TECHNOLOGY__STORAGE", "TechnologyFromStorage")
+    TechnologyToStorage = source.parameter_values("REGION__TECHNOLOGY__STORAGE", "TechnologyToStorage")
+    StorageLevelStart = get_parameter_values_with_default(source, "REGION__STORAGE", "StorageLevelStart", use_default = True, ignore_default_value_of = 0.0)
+    ResidualStorageCapacity = get_parameter_values_with_default(source, "REGION__STORAGE", "ResidualStorageCapacity", use_default = True, ignore_default_value_of = 0.0)
+    CapitalCostStorage = get_parameter_values_with_default(source, "REGION__STORAGE", "CapitalCostStorage", use_default = True, ignore_default_value_of = 0.0)
+    MinStorageCharge = get_parameter_values_with_default(source, "REGION__STORAGE", "MinStorageCharge", use_default = True, ignore_default_value_of = 0.0)
+    StorageMaxChargeRate = get_parameter_values_with_default(source, "REGION__STORAGE", "StorageMaxChargeRate", use_default = True, ignore_default_value_of = 0.0)
+    StorageMaxDischargeRate = get_parameter_values_with_default(source, "REGION__STORAGE", "StorageMaxDischargeRate", use_default = True, ignore_default_value_of = 0.0)
+    DiscountRateStorage = get_parameter_values_with_default(source, "REGION__STORAGE", "DiscountRateStorage", use_default = True, ignore_default_value_of = 0.0)
+    writer = ParameterValueWriter(target_db, "storage parameters")
+
+    # (region, storage) -> technology -> first TechnologyFromStorage / TechnologyToStorage of the technology
+    from_storage_techs = storage_technologies(TechnologyFromStorage)
+    to_storage_techs = storage_technologies(TechnologyToStorage)
     
     for rs in region__storages:
         storage_capacity = None
-        for technology in technologys:
-            fromS = False
-            toS = False
-            for TechFS in TechnologyFromStorage: 
-                if TechFS["entity_byname"][1] == technology["entity_byname"][0] and TechFS["entity_byname"][0] == rs["entity_byname"][0] and TechFS["entity_byname"][2] == rs["entity_byname"][1]:
-                    fromS = True
-            for TechTS in TechnologyToStorage: 
-                if TechTS["entity_byname"][1] == technology["entity_byname"][0] and TechTS["entity_byname"][0] == rs["entity_byname"][0] and TechTS["entity_byname"][2] == rs["entity_byname"][1]:
-                    toS = True
-            unit_name = f'{TechFS["entity_byname"][0]+"__"+TechFS["entity_byname"][1]}'
-            
-            if fromS and toS:
+        node_name = rs["entity_byname"][0] + "__" + rs["entity_byname"][1]
+        from_techs = from_storage_techs.get(rs["entity_byname"], {})
+        to_techs = to_storage_techs.get(rs["entity_byname"], {})
+        for technology in dict.fromkeys(itertools.chain(from_techs, to_techs)):
+            unit_name = rs["entity_byname"][0] + "__" + technology
+            if technology in from_techs and technology in to_techs:
                 unit_conversion_method = "two_way_linear"
-                p_value, p_type = api.to_database(unit_conversion_method)
-                added, updated, error = target_db.add_update_parameter_value_item(entity_class_name="unit",
-                                                                    entity_byname=(unit_name,),
-                                                                    alternative_name=TechFS["alternative_name"],
-                                                                    parameter_definition_name="conversion_method",
-                                                                    type=p_type,
-                                                                    value=p_value)   
-            if fromS:
+                writer.add("unit", (unit_name,), "conversion_method", from_techs[technology]["alternative_name"], unit_conversion_method)
+            if technology in from_techs:
                 # add node_toUnit relationship
-                entity_byname = (rs["entity_byname"][0] + "__" + rs["entity_byname"][1], unit_name)
-                ines_transform.assert_success(target_db.add_entity_item(entity_class_name='node__to_unit', entity_byname=entity_byname), warn=True)
-            if toS:
+                entity_byname = (node_name, unit_name)
+                add_target_item(target_db, "add_entity_item", "warn", entity_class_name='node__to_unit', entity_byname=entity_byname)
+            if technology in to_techs:
                 # add unit_toNode relationship
-                entity_byname = (unit_name, rs["entity_byname"][0] + "__" + rs["entity_byname"][1])
-                ines_transform.assert_success(target_db.add_entity_item(entity_class_name='unit__to_node', entity_byname=entity_byname), warn=True)
+                entity_byname = (unit_name, node_name)
+                add_target_item(target_db, "add_entity_item", "warn", entity_class_name='unit__to_node', entity_byname=entity_byname)
     
-        for param in ResidualStorageCapacity:
-            if param["entity_byname"] == rs["entity_byname"]:
-                alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
-                param_map = api.from_database(param["value"], param["type"])
-                if isinstance(param_map, float):
-                    target_db = ines_transform.add_item_to_DB(target_db, "storage_capacity", alt_ent_class, param_map * storage_unit_factor)
-                    target_db = ines_transform.add_item_to_DB(target_db, "storages_existing", alt_ent_class, 1.0)
-                    storage_capacity = param_map
-                else:
-                    storage_capacity = param_map.values[0]
-                    param_map.values = [x / storage_capacity for x in param_map.values]
-                    target_db = ines_transform.add_item_to_DB(target_db, "storage_capacity", alt_ent_class, storage_capacity * storage_unit_factor)
-                    target_db = ines_transform.add_item_to_DB(target_db, "storages_existing", alt_ent_class, param_map)
-                    storage_capacity = storage_capacity
-
-        for param in StorageLevelStart:
-            if param["entity_byname"] == rs["entity_byname"]:
-                alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
-                param_float = api.from_database(param["value"], param["type"])
-                if isinstance(param_float, float) and storage_capacity:
-                    target_db = ines_transform.add_item_to_DB(target_db, "storage_state_fix", alt_ent_class, param_float/storage_capacity)
-                    target_db = ines_transform.add_item_to_DB(target_db, "storage_state_fix_method", alt_ent_class, "fix_start")
-
-    for param in CapitalCostStorage:
+        for param in ResidualStorageCapacity.get(rs["entity_byname"], []):
+            alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
+            param_map = param["parsed_value"]
+            if isinstance(param_map, float):
+                writer.add_item("storage_capacity", alt_ent_class, param_map * storage_unit_factor)
+                writer.add_item("storages_existing", alt_ent_class, 1.0)
+                storage_capacity = param_map
+            else:
+                storage_capacity = param_map.values[0]
+                param_map = map_with_values(param_map, [x / storage_capacity for x in param_map.values])
+                writer.add_item("storage_capacity", alt_ent_class, storage_capacity * storage_unit_factor)
+                writer.add_item("storages_existing", alt_ent_class, param_map)
+                storage_capacity = storage_capacity
+
+        for param in StorageLevelStart.get(rs["entity_byname"], []):
+            alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
+            param_float = param["parsed_value"]
+            if isinstance(param_float, float) and storage_capacity:
+                writer.add_item("storage_state_fix", alt_ent_class, param_float/storage_capacity)
+                writer.add_item("storage_state_fix_method", alt_ent_class, "fix_start")
+
+    for param in itertools.chain.from_iterable(CapitalCostStorage.values()):
         alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
-        param_map = api.from_database(param["value"], param["type"])
+        param_map = param["parsed_value"]
         if isinstance(param_map, float):
-            target_db = ines_transform.add_item_to_DB(target_db, "storage_investment_cost", alt_ent_class, param_map * storage_investment_unit_factor)
+            writer.add_item("storage_investment_cost", alt_ent_class, param_map * storage_investment_unit_factor)
         else:
-            param_map.values = [x * storage_investment_unit_factor for x in param_map.values]
-            target_db = ines_transform.add_item_to_DB(target_db, "storage_investment_cost", alt_ent_class, param_map)
+            param_map = map_with_values(param_map, [x * storage_investment_unit_factor for x in param_map.values])
+            writer.add_item("storage_investment_cost", alt_ent_class, param_map)
 
-    for param in MinStorageCharge:
+    for param in itertools.chain.from_iterable(MinStorageCharge.values()):
         alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
-        param_map = api.from_database(param["value"], param["type"])
-        target_db = ines_transform.add_item_to_DB(target_db, "storage_state_lower_limit", alt_ent_class, param_map)
+        param_map = param["parsed_value"]
+        writer.add_item("storage_state_lower_limit", alt_ent_class, param_map)
 
-    for param in StorageMaxChargeRate:
+    for param in itertools.chain.from_iterable(StorageMaxChargeRate.values()):
         #create set
         set_name = f"set_charge_{param["entity_byname"][0]}_{param["entity_byname"][1]}"
         target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-        constant_value =  api.from_database(param["value"], param["type"])
-        target_db = ines_transform.add_item_to_DB(target_db, "flow_max_instant", [param["alternative_name"],(set_name,),'set'], constant_value * capacity_unit_factor) 
+        constant_value =  param["parsed_value"]
+        writer.add_item("flow_max_instant", [param["alternative_name"],(set_name,),'set'], constant_value * capacity_unit_factor) 
         #add flows to the set
-        for TechTS in TechnologyToStorage:
+        for TechTS in to_storage_techs.get(param["entity_byname"], {}).values():
             entity_byname = TechTS["entity_byname"]
-            if TechTS["entity_byname"][0] == param["entity_byname"][0] and TechTS["entity_byname"][2] == param["entity_byname"][1]:
-                ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                        entity_byname=(set_name, entity_byname[0] + "__" + entity_byname[1], entity_byname[0] + "__" + entity_byname[2])), 
-                                                                        warn=True)
+            add_target_item(target_db, "add_entity_item", "warn", entity_class_name='set__unit_flow', 
+                            entity_byname=(set_name, entity_byname[0] + "__" + entity_byname[1], entity_byname[0] + "__" + entity_byname[2]))
         
-    for param in StorageMaxDischargeRate:
+    for param in itertools.chain.from_iterable(StorageMaxDischargeRate.values()):
         #create set
         set_name = f"set_discharge_{param["entity_byname"][0]}_{param["entity_byname"][1]}"
         target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-        constant_value =  api.from_database(param["value"], param["type"])
-        target_db = ines_transform.add_item_to_DB(target_db, "flow_max_instant", [param["alternative_name"],(set_name,),'set'], constant_value* capacity_unit_factor) 
+        constant_value =  param["parsed_value"]
+        writer.add_item("flow_max_instant", [param["alternative_name"],(set_name,),'set'], constant_value* capacity_unit_factor) 
         #add flows to the set
-        for TechFS in TechnologyFromStorage:
+        for TechFS in from_storage_techs.get(param["entity_byname"], {}).values():
             entity_byname = TechFS["entity_byname"]
-            if TechFS["entity_byname"][0] == param["entity_byname"][0] and TechFS["entity_byname"][2] == param["entity_byname"][1]:
-                ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                        entity_byname=(set_name, entity_byname[0] + "__" + entity_byname[2], entity_byname[0] + "__" + entity_byname[1])), 
-                                                                        warn=True)
+            add_target_item(target_db, "add_entity_item", "warn", entity_class_name='set__unit_flow', 
+                            entity_byname=(set_name, entity_byname[0] + "__" + entity_byname[2], entity_byname[0] + "__" + entity_byname[1]))
     
-    for param in DiscountRateStorage:
+    for param in itertools.chain.from_iterable(DiscountRateStorage.values()):
         alt_ent_class = (param["alternative_name"], (param["entity_byname"][0]+"__"+param["entity_byname"][1],), "node")
-        param_float = api.from_database(param["value"], param["type"])
+        param_float = param["parsed_value"]
         if not param_float:
             param_float = default_interest_rate
-        target_db = ines_transform.add_item_to_DB(target_db, "storage_interest_rate", alt_ent_class, param_float)
+        writer.add_item("storage_interest_rate", alt_ent_class, param_float)
 
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added storage parameters")
     return target_db
 
-def process_reserves(source_db, target_db, timeslice_indexes):
+def storage_technologies(params):
+    # (region, storage) -> technology -> first parameter value record of the technology for that storage
+    technologies = {}
+    for param in params:
+        region, technology, storage = param["entity_byname"]
+        technologies.setdefault((region, storage), {}).setdefault(technology, param)
+    return technologies
+
+def process_reserves(source, target_db, timeslice_indexes):
 
     # This constraint would be possible with user constraints:
     # sum(flow_from_the_nodes) <= reserve_margin * sum(capacity of the units)
@@ -1058,19 +1827,30 @@ def process_reserves(source_db, target_db, timeslice_indexes):
 
     return target_db
 
-def process_emissions(source_db, target_db):
+def process_emissions(source, target_db):
 
-    EmissionActivityRatio = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__EMISSION",parameter_definition_name="EmissionActivityRatio")
-    EmissionsPenalty = source_db.get_parameter_value_items(entity_class_name="REGION__EMISSION",parameter_definition_name="EmissionsPenalty")
-    AnnualExogenousEmission = source_db.get_parameter_value_items(entity_class_name="REGION__EMISSION",parameter_definition_name="AnnualExogenousEmission")
-    AnnualEmissionLimit = source_db.get_parameter_value_items(entity_class_name="REGION__EMISSION",parameter_definition_name="AnnualEmissionLimit")
-    ModelPeriodExogenousEmission = source_db.get_parameter_value_items(entity_class_name="REGION__EMISSION",parameter_definition_name="ModelPeriodExogenousEmission")
-    ModelPeriodEmissionLimit = source_db.get_parameter_value_items(entity_class_name="REGION__EMISSION",parameter_definition_name="ModelPeriodEmissionLimit")
+    EmissionActivityRatio = source.parameter_values("REGION__TECHNOLOGY__EMISSION", "EmissionActivityRatio")
+    EmissionsPenalty = source.parameter_values("REGION__EMISSION", "EmissionsPenalty")
+    AnnualExogenousEmission = source.parameter_values("REGION__EMISSION", "AnnualExogenousEmission")
+    AnnualEmissionLimit = source.parameter_values("REGION__EMISSION", "AnnualEmissionLimit")
+    ModelPeriodExogenousEmission = source.parameter_values("REGION__EMISSION", "ModelPeriodExogenousEmission")
+    ModelPeriodEmissionLimit = source.parameter_values("REGION__EMISSION", "ModelPeriodEmissionLimit")
 
-    output_act_ratios = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__FUEL", parameter_definition_name="OutputActivityRatio")
+    output_act_ratios = source.parameter_values("REGION__TECHNOLOGY__FUEL", "OutputActivityRatio")
+    writer = ParameterValueWriter(target_db, "emission parameters")
+
+    # (region, technology) -> OutputActivityRatios and (region, emission) -> exogenous emissions
+    output_links = group_by_byname(output_act_ratios, 2)
+    annual_exogenous = group_by_byname(AnnualExogenousEmission, 2)
+    model_period_exogenous = group_by_byname(ModelPeriodExogenousEmission, 2)
+    emission_type = EmissionClassifier(emission_types)
 
     for param in EmissionActivityRatio:
-        param_map = api.from_database(param["value"], param["type"])
+        #check if co2, nox or so2
+        emission = emission_type(param["entity_byname"][2])
+        if emission is None:
+            continue
+        param_map = param["parsed_value"]
         if isinstance(param_map, api.Map):
             print("INES supports only constant emission rates, taking the first value of the map")
             if isinstance(param_map.values[0], api.Map):
@@ -1078,277 +1858,225 @@ def process_emissions(source_db, target_db):
             else:
                 param_map = param_map.values[0]
         
-        #check if co2 or not
-        if any(x in param["entity_byname"][2] for x in ["CO2", "co2", "C02"]):
+        if emission == "co2":
             #add commodity node
             param_name = "co2_content"
-            for oa_ratio in output_act_ratios:
-                if oa_ratio["entity_byname"][0] == param["entity_byname"][0] and oa_ratio["entity_byname"][1] == param["entity_byname"][1]:
-                    oa_ratio_val = oa_ratio["parsed_value"].values[0].values[0]
-                    node_name = f'{oa_ratio["entity_byname"][1]}_CO2_commodity'
-                    target_db = add_entity_and_entity_alternative(target_db, 'node', (node_name,), param["alternative_name"])
-                    entity_byname = (node_name, oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][1],)
-                    ines_transform.assert_success(target_db.add_entity_item(entity_class_name='node__to_unit', entity_byname=entity_byname), warn=True)
-                    alt_ent_class = (param["alternative_name"], (node_name,), "node")
-                    target_db = ines_transform.add_item_to_DB(target_db, param_name, alt_ent_class, param_map*oa_ratio_val)
-                    target_db = ines_transform.add_item_to_DB(target_db, "node_type", alt_ent_class, "commodity")
+            for oa_ratio in output_links.get(param["entity_byname"][0:2], []):
+                oa_ratio_val = oa_ratio["parsed_value"].values[0].values[0]
+                node_name = f'{oa_ratio["entity_byname"][1]}_CO2_commodity'
+                target_db = add_entity_and_entity_alternative(target_db, 'node', (node_name,), param["alternative_name"])
+                entity_byname = (node_name, oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][1],)
+                add_target_item(target_db, "add_entity_item", "warn", entity_class_name='node__to_unit', entity_byname=entity_byname)
+                alt_ent_class = (param["alternative_name"], (node_name,), "node")
+                writer.add_item(param_name, alt_ent_class, param_map*oa_ratio_val)
+                writer.add_item("node_type", alt_ent_class, "commodity")
         else:
-            if any(x in param["entity_byname"][2] for x in ["NOX", "nox"]):
-                param_name = "nox_emission_rate"
-            elif any(x in param["entity_byname"][2] for x in ["SO2", "so2", "S02"]):
-                param_name = "so2_emission_rate"
-            else:
-                continue
-            for oa_ratio in output_act_ratios:
-                if oa_ratio["entity_byname"][0] == param["entity_byname"][0] and oa_ratio["entity_byname"][1] == param["entity_byname"][1]:
-                    oa_ratio_val = oa_ratio["parsed_value"].values[0].values[0]
-                    entity_byname = (oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][1], oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][2])
-                    alt_ent_class = (param["alternative_name"], entity_byname, "unit__to_node")
-                    target_db = ines_transform.add_item_to_DB(target_db, param_name, alt_ent_class, param_map*oa_ratio_val)
+            param_name = emission + "_emission_rate"
+            for oa_ratio in output_links.get(param["entity_byname"][0:2], []):
+                oa_ratio_val = oa_ratio["parsed_value"].values[0].values[0]
+                entity_byname = (oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][1], oa_ratio["entity_byname"][0] + "__" + oa_ratio["entity_byname"][2])
+                alt_ent_class = (param["alternative_name"], entity_byname, "unit__to_node")
+                writer.add_item(param_name, alt_ent_class, param_map*oa_ratio_val)
 
     for param in EmissionsPenalty:
-        if any(x in param["entity_byname"][1] for x in ["CO2", "co2", "C02"]):
-            param_name = "co2_price"
-        elif any(x in param["entity_byname"][1] for x in ["NOX", "nox"]):
-            param_name = "nox_price"
-        elif any(x in param["entity_byname"][1] for x in ["SO2", "so2", "S02"]):
-            param_name = "so2_price"
-        else:
+        emission = emission_type(param["entity_byname"][1])
+        if emission is None:
             continue
-        param_map = api.from_database(param["value"], param["type"])
+        param_map = param["parsed_value"]
         alt_ent_class = (param["alternative_name"], (param["entity_byname"][0],), "set")
-        target_db = ines_transform.add_item_to_DB(target_db, param_name, alt_ent_class, param_map)
+        writer.add_item(emission + "_price", alt_ent_class, param_map)
 
     for param in AnnualEmissionLimit:
-        if any(x in param["entity_byname"][1] for x in ["CO2", "co2", "C02"]):
-            param_name = "co2_max_period"
-        elif any(x in param["entity_byname"][1] for x in ["NOX", "nox"]):
-            param_name = "nox_max_period"
-        elif any(x in param["entity_byname"][1] for x in ["SO2", "so2", "S02"]):
-            param_name = "so2_max_period"
-        else:
+        emission = emission_type(param["entity_byname"][1])
+        if emission is None:
             continue
-        param_map = api.from_database(param["value"], param["type"])
+        param_map = param["parsed_value"]
         alt_ent_class = (param["alternative_name"], (param["entity_byname"][0],), "set")
         #subract exogenous emissions, as they are not in INES spec
-        for Exo in AnnualExogenousEmission:
-            if Exo["entity_byname"][0] == param["entity_byname"][0] and Exo["entity_byname"][1] == param["entity_byname"][1]:
-                exo_map = api.from_database(Exo["value"], Exo["type"])
-                if isinstance(exo_map, api.Map):
-                    exo_values = exo_map.values
-                    param_map.values = [x - y for x, y in zip(param_map.values, exo_values)]
-                elif isinstance(exo_map, float):
-                    param_map.values = [x-exo_map for x in param_map.values]
-        target_db = ines_transform.add_item_to_DB(target_db, param_name, alt_ent_class, param_map)
+        for Exo in annual_exogenous.get(param["entity_byname"], []):
+            exo_map = Exo["parsed_value"]
+            if isinstance(exo_map, api.Map):
+                exo_values = exo_map.values
+                param_map = map_with_values(param_map, [x - y for x, y in zip(param_map.values, exo_values)])
+            elif isinstance(exo_map, float):
+                param_map = map_with_values(param_map, [x-exo_map for x in param_map.values])
+        writer.add_item(emission + "_max_period", alt_ent_class, param_map)
 
     for param in ModelPeriodEmissionLimit:
-        if any(x in param["entity_byname"][1] for x in ["CO2", "co2", "C02"]):
-            param_name = "co2_max_cumulative"
-        elif any(x in param["entity_byname"][1] for x in ["NOX", "nox"]):
-            param_name = "nox_max_cumulative"
-        elif any(x in param["entity_byname"][1] for x in ["SO2", "so2", "S02"]):
-            param_name = "so2_max_cumulative"
-        else:
+        emission = emission_type(param["entity_byname"][1])
+        if emission is None:
             continue
-        param_float = api.from_database(param["value"], param["type"])
+        param_float = param["parsed_value"]
         if isinstance(param_float, float):
             alt_ent_class = (param["alternative_name"], (param["entity_byname"][0],), "set")
-            for Exo in ModelPeriodExogenousEmission:
-                if Exo["entity_byname"][0] == param["entity_byname"][0] and Exo["entity_byname"][1] == param["entity_byname"][1]:
-                    exo_float = api.from_database(Exo["value"], Exo["type"])
-                    param_float = param_float - exo_float
-            target_db = ines_transform.add_item_to_DB(target_db, param_name, alt_ent_class, param_float)
-    return target_db    
+            for Exo in model_period_exogenous.get(param["entity_byname"], []):
+                exo_float = Exo["parsed_value"]
+                param_float = param_float - exo_float
+            writer.add_item(emission + "_max_cumulative", alt_ent_class, param_float)
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added emission parameters")
+    return target_db
+
+def group_by_byname(params, dimensions):
+    # Parameter value records grouped by the first dimensions of their entity_byname, in their original order
+    groups = {}
+    for param in params:
+        groups.setdefault(param["entity_byname"][0:dimensions], []).append(param)
+    return groups
 
-def process_RE_min_constraint(source_db, target_db):
+class EmissionClassifier:
+    """Maps OSeMOSYS emission names to the ines emission types (co2, nox, so2).
+
+    emission_types is the table from settings.yaml: emission type -> list of substrings. The first type
+    with a substring in the emission name is used. Each emission name is classified once.
+    """
+    def __init__(self, emission_types):
+        self.emission_types = emission_types
+        self._types = {}
+
+    def __call__(self, emission_name):
+        try:
+            return self._types[emission_name]
+        except KeyError:
+            emission = next((emission for emission, names in self.emission_types.items() if any(name in emission_name for name in names)), None)
+            self._types[emission_name] = emission
+            return emission
+
+def process_RE_min_constraint(source, target_db):
 
     #this constraint is presented as the minimum production of demand, not of all production. 
     #They are not exactly the same constraint, but on a system without slacks, they should be the same.
-    RETagTechnology = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="RETagTechnology")
-    RETagFuel = source_db.get_parameter_value_items(entity_class_name="REGION__FUEL", parameter_definition_name="RETagFuel")
-    REMinProductionTarget = source_db.get_parameter_value_items(entity_class_name="REGION", parameter_definition_name="REMinProductionTarget")
-    oa_ratio = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__FUEL", parameter_definition_name="OutputActivityRatio")
-    SpecifiedAnnualDemand = source_db.get_parameter_value_items(entity_class_name="REGION__FUEL", parameter_definition_name="SpecifiedAnnualDemand")
-    AccumulatedAnnualDemand = source_db.get_parameter_value_items(entity_class_name="REGION__FUEL", parameter_definition_name="AccumulatedAnnualDemand")
+    RETagTechnology = group_by_byname(source.parameter_values("REGION__TECHNOLOGY", "RETagTechnology"), 1)
+    RETagFuel = group_by_byname(source.parameter_values("REGION__FUEL", "RETagFuel"), 1)
+    REMinProductionTarget = source.parameter_values("REGION", "REMinProductionTarget")
+    output_flows = OutputFlows(source)
+    SpecifiedAnnualDemand = group_by_byname(source.parameter_values("REGION__FUEL", "SpecifiedAnnualDemand"), 2)
+    AccumulatedAnnualDemand = group_by_byname(source.parameter_values("REGION__FUEL", "AccumulatedAnnualDemand"), 2)
+    writer = ParameterValueWriter(target_db, "RE minimum production targets")
 
     for target in REMinProductionTarget:
-        set_name = target["entity_byname"][0] + "_RE_target"
-        target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), target["alternative_name"])
-        factor_map = api.from_database(target["value"], target["type"])
-        yearly_demand = [0 for i in factor_map.indexes]
-
-        for fuel in RETagFuel:
-            if fuel["entity_byname"][0] == target["entity_byname"][0]:
-                node_name = fuel["entity_byname"][0] + "__" + fuel["entity_byname"][1]
-                #getting demand
-                for param in SpecifiedAnnualDemand:
-                    if param["entity_byname"] == fuel["entity_byname"]:
-                        param_map = api.from_database(param["value"], param["type"])
-                        for i, val in enumerate(param_map.values):
-                            yearly_demand[i] += val * demand_unit_factor
-                    demand = True
-                if not demand:
-                    for param in AccumulatedAnnualDemand:
-                        if param["entity_byname"] == fuel["entity_byname"]:
-                            param_map = api.from_database(param["value"], param["type"])
-                            for i, val in enumerate(param_map.values):
-                                yearly_demand[i] += val * demand_unit_factor
-                #adding the flows to the set
-                for tech in RETagTechnology:
-                    if tech["entity_byname"][0] != target["entity_byname"][0]:
-                        continue
-                    for param in oa_ratio:
-                        if param["entity_byname"][0] == target["entity_byname"][0] and \
-                            param["entity_byname"][1] == tech["entity_byname"][1] and \
-                            param["entity_byname"][2] == fuel["entity_byname"][1]:
-                            unit_name = tech["entity_byname"][0] + "__" + tech["entity_byname"][1]
-                            unit__to_node_byname = (unit_name, node_name)
-                            ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                                    entity_byname=(set_name, unit__to_node_byname[0],unit__to_node_byname[1])), warn=True)
-        
-        flow_target_values = [x * factor for (x,factor) in zip(yearly_demand, factor_map.values)]
-        flow_target = api.Map(factor_map.indexes, flow_target_values, index_name="period")
-        target_db = ines_transform.add_item_to_DB(target_db, "flow_min_cumulative", [target["alternative_name"], (set_name,),'set'], flow_target)
-
+        region = target["entity_byname"][0]
+        set_name = region + "_RE_target"
+        factor_map = target["parsed_value"]
+        yearly_demand = np.zeros(len(factor_map.indexes))
+        flows = []
+        for fuel in RETagFuel.get((region,), []):
+            #getting demand, AccumulatedAnnualDemand if there is no SpecifiedAnnualDemand
+            demands = SpecifiedAnnualDemand.get(fuel["entity_byname"]) or AccumulatedAnnualDemand.get(fuel["entity_byname"], [])
+            for param in demands:
+                yearly_demand += np.nan_to_num(align_to_years(factor_map.indexes, param["parsed_value"])) * demand_unit_factor
+            #adding the flows to the set
+            for tech in RETagTechnology.get((region,), []):
+                flows.extend(output_flows.flows(region, tech["entity_byname"][1], fuel["entity_byname"][1]))
+        target_db = add_flow_set(target_db, set_name, target["alternative_name"], flows)
+
+        flow_target_values = yearly_demand * np.array(factor_map.values, dtype=float)
+        flow_target = api.Map(factor_map.indexes, flow_target_values.tolist(), index_name="period")
+        writer.add_item("flow_min_cumulative", [target["alternative_name"], (set_name,),'set'], flow_target)
+
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added RE minimum production targets")
     return target_db
 
-def process_activity_constraints(source_db, target_db):
+# Activity limit parameter -> set name suffix, ines parameter and whether the limit is annual (a map over years)
+activity_constraints = [
+    ("TotalTechnologyAnnualActivityLowerLimit", "_min_annual_activity", "flow_min_cumulative", True),
+    ("TotalTechnologyAnnualActivityUpperLimit", "_max_annual_activity", "flow_max_cumulative", True),
+    ("TotalTechnologyModelPeriodActivityLowerLimit", "_min_model_activity", "flow_min_cumulative", False),
+    ("TotalTechnologyModelPeriodActivityUpperLimit", "_max_model_activity", "flow_max_cumulative", False),
+]
 
-    TotalTechnologyAnnualActivityLowerLimit = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="TotalTechnologyAnnualActivityLowerLimit")
-    TotalTechnologyAnnualActivityUpperLimit = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="TotalTechnologyAnnualActivityUpperLimit")
-    TotalTechnologyModelPeriodActivityLowerLimit = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="TotalTechnologyModelPeriodActivityLowerLimit")
-    TotalTechnologyModelPeriodActivityUpperLimit = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="TotalTechnologyModelPeriodActivityUpperLimit")
-    oa_ratio = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY__FUEL", parameter_definition_name="OutputActivityRatio")
-    
-    for unit_source in source_db.get_entity_items(entity_class_name="REGION__TECHNOLOGY"):
-        # Get the CapacitytoActivityRatio, the activity is energy in year, flow is power
-        source_CapacitytoActivityRatio = source_db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", entity_name=unit_source["name"], parameter_definition_name="CapacityToActivityUnit")
+def process_activity_constraints(source, target_db):
+
+    output_flows = OutputFlows(source)
+    writer = ParameterValueWriter(target_db, "activity constraints")
+
+    # Get the CapacitytoActivityRatio, the activity is energy in year, flow is power
+    capacity_to_activity_ratios = {}
+    for unit_source in source.entities("REGION__TECHNOLOGY"):
+        source_CapacitytoActivityRatio = source.parameter_values("REGION__TECHNOLOGY", "CapacityToActivityUnit", unit_source["entity_byname"])
         if len(source_CapacitytoActivityRatio) > 1:
             exit("Multiple alternatives for CapacitytoActivityRatio - not handled")
-        elif len(source_CapacitytoActivityRatio) == 0:
-            capacity_to_activity_ratio = 1
-        else:
-            source_CapacitytoActivityRatio = source_CapacitytoActivityRatio[0]
-            capacity_to_activity_ratio = api.from_database(source_CapacitytoActivityRatio["value"], "float")
-    
-        for param in TotalTechnologyAnnualActivityLowerLimit:
-            if param["entity_byname"] != unit_source["entity_byname"]:
-                continue
-            param_map = api.from_database(param["value"], param["type"])
-            set_name = param["entity_byname"][1] + "_min_annual_activity"
-            target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-            
-            for oa in oa_ratio:
-                if oa["entity_byname"][0] == param["entity_byname"][0] and oa["entity_byname"][1] == param["entity_byname"][1]:
-                    unit_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][1]
-                    node_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][2]
-                    ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                            entity_byname=(set_name, unit_name, node_name)), warn=True)
-                    oa_ratio_map = api.from_database(oa["value"], oa["type"])
-                    for i, val in enumerate(param_map.indexes):
-                        for j, oa_val in enumerate(oa_ratio_map.values[0].indexes):
-                            if val == oa_val:
-                                # Note that the activity is in annual energy, the flow is in power -> capacity_to_activity_ratio converts both energy to power and annual to instant
-                                # Convert activity to:
-                                # 1. flow
-                                # 2. From energy to power
-                                # 3. Power to MW
-                                # 4. From instant to annual
-                                param_map.values[i] = param_map.values[i] * oa_ratio_map.values[0].values[j] / capacity_to_activity_ratio * capacity_unit_factor * 8760
-                                break
-                    
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_min_cumulative", [param["alternative_name"], (set_name,), "set"], param_map)
-                    break #taking the flow from one of the outputs is enough
-
-        for param in TotalTechnologyAnnualActivityUpperLimit:
-            if param["entity_byname"] != unit_source["entity_byname"]:
+        elif len(source_CapacitytoActivityRatio) == 1:
+            capacity_to_activity_ratios[unit_source["entity_byname"]] = source_CapacitytoActivityRatio[0]["parsed_value"]
+
+    for source_param, set_suffix, param_name, annual in activity_constraints:
+        for param in source.parameter_values("REGION__TECHNOLOGY", source_param):
+            set_name = param["entity_byname"][1] + set_suffix
+            #taking the flow from one of the outputs is enough
+            oa = output_flows.first_output(*param["entity_byname"])
+            target_db = add_flow_set(target_db, set_name, param["alternative_name"], [oa["entity_byname"]] if oa else [])
+            if not oa:
                 continue
-            param_map = api.from_database(param["value"], param["type"])
-            set_name = param["entity_byname"][1] + "_max_annual_activity"
-            target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-            
-            for oa in oa_ratio:
-                if oa["entity_byname"][0] == param["entity_byname"][0] and oa["entity_byname"][1] == param["entity_byname"][1]:
-                    unit_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][1]
-                    node_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][2]
-                    ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                            entity_byname=(set_name, unit_name, node_name)), warn=True)
-                    oa_ratio_map = api.from_database(oa["value"], oa["type"])
-                    for i, val in enumerate(param_map.indexes):
-                        for j, oa_val in enumerate(oa_ratio_map.values[0].indexes):
-                            if val == oa_val:
-                                param_map.values[i] = param_map.values[i] * oa_ratio_map.values[0].values[j] / capacity_to_activity_ratio * capacity_unit_factor * 8760
-                                break
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_max_cumulative", [param["alternative_name"], (set_name,), "set"], param_map)
-                    break #taking the flow from one of the outputs is enough
-        
-        for param in TotalTechnologyModelPeriodActivityLowerLimit:
-            if param["entity_byname"] != unit_source["entity_byname"]:
-                continue
-            param_float = api.from_database(param["value"], param["type"])
-            set_name = param["entity_byname"][1] + "_min_model_activity"
-            target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-            
-            for oa in oa_ratio:
-                if oa["entity_byname"][0] == param["entity_byname"][0] and oa["entity_byname"][1] == param["entity_byname"][1]:
-                    unit_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][1]
-                    node_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][2]
-                    ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                            entity_byname=(set_name, unit_name, node_name)), warn=True)
-                    oa_ratio_map = api.from_database(oa["value"], oa["type"])
-                    #taking the first value of the map, as INES supports only constant oa values
-                    param_float = param_float * oa_ratio_map.values[0].values[0] / capacity_to_activity_ratio * capacity_unit_factor * 8760
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_min_cumulative", [param["alternative_name"], (set_name,), "set"], param_float)
-                    break #taking the flow from one of the outputs is enough
-        
-        for param in TotalTechnologyModelPeriodActivityUpperLimit:
-            if param["entity_byname"] != unit_source["entity_byname"]:
-                continue
-            param_float = api.from_database(param["value"], param["type"])
-            set_name = param["entity_byname"][1] + "_max_model_activity"
-            target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), param["alternative_name"])
-            
-            for oa in oa_ratio:
-                if oa["entity_byname"][0] == param["entity_byname"][0] and oa["entity_byname"][1] == param["entity_byname"][1]:
-                    unit_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][1]
-                    node_name = oa["entity_byname"][0] + "__" + oa["entity_byname"][2]
-                    ines_transform.assert_success(target_db.add_entity_item(entity_class_name='set__unit_flow', 
-                                                                            entity_byname=(set_name, unit_name, node_name)), warn=True)
-                    oa_ratio_map = api.from_database(oa["value"], oa["type"])
-                    #taking the first value of the map, as INES supports only constant oa values
-                    param_float = param_float * oa_ratio_map.values[0].values[0] / capacity_to_activity_ratio * capacity_unit_factor * 8760
-                    target_db = ines_transform.add_item_to_DB(target_db, "flow_max_cumulative", [param["alternative_name"], (set_name,), "set"], param_float)
-                    break #taking the flow from one of the outputs is enough
+            capacity_to_activity_ratio = capacity_to_activity_ratios.get(param["entity_byname"], 1)
+            oa_ratio_map = oa["parsed_value"]
+            # Note that the activity is in annual energy, the flow is in power -> capacity_to_activity_ratio converts both energy to power and annual to instant
+            # Convert activity to:
+            # 1. flow
+            # 2. From energy to power
+            # 3. Power to MW
+            # 4. From instant to annual
+            if annual:
+                param_map = param["parsed_value"]
+                values = np.array(param_map.values, dtype=float)
+                oa_values = align_to_years(param_map.indexes, oa_ratio_map.values[0])
+                # years without an OutputActivityRatio are left as they are
+                values = np.where(np.isnan(oa_values), values, values * oa_values / capacity_to_activity_ratio * capacity_unit_factor * 8760)
+                writer.add_item(param_name, [param["alternative_name"], (set_name,), "set"], map_with_values(param_map, values.tolist()))
+            else:
+                #taking the first value of the map, as INES supports only constant oa values
+                param_float = param["parsed_value"] * oa_ratio_map.values[0].values[0] / capacity_to_activity_ratio * capacity_unit_factor * 8760
+                writer.add_item(param_name, [param["alternative_name"], (set_name,), "set"], param_float)
 
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added activity constraints")
     return target_db
 
-def process_node_types(source_db, target_db):
-    nodes = source_db.get_entity_items(entity_class_name="REGION__FUEL")
-    alts = source_db.get_alternative_items()
-    for node in nodes:
-        for alt in alts:
-            aa_demand = source_db.get_parameter_value_item(entity_class_name="REGION__FUEL",
-                                                           entity_byname=node["entity_byname"],
-                                                           alternative_name=alt["name"],
-                                                           parameter_definition_name="AccumulatedAnnualDemand")
-            sp_demand = source_db.get_parameter_value_item(entity_class_name="REGION__FUEL",
-                                                           entity_byname=node["entity_byname"],
-                                                           alternative_name=alt["name"],
-                                                           parameter_definition_name="SpecifiedDemandProfile")
-            if aa_demand and not sp_demand:
-                p_value, p_type = api.to_database("balance_within_period")
-                added, updated, error = target_db.add_update_parameter_value_item(entity_class_name="node",
-                                                                                  entity_byname=(node["name"],),
-                                                                                  alternative_name=alt["name"],
-                                                                                  parameter_definition_name="node_type",
-                                                                                  type=p_type,
-                                                                                  value=p_value)
-                if error:
-                    exit("Failed to add node_type balance_within_period on nodes with AccumulatedAnnualDemand: " + error)
-    try:
-        target_db.commit_session("Added node_type balance_within_period to nodes with AccumulatedAnnualDemand")
-    except:
-        print("Failed to commit node_type balance_within_period on nodes with AccumulatedAnnualDemand")
+class OutputFlows:
+    """OutputActivityRatio rows indexed by (region, technology) for building flow constraints."""
+    def __init__(self, source):
+        self._by_unit = group_by_byname(source.parameter_values("REGION__TECHNOLOGY__FUEL", "OutputActivityRatio"), 2)
+        self._flows = {param["entity_byname"] for params in self._by_unit.values() for param in params}
+
+    def first_output(self, region, technology):
+        outputs = self._by_unit.get((region, technology))
+        return outputs[0] if outputs else None
+
+    def flows(self, region, technology, fuel):
+        # The (region, technology, fuel) flow as a list, empty if the technology has no OutputActivityRatio to the fuel
+        return [(region, technology, fuel)] if (region, technology, fuel) in self._flows else []
+
+def add_flow_set(target_db, set_name, alternative_name, flows):
+    # Adds the set and its set__unit_flow members for the (region, technology, fuel) flows
+    target_db = add_entity_and_entity_alternative(target_db, 'set', (set_name,), alternative_name)
+    for region, technology, fuel in flows:
+        add_target_item(target_db, "add_entity_item", "warn", entity_class_name='set__unit_flow', 
+                        entity_byname=(set_name, region + "__" + technology, region + "__" + fuel))
+    return target_db
+
+def align_to_years(years, param_map):
+    # Values of param_map at the given years as a float array, NaN for the years param_map does not have
+    aligned = np.full(len(years), np.nan)
+    if not len(param_map.indexes):
+        return aligned
+    years = np.array(years, dtype=str)
+    value_indexes = np.array(param_map.indexes, dtype=str)
+    order = np.argsort(value_indexes, kind="stable")
+    positions = order[np.minimum(np.searchsorted(value_indexes, years, sorter=order), len(order) - 1)]
+    found = value_indexes[positions] == years
+    aligned[found] = np.array(param_map.values, dtype=float)[positions[found]]
+    return aligned
+
+def process_node_types(source, target_db):
+    nodes = source.entities("REGION__FUEL")
+    writer = ParameterValueWriter(target_db, "node_type balance_within_period")
+    table = ParameterTable(source, "REGION__FUEL", nodes, ["AccumulatedAnnualDemand", "SpecifiedDemandProfile"])
+    aa_demand = table.exists[:, :, 0]
+    sp_demand = table.exists[:, :, 1]
+    for n, a in np.argwhere(aa_demand & ~sp_demand):
+        writer.add("node", (nodes[n]["name"],), "node_type", table.alternatives[a], "balance_within_period")
+    writer.flush()
+    commit_policy.checkpoint(target_db, "Added node_type balance_within_period to nodes with AccumulatedAnnualDemand")
     return target_db
 
 ##Check parameters:
@@ -1373,51 +2101,127 @@ def alternative_name_from_two(alt_i, alt_o, target_db):
         alt = alt_i
     else:
         alt = alt_i + "__" + alt_o
-    target_db.add_update_alternative_item(name=alt)
+    add_target_item(target_db, "add_update_alternative_item", "ignore", name=alt)
     return alt
 
 
-def get_parameter_values_with_default(source_db, source_entity_class, source_param, alternative_name = None, use_default = True, ignore_default_value_of = None):
-    entities = source_db.get_entity_items(entity_class_name=source_entity_class) if use_default else None
-    param_def_item = source_db.get_parameter_definition_item(
-                        entity_class_name=source_entity_class, name=source_param
-                        ) if use_default else None
+def get_parameter_values_with_default(source, source_entity_class, source_param, alternative_name = None, use_default = True, ignore_default_value_of = None):
+    # Returns the parameter values grouped by entity_byname: {entity_byname: [parameter values]}.
+    # Entities without a value get the default value in the default_alternative.
+    entities = source.entities(source_entity_class) if use_default else None
+    param_def_item = source.parameter_definition(source_entity_class, source_param) if use_default else None
 
     # Get all parameter values at once
-    if alternative_name:
-        params = source_db.get_parameter_value_items(
-            entity_class_name=source_entity_class,
-            parameter_definition_name=source_param,
-            alternative_name=alternative_name
-        )
-    else:
-        params = source_db.get_parameter_value_items(
-            entity_class_name=source_entity_class,
-            parameter_definition_name=source_param,
-        )
+    params = {}
+    for param in source.parameter_values(source_entity_class, source_param):
+        if alternative_name and param["alternative_name"] != alternative_name:
+            continue
+        params.setdefault(param["entity_byname"], []).append(param)
 
     if use_default:
-        if ignore_default_value_of != api.from_database(param_def_item["default_value"], param_def_item["default_type"]):
-            entities_with_params = {tuple(p["entity_byname"]) for p in params}
+        if ignore_default_value_of != param_def_item["parsed_value"]:
             for entity in entities:
-                if tuple(entity["entity_byname"]) not in entities_with_params:
-                    params.append({
+                if entity["entity_byname"] not in params:
+                    params[entity["entity_byname"]] = [{
                         "entity_byname": entity["entity_byname"],
                         "value": param_def_item["default_value"],
                         "type": param_def_item["default_type"],
+                        "parsed_value": param_def_item["parsed_value"],
                         "alternative_name": default_alternative
-                    })
+                    }]
     return params
 
+def resolve_discount_rates(source, unit_interest_rates):
+    # (region, technology) -> (alternative, interest rate). The interest rate is taken from DiscountRateIdv of the unit,
+    # then from DiscountRate of the region and last from the default value of DiscountRate.
+    # The default value is placed in the alternative where the unit entity exists.
+    region_interest_rates = {}
+    for param in source.parameter_values("REGION", "DiscountRate"):
+        region_interest_rates[param["entity_byname"][0]] = (param["alternative_name"], param["parsed_value"])
+    default_discount_rate = source.parameter_definition("REGION", "DiscountRate")
+    interest_rates = {}
+    for unit in source.entities("REGION__TECHNOLOGY"):
+        alt = None
+        interest_rate = None
+        for param in unit_interest_rates.get(unit["entity_byname"], []):
+            alt = param["alternative_name"]
+            interest_rate = param["parsed_value"]
+        if not interest_rate and unit["entity_byname"][0] in region_interest_rates:
+            alt, interest_rate = region_interest_rates[unit["entity_byname"][0]]
+        if not interest_rate and default_discount_rate and default_discount_rate["default_value"]:
+            interest_rate = default_discount_rate["parsed_value"]
+            unit_alternatives = (source.entity_alternatives("REGION__TECHNOLOGY", unit["entity_byname"])
+                                 or source.entity_alternatives("TECHNOLOGY", (unit["entity_byname"][1],)))
+            alt = unit_alternatives[-1]["alternative_name"] if unit_alternatives else default_alternative
+        if interest_rate:
+            interest_rates[unit["entity_byname"]] = (alt, interest_rate)
+    return interest_rates
+
+def index_activity_ratios(source):
+    # (region, technology) -> fuel -> InputActivityRatio and OutputActivityRatio rows, fuels in the order of the REGION__TECHNOLOGY__FUEL entities
+    activity_ratios = {}
+    for rtf_ent in source.entities("REGION__TECHNOLOGY__FUEL"):
+        region, technology, fuel = rtf_ent["entity_byname"]
+        activity_ratios.setdefault((region, technology), {})[fuel] = {
+            "InputActivityRatio": source.parameter_values("REGION__TECHNOLOGY__FUEL", "InputActivityRatio", rtf_ent["entity_byname"]),
+            "OutputActivityRatio": source.parameter_values("REGION__TECHNOLOGY__FUEL", "OutputActivityRatio", rtf_ent["entity_byname"]),
+        }
+    return activity_ratios
+
+def map_with_values(param_map, values, index_name=None):
+    # Parsed values in the SourceSnapshot are shared, so a modified map is returned as a new map
+    return api.Map(param_map.indexes, values, index_name=index_name if index_name else param_map.index_name)
+
 def add_entity_and_entity_alternative(target_db, entity_class_name, entity_byname, alternative_name):
-    ines_transform.assert_success(target_db.add_entity_item(entity_class_name = entity_class_name, entity_byname = entity_byname), warn=True)
-    ines_transform.assert_success(target_db.add_update_entity_alternative_item(entity_class_name=entity_class_name, entity_byname=entity_byname,
-                                                                               alternative_name=alternative_name, active=True), warn=True)
+    add_target_item(target_db, "add_entity_item", "warn", entity_class_name = entity_class_name, entity_byname = entity_byname)
+    add_target_item(target_db, "add_update_entity_alternative_item", "warn", entity_class_name=entity_class_name, entity_byname=entity_byname,
+                    alternative_name=alternative_name, active=True)
     return target_db
 
-def round_to_nearest_minute(dt):
-    new_seconds = (dt.second + 30) // 60 * 60  # Round seconds
-    return dt + datetime.timedelta(seconds=new_seconds - dt.second)
+def resolution_to_string(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+def apply_settings(settings):
+    # Sets the module level settings used by the process functions. Also called in the stage worker processes.
+    global default_alternative, unlimited_unit_capacity, default_unit_size, unit_to_penalty_boundary, default_interest_rate
+    global capacity_unit_factor, storage_unit_factor, demand_unit_factor, investment_unit_factor
+    global storage_investment_unit_factor, variable_cost_unit_factor, commit_policy, stage_workers, profiler, stage_tracker
+    global incremental, incremental_state_file, timeslice_cache, timeslice_cache_directory, parsed_value_cache_size, emission_types
+    default_alternative = settings["default_alternative"]
+    
+    unlimited_unit_capacity = float(settings["unlimited_unit_capacity"])
+    default_unit_size = float(settings["default_unit_size"])
+    unit_to_penalty_boundary = float(settings["unit_to_penalty_boundary"])
+    default_interest_rate = float(settings["default_interest_rate"])
+
+    capacity_unit_factor = float(settings["capacity_unit_to_MW_factor"])
+    storage_unit_factor = float(settings["storage_capacity_unit_to_MWh_factor"])
+    demand_unit_factor = float(settings["demand_unit_to_MWh_factor"])
+    investment_unit_factor = float(settings["investment_unit_to_CUR/MW_factor"])
+    storage_investment_unit_factor = float(settings["storage_investment_unit_to_CUR/MWh_factor"])
+    variable_cost_unit_factor = float(settings["variable_cost_unit_to_CUR/MW_factor"])
+
+    commit_policy = CommitPolicy(settings.get("commit_policy", "stage"))
+    stage_workers = int(settings.get("stage_workers", 1))
+    profile = settings.get("profile", False)
+    profile_json = settings.get("profile_json")
+    profile_environment = os.environ.get("OSEMOSYS_TO_INES_PROFILE")
+    if profile_environment:
+        profile = profile_environment not in ("0", "false", "False")
+        if profile_environment.endswith(".json"):
+            profile_json = profile_environment
+    profiler = StageProfiler(bool(profile), profile_json)
+    stage_tracker = StageTracker()
+    incremental = bool(settings.get("incremental", False))
+    incremental_state_file = settings.get("incremental_state_file")
+    timeslice_cache = bool(settings.get("timeslice_cache", True))
+    timeslice_cache_directory = settings.get("timeslice_cache_directory") or Path(__file__).parent / "timeslice_cache"
+    parsed_value_cache_size = int(settings.get("parsed_value_cache_size") or 0) or None
+    emission_types = settings.get("emission_types") or {"co2": ["CO2", "co2", "C02"], "nox": ["NOX", "nox"], "so2": ["SO2", "so2", "S02"]}
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -1448,19 +2252,7 @@ if __name__ == "__main__":
     else:
         exit("Please provide timeslices to time mapping csv file as the fourth argument.""")
     
-    default_alternative = settings["default_alternative"]
-    
-    unlimited_unit_capacity = float(settings["unlimited_unit_capacity"])
-    default_unit_size = float(settings["default_unit_size"])
-    unit_to_penalty_boundary = float(settings["unit_to_penalty_boundary"])
-    default_interest_rate = float(settings["default_interest_rate"])
+    apply_settings(settings)
 
-    capacity_unit_factor = float(settings["capacity_unit_to_MW_factor"])
-    storage_unit_factor = float(settings["storage_capacity_unit_to_MWh_factor"])
-    demand_unit_factor = float(settings["demand_unit_to_MWh_factor"])
-    investment_unit_factor = float(settings["investment_unit_to_CUR/MW_factor"])
-    storage_investment_unit_factor = float(settings["storage_investment_unit_to_CUR/MWh_factor"])
-    variable_cost_unit_factor = float(settings["variable_cost_unit_to_CUR/MW_factor"])
-    
     main()
 
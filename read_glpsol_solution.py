@@ -0,0 +1,321 @@
+import sys
+import re
+import csv
+import json
+import itertools
+import sqlite3
+import subprocess
+import tempfile
+import yaml
+from pathlib import Path
+import spinedb_api as api
+from spinedb_api import DatabaseMapping
+from spinedb_api.exception import NothingToCommit
+from run_osemosys_python_wrapper import glpsol_executable
+
+# Reads the glpsol solution file (-w, GLPK raw format) into OSeMOSYS result parameters of a Spine database and
+# optionally into the ines database. The raw solution only has column numbers, the names come from the same problem
+# written in the GLPK format (glpsol --check --wglp). Both files list the columns in the same order, so they are read
+# line by line side by side. glpsol numbers the columns variable by variable, but within a variable in the order the
+# constraints use them, so the columns of one entity are not together. The rows of a variable are therefore spilled
+# in chunks of results_chunk_size to a temporary sqlite file and read back entity by entity. Only the values of one
+# entity are in memory at a time and the parameter values are written in chunks of results_chunk_size.
+# Usage: python read_glpsol_solution.py settings_OSeMOSYS.yaml url_db [url_ines_db]
+
+# OSeMOSYS entity class -> ines entity class, the ines entity name is the OSeMOSYS elements joined with "__" like in osemosys_to_ines.py
+ines_entity_classes = {
+    "REGION__TECHNOLOGY": "unit",
+    "REGION__FUEL": "node",
+    "REGION__STORAGE": "node",
+}
+
+def read_solution(settings, url_db, url_ines_db=None):
+    directory = Path(__file__).parent
+    model_path = directory / "mathprog_files" / settings["model_code"]
+    data_path = directory / settings["new_model_name"]
+    solution_path = directory / settings["solution_file"]
+    problem_path = solution_path.with_suffix(".glp")
+    if not solution_path.exists():
+        sys.exit("No solution file " + str(solution_path))
+    if not problem_path.exists() or problem_path.stat().st_mtime < max(model_path.stat().st_mtime, data_path.stat().st_mtime):
+        generate_problem_file(settings, model_path, data_path, problem_path)
+    variable_sets = read_variable_sets(model_path)
+    map_dimensions = set(settings.get("dimens_to_param") or [])
+    selected_variables = set(settings.get("results_variables") or [])
+    skip_zeros = settings.get("results_skip_zeros", True)
+    alternative = settings.get("results_alternative") or "results"
+    chunk_size = int(settings.get("results_chunk_size") or 10000)
+
+    writers = [ResultWriter(url_db, alternative, chunk_size)]
+    if url_ines_db:
+        writers.append(ResultWriter(url_ines_db, alternative, chunk_size, ines_entity_classes))
+    try:
+        with tempfile.TemporaryDirectory() as spill_folder:
+            spill = RowSpill(Path(spill_folder) / "rows.sqlite", chunk_size)
+            try:
+                for variable, rows in variable_rows(solution_columns(solution_path, problem_path)):
+                    if selected_variables and variable not in selected_variables:
+                        continue
+                    if variable not in variable_sets:
+                        continue
+                    for class_name, elements, value in variable_results(variable_sets[variable], map_dimensions, rows, skip_zeros, spill):
+                        for writer in writers:
+                            writer.add_result(variable, class_name, elements, value)
+            finally:
+                spill.close()
+        for writer in writers:
+            writer.close()
+    finally:
+        for writer in writers:
+            writer.db.close()
+
+def generate_problem_file(settings, model_path, data_path, problem_path):
+    glpsol_cmd = [glpsol_executable(settings), '--check', '-m', str(model_path), '-d', str(data_path), '--wglp', str(problem_path)]
+    completed = subprocess.run(glpsol_cmd)
+    if completed.returncode != 0:
+        sys.exit("Could not write the problem file with glpsol: " + str(completed.returncode))
+
+def read_variable_sets(model_path):
+    # variable -> index sets from the var statements of the MathProg model, e.g. NewCapacity -> [REGION, TECHNOLOGY, YEAR]
+    with open(model_path, 'r') as model_file:
+        model_code = model_file.read()
+    variable_sets = {}
+    for match in re.finditer(r'^\s*var\s+(\w+)\s*\{([^}]*)\}', model_code, re.MULTILINE):
+        variable_sets[match.group(1)] = re.findall(r'\bin\s+(\w+)', match.group(2))
+    return variable_sets
+
+def solution_columns(solution_path, problem_path):
+    # Yields (column name, value) for the columns of the solution
+    with open(solution_path, 'r') as solution_file, open(problem_path, 'r') as problem_file:
+        problem_rows, problem_columns = problem_size(problem_file)
+        column_names = problem_column_names(problem_file)
+        value_position = None
+        name_column, name = 0, None
+        for line in solution_file:
+            if line.startswith('s '):
+                # s bas m n p d obj | s ipt m n s obj | s mip m n s obj
+                tokens = line.split()
+                if (int(tokens[2]), int(tokens[3])) != (problem_rows, problem_columns):
+                    sys.exit(f"The solution {solution_path} has {tokens[2]} rows and {tokens[3]} columns, but the problem file "
+                             f"{problem_path} has {problem_rows} rows and {problem_columns} columns. Delete the problem file "
+                             f"if it is from another model or data, it is then written again.")
+                value_position = 3 if tokens[1] == 'bas' else 2
+            elif line.startswith('j '):
+                if value_position is None:
+                    sys.exit("No solution line (s) before the columns in " + str(solution_path))
+                tokens = line.split()
+                column = int(tokens[1])
+                while name_column < column:
+                    name_column, name = next(column_names, (sys.maxsize, None))
+                if name_column == column:
+                    yield name, float(tokens[value_position])
+
+def problem_size(problem_file):
+    # Rows and columns from the problem line (p lp|mip min|max rows columns non-zeros) of a GLPK format problem file
+    for line in problem_file:
+        if line.startswith('p '):
+            tokens = line.split()
+            return int(tokens[3]), int(tokens[4])
+    sys.exit("No problem line (p) in " + problem_file.name)
+
+def problem_column_names(problem_file):
+    # Yields (column number, name) from the 'n j' lines of a GLPK format problem file
+    for line in problem_file:
+        if line.startswith('n j '):
+            _, _, column, name = line.rstrip('\n').split(' ', 3)
+            yield int(column), name
+
+def variable_rows(columns):
+    # Groups consecutive columns by variable: yields (variable, iterator of (index tuple, value)).
+    # glpsol writes the columns of a variable together, a variable that comes again means the files do not match.
+    variables_read = set()
+    for variable, variable_columns in itertools.groupby(columns, key=lambda column: column[0].partition('[')[0]):
+        if variable in variables_read:
+            sys.exit(f"The columns of {variable} are not together in the problem file, cannot read the solution")
+        variables_read.add(variable)
+        yield variable, ((split_indexes(name.partition('[')[2].rstrip(']')), value) for name, value in variable_columns)
+
+def split_indexes(indexes):
+    if not indexes:
+        return ()
+    return tuple(next(csv.reader([indexes], quotechar="'", skipinitialspace=True)))
+
+def variable_results(index_sets, map_dimensions, rows, skip_zeros, spill):
+    # Yields (entity class, entity elements, value) where the dimensions in map_dimensions form a (nested) map
+    entity_positions = [i for i, index_set in enumerate(index_sets) if index_set not in map_dimensions]
+    map_positions = [i for i, index_set in enumerate(index_sets) if index_set in map_dimensions]
+    class_name = "__".join(index_sets[i] for i in entity_positions)
+    if not entity_positions:
+        for _ in rows:
+            pass
+        return
+    if not map_positions:
+        # One column per entity
+        for indexes, value in rows:
+            if skip_zeros and not value:
+                continue
+            yield class_name, indexes, value
+        return
+    spill.write((tuple(indexes[i] for i in entity_positions), tuple(indexes[i] for i in map_positions), value) for indexes, value in rows)
+    for elements, values in spill.read_entities():
+        if skip_zeros and not any(value for _, value in values):
+            continue
+        yield class_name, elements, nested_map(values, [index_sets[i] for i in map_positions])
+
+def nested_map(values, index_names):
+    # values is a list of (index tuple, value) in the order glpsol wrote them
+    if len(index_names) == 1:
+        return api.Map([indexes[0] for indexes, _ in values], [value for _, value in values], index_name=index_names[0])
+    groups = {}
+    for indexes, value in values:
+        groups.setdefault(indexes[0], []).append((indexes[1:], value))
+    return api.Map(list(groups), [nested_map(group, index_names[1:]) for group in groups.values()], index_name=index_names[0])
+
+class RowSpill:
+    """Temporary sqlite table of the rows of one variable, written in chunks and read back entity by entity.
+
+    write() replaces the rows with (entity elements, map indexes, value) rows. read_entities() yields
+    (entity elements, [(map indexes, value)]) per entity, the values in the order they were written.
+    """
+    def __init__(self, path, chunk_size):
+        self.connection = sqlite3.connect(path)
+        self.chunk_size = chunk_size
+        self.connection.execute("CREATE TABLE rows (entity TEXT, indexes TEXT, value REAL)")
+
+    def write(self, rows):
+        self.connection.execute("DELETE FROM rows")
+        rows = ((json.dumps(elements), json.dumps(indexes), value) for elements, indexes, value in rows)
+        for chunk in iter(lambda: list(itertools.islice(rows, self.chunk_size)), []):
+            self.connection.executemany("INSERT INTO rows VALUES (?, ?, ?)", chunk)
+        self.connection.commit()
+
+    def read_entities(self):
+        cursor = self.connection.execute("SELECT entity, indexes, value FROM rows ORDER BY entity, rowid")
+        for entity, entity_rows in itertools.groupby(cursor, key=lambda row: row[0]):
+            yield tuple(json.loads(entity)), [(tuple(json.loads(indexes)), value) for _, indexes, value in entity_rows]
+
+    def close(self):
+        self.connection.close()
+
+class ResultWriter:
+    """Writes result parameter values to a Spine database in chunks of chunk_size values.
+
+    With entity_classes (source class -> target class) the results are written to the target classes and only for
+    entities that exist there, otherwise missing entity classes and entities are added. Parameter definitions are added
+    when missing.
+
+    Only the values of the chunk being written are kept in the mapping. Checking a new value against the database
+    would make the mapping fetch all parameter values, so the values of the entities that already had values in the
+    alternative are fetched for the chunk, existing values are updated and the others are added without the check.
+    """
+    def __init__(self, url_db, alternative, chunk_size, entity_classes=None):
+        self.db = DatabaseMapping(url_db)
+        self.alternative = alternative
+        self.chunk_size = chunk_size
+        self.entity_classes = entity_classes
+        self._items = []
+        self._entities = {}
+        self._definitions = {}
+        self.db.add_update_item("alternative", name=alternative)
+        self._alternative_id = self.db.get_alternative_item(name=alternative)["id"]
+        with self.db:
+            value_sq, alternative_sq = self.db.parameter_value_sq, self.db.alternative_sq
+            self._entities_with_values = {entity_id for entity_id, in self.db.query(value_sq.c.entity_id).filter(
+                value_sq.c.alternative_id == alternative_sq.c.id, alternative_sq.c.name == alternative).distinct()}
+
+    def add_result(self, variable, class_name, elements, value):
+        if self.entity_classes is not None:
+            if class_name not in self.entity_classes:
+                return
+            class_name = self.entity_classes[class_name]
+            entity_byname = ("__".join(elements),)
+            if entity_byname not in self.entities(class_name):
+                return
+            if isinstance(value, api.Map) and value.index_name == "YEAR":
+                value = api.Map(value.indexes, value.values, index_name="period")
+        else:
+            entity_byname = elements
+            self.add_entity(class_name, entity_byname)
+        p_value, p_type = api.to_database(value)
+        self._items.append({"entity_class_name": class_name, "entity_byname": entity_byname,
+                            "parameter_definition_name": variable, "alternative_name": self.alternative,
+                            "entity_id": self.entities(class_name)[entity_byname],
+                            "parameter_definition_id": self.definition_id(class_name, variable),
+                            "value": p_value, "type": p_type})
+        if len(self._items) >= self.chunk_size:
+            self.flush()
+
+    def entities(self, class_name):
+        # entity_byname -> id of the entities of the class
+        if class_name not in self._entities:
+            self._entities[class_name] = {tuple(entity["entity_byname"]): entity["id"] for entity in self.db.get_entity_items(entity_class_name=class_name)}
+        return self._entities[class_name]
+
+    def definition_id(self, class_name, variable):
+        if (class_name, variable) not in self._definitions:
+            self.db.add_update_item("parameter_definition", entity_class_name=class_name, name=variable)
+            definition = self.db.get_parameter_definition_item(entity_class_name=class_name, name=variable)
+            self._definitions[(class_name, variable)] = definition["id"], definition["entity_class_id"]
+        return self._definitions[(class_name, variable)]
+
+    def add_entity(self, class_name, entity_byname):
+        if class_name not in self._entities and not self.db.get_entity_class_item(name=class_name):
+            dimensions = class_name.split("__")
+            for dimension in dimensions:
+                if len(dimensions) > 1 and not self.db.get_entity_class_item(name=dimension):
+                    self.db.add_entity_class_item(name=dimension)
+            self.db.add_entity_class_item(name=class_name, dimension_name_list=dimensions if len(dimensions) > 1 else ())
+        entities = self.entities(class_name)
+        if entity_byname not in entities:
+            if len(entity_byname) > 1:
+                for dimension, element in zip(class_name.split("__"), entity_byname):
+                    self.add_entity(dimension, (element,))
+                entity, _ = self.db.add_entity_item(entity_class_name=class_name, element_name_list=entity_byname)
+            else:
+                entity, _ = self.db.add_entity_item(entity_class_name=class_name, name=entity_byname[0])
+            entities[entity_byname] = entity["id"]
+
+    def flush(self):
+        if not self._items:
+            return
+        for entity_id in {item["entity_id"] for item in self._items}:
+            if entity_id.db_id in self._entities_with_values:
+                self.db.get_items("parameter_value", entity_id=entity_id, alternative_id=self._alternative_id)
+        errors = []
+        for item in self._items:
+            definition_id, class_id = item["parameter_definition_id"]
+            existing = self.db.get_item("parameter_value", fetch=False, entity_class_name=item["entity_class_name"],
+                                        entity_byname=item["entity_byname"], parameter_definition_name=item["parameter_definition_name"],
+                                        alternative_name=self.alternative)
+            if existing:
+                _, error = self.db.update_item("parameter_value", id=existing["id"], value=item["value"], type=item["type"])
+            else:
+                _, error = self.db.add_item("parameter_value", check=False, entity_class_id=class_id, entity_id=item["entity_id"],
+                                            parameter_definition_id=definition_id, alternative_id=self._alternative_id,
+                                            value=item["value"], type=item["type"])
+            if error:
+                errors.append(error)
+        if errors:
+            print(f"{len(errors)} result values could not be written, first: {errors[0]}")
+        self.commit()
+        self._items = []
+        # The committed values are not needed anymore, only the entity and parameter definition lookups are kept
+        self.db.reset("parameter_value")
+
+    def commit(self):
+        # Results that are already in the database as they are do not change anything
+        try:
+            self.db.commit_session("Added OSeMOSYS results")
+        except NothingToCommit:
+            pass
+
+    def close(self):
+        self.flush()
+        self.commit()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("Please provide the settings yaml file and the url of the OSeMOSYS Spine database, optionally the url of the ines database")
+    with open(sys.argv[1], 'r') as yaml_file:
+        settings = yaml.safe_load(yaml_file)
+    read_solution(settings, sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
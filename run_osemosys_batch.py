@@ -0,0 +1,126 @@
+import subprocess
+import sys
+import os
+import signal
+import json
+import time
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from spinedb_api import DatabaseMapping
+from spinedb_api.filters.scenario_filter import scenario_filter_config
+from spinedb_api.filters.tools import append_filter_config
+
+# Writes and solves the OSeMOSYS model of several scenarios of a Spine database in parallel.
+# Each scenario gets a working directory under batch_directory with its own settings, param_dimens.yaml, .dat, solution,
+# result files and log, so that the parallel runs do not write the same files.
+# Usage: python run_osemosys_batch.py settings_OSeMOSYS.yaml url_db model_code_file [scenario ...]
+# Without scenarios all scenarios of the database are run.
+
+def run_batch(settings, url_db, code_file, scenarios):
+    batch_directory = Path(settings.get("batch_directory") or "batch_runs").resolve()
+    batch_directory.mkdir(parents=True, exist_ok=True)
+    workers = batch_workers(settings, len(scenarios))
+    print(f"Running {len(scenarios)} scenarios with {workers} parallel runs")
+    # The runs are child processes, the threads only start them and wait
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        runs = list(executor.map(lambda scenario: run_scenario(settings, url_db, code_file, scenario, batch_directory), scenarios))
+    report = {"url_db": url_db,
+              "succeeded": sum(run["status"] == "ok" for run in runs),
+              "failed": sum(run["status"] != "ok" for run in runs),
+              "runs": runs}
+    with open(batch_directory / "batch_report.json", 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"{'scenario':<30}{'status':>10}{'attempts':>10}{'seconds':>10}")
+    for run in runs:
+        print(f"{run['scenario']:<30}{run['status']:>10}{run['attempts']:>10}{run['seconds']:>10.1f}")
+    print(f"{report['succeeded']} succeeded, {report['failed']} failed, report in {batch_directory / 'batch_report.json'}")
+    return report
+
+def run_scenario(settings, url_db, code_file, scenario, batch_directory):
+    run_directory = batch_directory / scenario
+    run_directory.mkdir(parents=True, exist_ok=True)
+    run_settings = dict(settings)
+    run_settings["new_model_name"] = str(run_directory / Path(settings["new_model_name"]).name)
+    run_settings["solution_file"] = str(run_directory / Path(settings["solution_file"]).name)
+    settings_file = run_directory / "settings_OSeMOSYS.yaml"
+    with open(settings_file, 'w') as yaml_file:
+        yaml.safe_dump(run_settings, yaml_file)
+    scenario_url = append_filter_config(url_db, scenario_filter_config(scenario))
+    steps = scenario_steps(settings_file, scenario_url, code_file, run_directory)
+    timeout = settings.get("batch_timeout") or None
+    retries = int(settings.get("batch_retries") or 0)
+    run = {"scenario": scenario, "directory": str(run_directory), "status": "ok", "attempts": 0, "seconds": 0.0, "steps": {}}
+    start = time.perf_counter()
+    with open(run_directory / "run.log", 'w') as log_file:
+        for step, cmd in steps:
+            for attempt in range(retries + 1):
+                run["attempts"] += 1
+                status, returncode = run_step(cmd, run_directory, log_file, timeout)
+                run["steps"][step] = {"status": status, "returncode": returncode, "attempts": attempt + 1}
+                if status == "ok":
+                    break
+                log_file.write(f"{step} {status} (return code {returncode}), attempt {attempt + 1} of {retries + 1}\n")
+                log_file.flush()
+            if status != "ok":
+                run["status"] = status
+                run["failed_step"] = step
+                break
+    run["seconds"] = round(time.perf_counter() - start, 3)
+    return run
+
+def scenario_steps(settings_file, scenario_url, code_file, run_directory):
+    # write_osemosys.py writes the model structure to the param_dimens.yaml of the run instead of the shared one next to it
+    directory = Path(__file__).parent
+    return [("write", [sys.executable, str(directory / "write_osemosys.py"), str(settings_file), scenario_url, str(code_file),
+                       str(run_directory / "param_dimens.yaml")]),
+            ("solve", [sys.executable, str(directory / "run_osemosys_python_wrapper.py"), str(settings_file)])]
+
+def run_step(cmd, run_directory, log_file, timeout):
+    # The step runs in its own process group so that a timeout also stops the solver started by the step
+    process = subprocess.Popen(cmd, cwd=run_directory, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        process.wait()
+        return "timeout", None
+    return ("ok" if returncode == 0 else "failed"), returncode
+
+def batch_workers(settings, scenario_count):
+    # batch_workers from the settings, otherwise as many as there are cores and memory for batch_memory_per_run_gb
+    workers = int(settings.get("batch_workers") or 0)
+    if not workers:
+        workers = os.cpu_count() or 1
+        memory_per_run = float(settings.get("batch_memory_per_run_gb") or 0) * 1024 ** 3
+        if memory_per_run and hasattr(os, "sysconf"):
+            try:
+                available_memory = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+                workers = min(workers, max(1, int(available_memory // memory_per_run)))
+            except (ValueError, OSError):
+                pass
+    return max(1, min(workers, scenario_count))
+
+def database_scenarios(url_db):
+    with DatabaseMapping(url_db) as db:
+        return [scenario["name"] for scenario in db.get_scenario_items()]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        sys.exit("Please provide the settings yaml file, the url of the OSeMOSYS Spine database and the osemosys code file as arguments, optionally followed by scenario names")
+    with open(sys.argv[1], 'r') as yaml_file:
+        settings = yaml.safe_load(yaml_file)
+    url_db = sys.argv[2]
+    if url_db.startswith("sqlite:///") and not Path(url_db[len("sqlite:///"):]).is_absolute():
+        # The runs work in their own directories
+        url_db = "sqlite:///" + str(Path(url_db[len("sqlite:///"):]).resolve())
+    code_file = Path(sys.argv[3]).resolve()
+    scenarios = sys.argv[4:] or database_scenarios(url_db)
+    if not scenarios:
+        sys.exit("No scenarios to run")
+    report = run_batch(settings, url_db, code_file, scenarios)
+    if report["failed"]:
+        sys.exit(1)
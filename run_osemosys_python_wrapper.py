@@ -1,18 +1,234 @@
 import subprocess
 import sys
+import os
+import re
+import json
+import hashlib
+import time
+import shutil
 import logging
 import yaml
 from pathlib import Path
 
-def run_osemosys(modelfile, infile, outfile):
+def run_osemosys(modelfile, infile, outfile, solver_settings=None):
     logger = logging.getLogger(__name__)
     directory = Path(__file__).parent
-    glpsol_dir = directory / "glpsol_files"
-    glpsol_cmd = [str(glpsol_dir / "glpsol.exe"), '-m', str(directory / "mathprog_files" / modelfile), '-d',  str(directory / infile), '--cbg','-w', str(directory / outfile)]
-    completed = subprocess.run(glpsol_cmd)
-    if completed.returncode != 0:
-        logger.error(f'{completed.returncode}')
-        sys.exit(completed.returncode)
+    solver_settings = solver_settings or {}
+    solver = solver_settings.get("solver") or "glpsol"
+    if solver not in solver_backends:
+        logger.error(f'Unknown solver {solver}, use one of: {", ".join(solver_backends)}')
+        sys.exit(1)
+    model_path = directory / "mathprog_files" / modelfile
+    data_path = directory / infile
+    solution_path = directory / outfile
+    # The run report (time, phases, iterations, memory and CPU of each solver command) is written next to the solution file
+    run_report["solver"] = solver
+    run_report["steps"] = []
+    start = time.perf_counter()
+    try:
+        solver_backends[solver](model_path, data_path, solution_path, solver_settings)
+    finally:
+        run_report["seconds"] = round(time.perf_counter() - start, 3)
+        with open(solution_path.with_suffix(".run.json"), 'w') as report_file:
+            json.dump(run_report, report_file, indent=2)
+
+def solve_with_glpsol(model_path, data_path, solution_path, solver_settings):
+    glpsol_cmd = [glpsol_executable(solver_settings), '-m', str(model_path), '-d', str(data_path), '--cbg', '-w', str(solution_path)]
+    run_solver_command(glpsol_cmd)
+
+def solve_with_highs(model_path, data_path, solution_path, solver_settings):
+    # glpsol only generates the matrix, HiGHS solves it and writes the solution in the glpsol raw format.
+    # With postprocess_results glpsol then reads the solution back (-r) to run the post-processing statements
+    # of the model (result files), which translates the model again. It defaults to false with matrix_cache,
+    # otherwise the generation the cache saves would run anyway.
+    matrix_path = generate_matrix(model_path, data_path, solution_path, solver_settings)
+    options_path = solution_path.with_suffix(".highs_options.txt")
+    options = {"threads": solver_threads(solver_settings), "write_solution_style": 2}
+    options.update(solver_settings.get("solver_options") or {})
+    with open(options_path, 'w') as options_file:
+        for name, value in options.items():
+            options_file.write(f"{name} = {value}\n")
+    highs_cmd = [solver_executable(solver_settings, "highs"), '--model_file', str(matrix_path),
+                 '--options_file', str(options_path), '--solution_file', str(solution_path)]
+    run_solver_command(highs_cmd)
+    postprocess_results = solver_settings.get("postprocess_results")
+    if postprocess_results is None:
+        postprocess_results = not solver_settings.get("matrix_cache")
+    # Whether glpsol translated the model again after the solve
+    run_report["model_generated_again"] = bool(postprocess_results)
+    if postprocess_results:
+        if run_report.get("matrix_cache", {}).get("hit"):
+            print("The matrix was cached, but post-processing the results translates the model again")
+        glpsol_cmd = [glpsol_executable(solver_settings), '-m', str(model_path), '-d', str(data_path), '-r', str(solution_path)]
+        run_solver_command(glpsol_cmd)
+
+def solve_with_cbc(model_path, data_path, solution_path, solver_settings):
+    # The solution is written in the CBC format, the post-processing statements of the model are not run.
+    matrix_path = generate_matrix(model_path, data_path, solution_path, solver_settings)
+    cbc_cmd = [solver_executable(solver_settings, "cbc"), str(matrix_path), '-threads', str(solver_threads(solver_settings))]
+    for name, value in (solver_settings.get("solver_options") or {}).items():
+        cbc_cmd += ['-' + name, str(value)]
+    cbc_cmd += ['-solve', '-solu', str(solution_path)]
+    run_solver_command(cbc_cmd)
+
+def generate_matrix(model_path, data_path, solution_path, solver_settings):
+    # Translates the model and data to a free MPS file without solving (glpsol --check).
+    # With matrix_cache the file is kept in matrix_cache_directory under the hash of the model and data files
+    # and the translation is skipped when the same model and data are solved again.
+    if not solver_settings.get("matrix_cache"):
+        matrix_path = solution_path.with_suffix(".mps")
+        write_matrix(model_path, data_path, matrix_path, solver_settings)
+        return matrix_path
+    cache_directory = Path(solver_settings.get("matrix_cache_directory") or Path(__file__).parent / "matrix_cache")
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    matrix_path = cache_directory / (file_hash(model_path, data_path) + ".mps")
+    if matrix_path.exists():
+        os.utime(matrix_path)
+        run_report["matrix_cache"] = {"hit": True, "file": str(matrix_path)}
+        print(f"Using the cached matrix {matrix_path}")
+        return matrix_path
+    temporary_path = matrix_path.with_suffix(f".{os.getpid()}.tmp")
+    write_matrix(model_path, data_path, temporary_path, solver_settings)
+    os.replace(temporary_path, matrix_path)
+    run_report["matrix_cache"] = {"hit": False, "file": str(matrix_path)}
+    evict_matrices(cache_directory, float(solver_settings.get("matrix_cache_size_gb") or 0) * 1024 ** 3, matrix_path)
+    return matrix_path
+
+def write_matrix(model_path, data_path, matrix_path, solver_settings):
+    glpsol_cmd = [glpsol_executable(solver_settings), '--check', '-m', str(model_path), '-d', str(data_path), '--wfreemps', str(matrix_path)]
+    run_solver_command(glpsol_cmd)
+
+def file_hash(*paths):
+    # sha256 of the file contents (and glpsol arguments of the matrix), read in blocks
+    file_digest = hashlib.sha256(b"glpsol --check --wfreemps\n")
+    for path in paths:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                file_digest.update(block)
+        file_digest.update(b"\0")
+    return file_digest.hexdigest()
+
+def evict_matrices(cache_directory, max_size, keep_path):
+    # Removes the least recently used matrices until the cache is at most max_size bytes, no limit if max_size is 0
+    if not max_size:
+        return
+    matrices = sorted(cache_directory.glob("*.mps"), key=lambda path: path.stat().st_mtime)
+    cache_size = sum(path.stat().st_size for path in matrices)
+    for path in matrices:
+        if cache_size <= max_size:
+            break
+        if path == keep_path:
+            continue
+        cache_size -= path.stat().st_size
+        path.unlink(missing_ok=True)
+
+def run_solver_command(cmd):
+    # Streams the solver output and records its phases, iterations and resource use in the run report
+    logger = logging.getLogger(__name__)
+    monitor = SolverOutputMonitor()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    for line in process.stdout:
+        sys.stdout.write(line)
+        monitor.parse(line)
+    returncode, resource_usage = wait_with_resource_usage(process)
+    step = {"command": cmd, "returncode": returncode}
+    step.update(monitor.report())
+    step.update(resource_usage)
+    run_report["steps"].append(step)
+    if returncode != 0:
+        logger.error(f'{Path(cmd[0]).name}: {returncode}')
+        sys.exit(returncode)
+
+def wait_with_resource_usage(process):
+    # Peak memory and CPU time of the finished child from wait4, where available
+    if not hasattr(os, "wait4"):
+        return process.wait(), {}
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss_bytes = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return process.returncode, {"peak_rss_mb": round(peak_rss_bytes / 1024 ** 2, 1),
+                                "cpu_user_seconds": round(rusage.ru_utime, 3),
+                                "cpu_system_seconds": round(rusage.ru_stime, 3)}
+
+class SolverOutputMonitor:
+    """Follows the glpsol or HiGHS output line by line.
+
+    The time from the start of the command to the first line of each phase is recorded, as well as the last
+    simplex or MIP iteration number, the solution status and the time and memory glpsol reports.
+    """
+    phase_markers = [
+        ("reading model", "Reading model section"),
+        ("generating model", "Generating "),
+        ("model generated", "Model has been successfully generated"),
+        ("writing matrix", "Writing problem data to"),
+        ("presolve", "Preprocessing"),
+        ("presolve", "Presolving model"),
+        ("simplex", "GLPK Simplex Optimizer"),
+        ("simplex", "Solving the presolved LP"),
+        ("interior point", "GLPK Interior-Point Optimizer"),
+        ("mip", "GLPK Integer Optimizer"),
+        ("mip", "Solving MIP model with"),
+        ("writing solution", "Writing basic solution to"),
+        ("writing solution", "Writing MIP solution to"),
+        ("writing solution", "Writing interior-point solution to"),
+        ("post-processing", "Reading solution from"),
+        ("model processed", "Model has been successfully processed"),
+    ]
+    iteration_patterns = [re.compile(r'^[ *]\s*(\d+): obj ='), re.compile(r'^\+\s*(\d+): mip ='),
+                          re.compile(r'^\s*(\d+)\s+-?\d[\d.e+-]*\s+(?:Pr|Du|Ph)')]
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.iterations = None
+        self.status = None
+        self.glpk_time_used = None
+        self.glpk_memory_used = None
+
+    def parse(self, line):
+        for phase, marker in self.phase_markers:
+            if phase not in self.phases and marker in line:
+                self.phases[phase] = round(time.perf_counter() - self.start, 3)
+        for pattern in self.iteration_patterns:
+            match = pattern.match(line)
+            if match:
+                self.iterations = int(match.group(1))
+        if "SOLUTION" in line and line.isupper() or line.startswith("Model status"):
+            self.status = line.split(":", 1)[-1].strip()
+        elif line.startswith(("Simplex", "IPM")) and "iterations:" in line:
+            self.iterations = int(line.split(":", 1)[1].split()[0])
+        elif line.startswith("Time used:"):
+            self.glpk_time_used = float(line.split()[2])
+        elif line.startswith("Memory used:"):
+            self.glpk_memory_used = line.split(":", 1)[1].strip()
+
+    def report(self):
+        return {"seconds": round(time.perf_counter() - self.start, 3), "phases": self.phases, "iterations": self.iterations,
+                "status": self.status, "glpk_time_used": self.glpk_time_used, "glpk_memory_used": self.glpk_memory_used}
+
+def glpsol_executable(solver_settings):
+    # glpsol_path from the settings, then the bundled glpsol on Windows and glpsol on the PATH elsewhere
+    if solver_settings.get("glpsol_path"):
+        return str(solver_settings["glpsol_path"])
+    if os.name == "nt":
+        return str(Path(__file__).parent / "glpsol_files" / "glpsol.exe")
+    glpsol = shutil.which("glpsol")
+    if glpsol:
+        return glpsol
+    sys.exit("glpsol not found, install GLPK (e.g. apt install glpk-utils) or set glpsol_path in the settings")
+
+def solver_executable(solver_settings, solver):
+    executable = solver_settings.get("solver_path") or shutil.which(solver)
+    if not executable:
+        sys.exit(f"{solver} not found, install it or set solver_path in the settings")
+    return str(executable)
+
+def solver_threads(solver_settings):
+    return int(solver_settings.get("solver_threads") or os.cpu_count() or 1)
+
+solver_backends = {"glpsol": solve_with_glpsol, "highs": solve_with_highs, "cbc": solve_with_cbc}
+run_report = {}
 
 if __name__ == "__main__":
     with open(sys.argv[1], 'r') as yaml_file:
@@ -20,4 +236,4 @@ if __name__ == "__main__":
     modelfile = settings["model_code"]
     infile = settings["new_model_name"]
     outfile = settings["solution_file"]
-    run_osemosys(modelfile, infile, outfile)
\ No newline at end of file
+    run_osemosys(modelfile, infile, outfile, settings)
@@ -0,0 +1,97 @@
+import spinedb_api as api
+from spinedb_api import DatabaseMapping
+from pathlib import Path
+import importlib.util
+import re
+import shutil
+import subprocess
+import sys
+import pytest
+import yaml
+
+# Runs the incremental conversion of osemosys_to_ines.py on a tiny synthetic OSeMOSYS database into the shipped ines-spec.
+# usage: python -m pytest tests (needs ines-tools, installed or as a parallel folder)
+
+osemosys_to_ines_folder = Path(__file__).parent.parent / "ines-osemosys"
+sys.path.insert(0, str(osemosys_to_ines_folder))
+from benchmark_osemosys_to_ines import create_source_db, write_timeslice_csv, scales
+
+ines_tools_found = (importlib.util.find_spec("ines_tools") is not None
+                    or (osemosys_to_ines_folder.parent.parent / "ines-tools" / "ines_tools").exists())
+pytestmark = pytest.mark.skipif(not ines_tools_found, reason="ines-tools is not installed")
+
+
+@pytest.fixture
+def conversion_files(tmp_path):
+    with open(osemosys_to_ines_folder / "settings.yaml", 'r') as file:
+        settings = yaml.safe_load(file)
+    with open(osemosys_to_ines_folder.parent / "param_dimens.yaml", 'r') as file:
+        param_dimens = yaml.safe_load(file)
+    settings.update({"incremental": True, "incremental_state_file": str(tmp_path / "fingerprints.json"), "timeslice_cache": False})
+    settings_file = tmp_path / "settings.yaml"
+    with open(settings_file, 'w') as file:
+        yaml.safe_dump(settings, file)
+    source_file = tmp_path / "osemosys_source.sqlite"
+    create_source_db("sqlite:///" + str(source_file), param_dimens, scales["tiny"], settings["default_alternative"])
+    timeslice_csv = tmp_path / "timeslices_to_time.csv"
+    write_timeslice_csv(timeslice_csv, scales["tiny"]["timeslices"])
+    target_file = tmp_path / "ines_target.sqlite"
+    shutil.copy(osemosys_to_ines_folder.parent / "ines-spec.sqlite", target_file)
+    return source_file, target_file, settings_file, timeslice_csv
+
+
+def convert(source_file, target_file, settings_file, timeslice_csv):
+    completed = subprocess.run([sys.executable, str(osemosys_to_ines_folder / "osemosys_to_ines.py"),
+                                "sqlite:///" + str(source_file), "sqlite:///" + str(target_file), str(settings_file), str(timeslice_csv)],
+                               cwd=osemosys_to_ines_folder, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stdout + completed.stderr
+    return completed.stdout
+
+
+def target_content(target_file):
+    with DatabaseMapping("sqlite:///" + str(target_file)) as db:
+        return {
+            "alternatives": {alternative["name"] for alternative in db.get_alternative_items()},
+            "entities": {(entity["entity_class_name"], tuple(entity["entity_byname"])) for entity in db.get_entity_items()},
+            "entity_alternatives": {(item["entity_class_name"], tuple(item["entity_byname"]), item["alternative_name"], item["active"])
+                                    for item in db.get_entity_alternative_items()},
+            "parameter_values": {(item["entity_class_name"], tuple(item["entity_byname"]), item["parameter_definition_name"],
+                                  item["alternative_name"]): (item["type"], bytes(item["value"]))
+                                 for item in db.get_parameter_value_items()},
+        }
+
+
+def test_second_run_writes_nothing(conversion_files):
+    source_file, target_file, settings_file, timeslice_csv = conversion_files
+    output = convert(*conversion_files)
+    assert "Incremental conversion added" in output
+    assert target_content(target_file)["parameter_values"]
+    converted = target_file.read_bytes()
+    output = convert(*conversion_files)
+    assert "nothing to do" in output
+    assert target_file.read_bytes() == converted
+
+
+def test_changed_source_gives_the_full_conversion(conversion_files, tmp_path):
+    source_file, target_file, settings_file, timeslice_csv = conversion_files
+    convert(*conversion_files)
+    with DatabaseMapping("sqlite:///" + str(source_file)) as db:
+        capital_cost = db.get_parameter_value_items(entity_class_name="REGION__TECHNOLOGY", parameter_definition_name="CapitalCost")[0]
+        value = api.from_database(capital_cost["value"], capital_cost["type"])
+        value, value_type = api.to_database(api.Map(value.indexes, [2 * x for x in value.values], index_name=value.index_name))
+        db.update_item("parameter_value", id=capital_cost["id"], value=value, type=value_type)
+        db.commit_session("Doubled one capital cost")
+    output = convert(*conversion_files)
+    assert "1 source entity classes or parameters changed" in output
+    stages_run, stage_count = re.search(r"running (\d+) of (\d+) stages", output).groups()
+    assert int(stages_run) < int(stage_count)
+    full_target_file = tmp_path / "ines_full.sqlite"
+    shutil.copy(osemosys_to_ines_folder.parent / "ines-spec.sqlite", full_target_file)
+    full_settings_file = tmp_path / "settings_full.yaml"
+    with open(settings_file, 'r') as file:
+        settings = yaml.safe_load(file)
+    settings["incremental"] = False
+    with open(full_settings_file, 'w') as file:
+        yaml.safe_dump(settings, file)
+    convert(source_file, full_target_file, full_settings_file, timeslice_csv)
+    assert target_content(target_file) == target_content(full_target_file)
@@ -0,0 +1,37 @@
+from pathlib import Path
+import sys
+import spinedb_api as api
+from spinedb_api import DatabaseMapping
+
+# read_glpsol_solution.py must not keep the results it has written in memory.
+# usage: python -m pytest tests
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from read_glpsol_solution import ResultWriter
+
+
+def write_results(url, chunk_size, value_count, offset):
+    writer = ResultWriter(url, "results", chunk_size)
+    mapped_values = []
+    for i in range(value_count):
+        value = api.Map(["2020", "2021"], [float(i), float(i + offset)], index_name="YEAR")
+        writer.add_result("NewCapacity", "REGION__TECHNOLOGY", ("R1", f"T{i}"), value)
+        mapped_values.append(len(writer.db.get_parameter_value_items(fetch=False)))
+    writer.close()
+    writer.db.close()
+    return mapped_values
+
+
+def test_written_chunks_are_released(tmp_path):
+    url = "sqlite:///" + str(tmp_path / "results.sqlite")
+    DatabaseMapping(url, create=True).close()
+    chunk_size = 10
+    # A new database and a rerun that updates the values already there
+    for offset in (1, 2):
+        mapped_values = write_results(url, chunk_size, 5 * chunk_size, offset)
+        assert max(mapped_values) <= chunk_size
+    with DatabaseMapping(url) as db:
+        values = db.get_parameter_value_items(parameter_definition_name="NewCapacity", alternative_name="results")
+        assert len(values) == 5 * chunk_size
+        value = next(value for value in values if value["entity_byname"] == ("R1", "T7"))
+        assert list(api.from_database(value["value"], value["type"]).values) == [7.0, 9.0]
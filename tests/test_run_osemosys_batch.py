@@ -0,0 +1,24 @@
+from pathlib import Path
+import sys
+
+# The parallel scenario runs of run_osemosys_batch.py must not share the files write_osemosys.py writes.
+# usage: python -m pytest tests
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from run_osemosys_batch import scenario_steps
+
+
+def test_parallel_runs_write_their_own_param_dimens(tmp_path):
+    param_dimens_files = []
+    for scenario in ("base", "high_demand"):
+        run_directory = tmp_path / scenario
+        steps = dict(scenario_steps(run_directory / "settings_OSeMOSYS.yaml", "sqlite:///db.sqlite", tmp_path / "model.mod", run_directory))
+        write_cmd = steps["write"]
+        assert Path(write_cmd[1]).name == "write_osemosys.py"
+        # settings, url, code file and the param_dimens.yaml of the run
+        assert len(write_cmd) == 6
+        param_dimens_file = Path(write_cmd[5])
+        assert param_dimens_file.parent == run_directory
+        param_dimens_files.append(param_dimens_file)
+    assert param_dimens_files[0] != param_dimens_files[1]
+    assert Path(__file__).parent.parent / "param_dimens.yaml" not in param_dimens_files
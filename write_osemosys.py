@@ -18,7 +18,8 @@ if __name__ == "__main__":
     if len(sys.argv) < 3:
         sys.exit("You need to provide the osemosys code as the third argument")
     code_file_name = sys.argv[3]
-    param_dimens_file = str(Path(__file__).parent / 'param_dimens.yaml')
+    # The model structure is written to param_dimens.yaml and read back. Parallel runs (run_osemosys_batch.py) give their own file as the fourth argument.
+    param_dimens_file = sys.argv[4] if len(sys.argv) > 4 else str(Path(__file__).parent / 'param_dimens.yaml')
 
     read_mathprog_structure(settings, url_db, code_file_name, param_dimens_file, write_to_db=False)
     print("Added model structure")